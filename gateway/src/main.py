@@ -0,0 +1,284 @@
+from fastapi import APIRouter, FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
+from urllib.parse import parse_qsl
+import logging
+import asyncio
+import os
+from typing import Dict, Optional, Set, Tuple
+import httpx
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from .services.backends import Backend, BackendPool
+from .services.metrics import ROUTED_REQUESTS, UPSTREAM_ERRORS
+from .services.routing import AffinityMap, generation_id, routing_key
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Not forwarded in either direction
+HOP_BY_HOP = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailers",
+    "transfer-encoding",
+    "upgrade",
+    "host"
+}
+
+# Bodies up to this size are read up front: they can be routed on, retried
+# on another backend, and the client watched for disconnects meanwhile
+MAX_BUFFERED_BODY = int(os.getenv("GATEWAY_MAX_BUFFERED_BODY", str(1024 * 1024)))
+
+# Progress and previews are per replica; poll the one running your generation
+PER_NODE_PATHS = ("/generate/progress", "/generate/preview")
+
+class ClientDisconnected(Exception):
+    pass
+
+router = APIRouter()
+
+def _forward_headers(request: Request) -> Dict[str, str]:
+    headers = {
+        name: value for name, value in request.headers.items()
+        if name.lower() not in HOP_BY_HOP and name.lower() != "x-generation-prefix"
+    }
+    client_host = request.client.host if request.client else None
+    if client_host:
+        # Backends trusting the gateway keep per-client fairness (uvicorn FORWARDED_ALLOW_IPS)
+        forwarded = request.headers.get("x-forwarded-for")
+        headers["x-forwarded-for"] = f"{forwarded}, {client_host}" if forwarded else client_host
+    headers["x-forwarded-proto"] = request.url.scheme
+    return headers
+
+async def _read_form(request: Request, body: bytes) -> Dict[str, str]:
+    """Text fields of a buffered form body, for routing only"""
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        return dict(parse_qsl(body.decode("latin-1")))
+    if content_type.startswith("multipart/form-data"):
+        try:
+            form = await request.form()
+        except Exception as e:
+            logger.warning(f"Could not parse form for routing: {str(e)}")
+            return {}
+        return {name: value for name, value in form.items() if isinstance(value, str)}
+    return {}
+
+async def _wait_for_disconnect(request: Request) -> None:
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+async def _send(client: httpx.AsyncClient, upstream_request: httpx.Request, request: Request, watch: bool) -> httpx.Response:
+    """Send upstream; with a buffered body, give up if the client leaves first
+
+    Generations only answer once the image is done, so closing the
+    upstream connection is how a disconnect reaches the backend.
+    """
+    if not watch:
+        return await client.send(upstream_request, stream=True)
+    send = asyncio.create_task(client.send(upstream_request, stream=True))
+    disconnect = asyncio.create_task(_wait_for_disconnect(request))
+    try:
+        await asyncio.wait({send, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnect.cancel()
+    if not send.done():
+        send.cancel()
+        raise ClientDisconnected()
+    return send.result()
+
+def _choose(
+    request: Request,
+    path: str,
+    key: Optional[str],
+    key_source: str,
+    tried: Set[str]
+) -> Tuple[Optional[Backend], str]:
+    """Backend for a request and what picked it"""
+    pool: BackendPool = request.app.state.pool
+    client_host = request.client.host if request.client else "unknown"
+
+    # State that lives on one replica goes back to that replica
+    generation = generation_id(path)
+    if generation is not None:
+        backend = pool.owner(generation)
+        if backend is not None and backend.url not in tried:
+            return backend, "prefix"
+        backend = pool.get(request.app.state.generations.get(generation))
+        if backend is not None and backend.url not in tried:
+            return backend, "affinity"
+        backend, _ = pool.choose(f"generation:{generation}", exclude=tried)
+        return backend, "hash"
+    if path in PER_NODE_PATHS:
+        backend = pool.get(request.app.state.clients.get(client_host))
+        if backend is not None and backend.url not in tried:
+            return backend, "affinity"
+
+    backend, spilled = pool.choose(key, exclude=tried)
+    if key is None:
+        return backend, "least_loaded"
+    return backend, f"{key_source}_spill" if spilled else key_source
+
+def _remember(request: Request, path: str, backend: Backend, upstream: httpx.Response) -> None:
+    generation = upstream.headers.get("x-generation-id")
+    if generation:
+        request.app.state.generations.set(generation, backend.url)
+    if path.startswith("/generate"):
+        client_host = request.client.host if request.client else "unknown"
+        request.app.state.clients.set(client_host, backend.url)
+
+async def _finish(upstream: httpx.Response, pool: BackendPool, backend: Backend) -> None:
+    await upstream.aclose()
+    pool.release(backend)
+
+@router.get("/health")
+async def health_check(request: Request):
+    pool: BackendPool = request.app.state.pool
+    healthy = sum(1 for backend in pool.backends.values() if backend.healthy)
+    status = "healthy" if healthy == len(pool.backends) else "degraded" if healthy else "unavailable"
+    return JSONResponse(
+        status_code=200 if healthy else 503,
+        content={"status": status, "backends": len(pool.backends), "healthy_backends": healthy}
+    )
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheus metrics"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@router.get("/backends")
+async def list_backends(request: Request):
+    """Health, open requests and scheduler queue depth per backend"""
+    return request.app.state.pool.snapshot()
+
+@router.api_route("/{path:path}", methods=["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"])
+async def proxy(request: Request, path: str):
+    pool: BackendPool = request.app.state.pool
+    client: httpx.AsyncClient = request.app.state.client
+    path = request.url.path
+
+    content_length = request.headers.get("content-length")
+    if content_length is not None and not content_length.strip().isdigit():
+        return JSONResponse(status_code=400, content={"detail": "Malformed Content-Length"})
+    buffered = request.method in ("GET", "HEAD", "DELETE", "OPTIONS") or (
+        content_length is not None and int(content_length) <= MAX_BUFFERED_BODY
+    )
+    body = await request.body() if buffered else None
+    form = await _read_form(request, body) if body and path == "/generate" else {}
+    key, key_source = routing_key(request.headers, request.query_params, form)
+
+    target = path + (f"?{request.url.query}" if request.url.query else "")
+    headers = _forward_headers(request)
+    tried: Set[str] = set()
+
+    # A request that never reached a backend is safe to send to the next one
+    while True:
+        backend, route = _choose(request, path, key, key_source, tried)
+        if backend is None:
+            return JSONResponse(status_code=503, content={"detail": "No healthy icon-service backend"})
+        tried.add(backend.url)
+
+        upstream_request = client.build_request(
+            request.method,
+            backend.url + target,
+            # Ids the backend mints start with its prefix (see BackendPool.owner)
+            headers={**headers, "x-generation-prefix": backend.prefix},
+            content=body if buffered else request.stream()
+        )
+        pool.acquire(backend)
+        try:
+            upstream = await _send(client, upstream_request, request, watch=buffered)
+        except ClientDisconnected:
+            pool.release(backend)
+            return Response(status_code=499)
+        except httpx.ConnectError as e:
+            pool.release(backend)
+            UPSTREAM_ERRORS.labels(backend=backend.url, reason="connect").inc()
+            pool.report_failure(backend, str(e))
+            if buffered:
+                logger.warning(f"Could not reach {backend.url}; trying the next backend")
+                continue
+            return JSONResponse(status_code=502, content={"detail": f"Could not reach {backend.url}"})
+        except httpx.TransportError as e:
+            pool.release(backend)
+            UPSTREAM_ERRORS.labels(backend=backend.url, reason=type(e).__name__).inc()
+            logger.error(f"Proxying {request.method} {path} to {backend.url} failed: {str(e)}")
+            return JSONResponse(status_code=502, content={"detail": "Bad gateway"})
+        break
+
+    ROUTED_REQUESTS.labels(backend=backend.url, route=route).inc()
+    _remember(request, path, backend, upstream)
+    response_headers = {
+        name: value for name, value in upstream.headers.items() if name.lower() not in HOP_BY_HOP
+    }
+    response_headers["x-backend"] = backend.url
+    # Streamed through as-is; closing it (done or client gone) frees the backend
+    return StreamingResponse(
+        upstream.aiter_raw(),
+        status_code=upstream.status_code,
+        headers=response_headers,
+        background=BackgroundTask(_finish, upstream, pool, backend)
+    )
+
+def create_app() -> FastAPI:
+    """Gateway in front of the icon-service replicas"""
+    app = FastAPI()
+
+    # Add CORS middleware
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["http://localhost:3001"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.include_router(router)
+
+    app.state.client = httpx.AsyncClient(
+        # Keep-alive connections are reused across requests to each backend
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("GATEWAY_MAX_CONNECTIONS", "200")),
+            max_keepalive_connections=int(os.getenv("GATEWAY_MAX_KEEPALIVE", "50"))
+        ),
+        # Generations take as long as they take; deadlines are the backend's job
+        timeout=httpx.Timeout(
+            connect=float(os.getenv("GATEWAY_CONNECT_TIMEOUT", "5")),
+            read=None,
+            write=30.0,
+            pool=float(os.getenv("GATEWAY_POOL_TIMEOUT", "30"))
+        )
+    )
+    app.state.pool = BackendPool(
+        urls=[url.strip() for url in os.getenv("ICON_SERVICE_URLS", "http://icon-service:8000").split(",") if url.strip()],
+        client=app.state.client,
+        check_interval=float(os.getenv("HEALTH_CHECK_INTERVAL", "5")),
+        check_timeout=float(os.getenv("HEALTH_CHECK_TIMEOUT", "2")),
+        eject_after=int(os.getenv("EJECT_AFTER_FAILURES", "2")),
+        replicas=int(os.getenv("HASH_RING_REPLICAS", "100")),
+        load_factor=float(os.getenv("HASH_LOAD_FACTOR", "1.25"))
+    )
+    affinity_capacity = int(os.getenv("AFFINITY_CAPACITY", "100000"))
+    app.state.generations = AffinityMap(affinity_capacity)
+    app.state.clients = AffinityMap(affinity_capacity)
+
+    @app.on_event("startup")
+    async def start_health_checks():
+        # One round before serving so healthy backends are in rotation at once
+        await app.state.pool.check_all()
+        app.state.health_checks = asyncio.create_task(app.state.pool.run_health_checks())
+
+    @app.on_event("shutdown")
+    async def stop():
+        app.state.health_checks.cancel()
+        await app.state.client.aclose()
+
+    return app
+
+app = create_app()
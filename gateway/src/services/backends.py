@@ -0,0 +1,171 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import hashlib
+import logging
+import random
+import time
+from .hashing import BoundedLoadRing
+from .metrics import BACKEND_EJECTIONS, BACKEND_HEALTHY, BACKEND_IN_FLIGHT, BACKEND_QUEUE_DEPTH
+
+class Backend:
+    """One icon-service replica as the gateway sees it"""
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        # Leads the ids of generations made here, so follow-ups find their way back
+        self.prefix = hashlib.sha256(self.url.encode()).hexdigest()[:8]
+        self.healthy = False
+        self.status = "unknown"
+        self.failures = 0
+        self.in_flight = 0
+        self.queue_depth: Optional[int] = None
+        self.running: Optional[int] = None
+        self.checked_at: Optional[float] = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "status": self.status,
+            "failures": self.failures,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "running": self.running,
+            "checked_at": self.checked_at
+        }
+
+class BackendPool:
+    """Icon-service replicas, their health and the requests open to each
+
+    Backends start out of rotation and join after their first passing
+    health check. Failed checks and unreachable proxied requests both
+    count as failures; eject_after consecutive ones take a backend out
+    until a check passes again. A replica still loading its model reports
+    "loading" and is left out until it is ready.
+    """
+    def __init__(
+        self,
+        urls: Iterable[str],
+        client,
+        check_interval: float = 5.0,
+        check_timeout: float = 2.0,
+        eject_after: int = 2,
+        replicas: int = 100,
+        load_factor: float = 1.25
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.client = client
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.eject_after = eject_after
+        self.backends: Dict[str, Backend] = {}
+        for url in urls:
+            backend = Backend(url)
+            self.backends[backend.url] = backend
+            BACKEND_HEALTHY.labels(backend=backend.url).set(0)
+        if not self.backends:
+            raise ValueError("At least one backend URL is required")
+        self.prefixes = {backend.prefix: backend for backend in self.backends.values()}
+        if len(self.prefixes) != len(self.backends):
+            raise ValueError("Backend URLs collide on their generation id prefix")
+        self.ring = BoundedLoadRing(self.backends, replicas=replicas, load_factor=load_factor)
+
+    def get(self, url: Optional[str]) -> Optional[Backend]:
+        """A backend by URL if it is in rotation"""
+        backend = self.backends.get(url) if url else None
+        return backend if backend is not None and backend.healthy else None
+
+    def owner(self, generation_id: str) -> Optional[Backend]:
+        """The backend that minted a generation id, if it is in rotation"""
+        backend = self.prefixes.get(generation_id[:8])
+        return backend if backend is not None and backend.healthy else None
+
+    def choose(self, key: Optional[str], exclude: Iterable[str] = ()) -> Tuple[Optional[Backend], bool]:
+        """Backend for a routing key and whether it spilled past the key's owner
+
+        Requests without a key go to the least busy backend.
+        """
+        excluded = set(exclude)
+        if key is None:
+            ready = [b for b in self.backends.values() if b.healthy and b.url not in excluded]
+            if not ready:
+                return None, False
+            lowest = min(b.in_flight for b in ready)
+            return random.choice([b for b in ready if b.in_flight == lowest]), False
+        url, spilled = self.ring.choose(
+            key,
+            load=lambda url: self.backends[url].in_flight,
+            eligible=lambda url: self.backends[url].healthy and url not in excluded
+        )
+        return (self.backends[url] if url else None), spilled
+
+    def acquire(self, backend: Backend) -> None:
+        backend.in_flight += 1
+        BACKEND_IN_FLIGHT.labels(backend=backend.url).set(backend.in_flight)
+
+    def release(self, backend: Backend) -> None:
+        backend.in_flight -= 1
+        BACKEND_IN_FLIGHT.labels(backend=backend.url).set(backend.in_flight)
+
+    def report_failure(self, backend: Backend, reason: str) -> None:
+        backend.failures += 1
+        if backend.healthy and backend.failures >= self.eject_after:
+            backend.healthy = False
+            BACKEND_HEALTHY.labels(backend=backend.url).set(0)
+            BACKEND_EJECTIONS.labels(backend=backend.url).inc()
+            self.logger.warning(f"Ejected {backend.url} after {backend.failures} failures: {reason}")
+
+    def report_success(self, backend: Backend) -> None:
+        backend.failures = 0
+        if not backend.healthy:
+            backend.healthy = True
+            BACKEND_HEALTHY.labels(backend=backend.url).set(1)
+            self.logger.info(f"{backend.url} is in rotation")
+
+    async def check(self, backend: Backend) -> None:
+        """Poll one backend's /health and update its state"""
+        try:
+            # Tells the replica its prefix, which it needs for ids of queued jobs it runs
+            response = await self.client.get(
+                f"{backend.url}/health",
+                headers={"x-generation-prefix": backend.prefix},
+                timeout=self.check_timeout
+            )
+            body = response.json() if response.status_code == 200 else {}
+        except Exception as e:
+            backend.status = "unreachable"
+            self.report_failure(backend, f"health check failed: {str(e)}")
+            return
+        finally:
+            backend.checked_at = time.time()
+
+        backend.status = body.get("status", f"http {response.status_code}")
+        backend.queue_depth = body.get("queue_depth")
+        backend.running = body.get("running")
+        if backend.queue_depth is not None:
+            BACKEND_QUEUE_DEPTH.labels(backend=backend.url).set(backend.queue_depth)
+
+        if backend.status == "healthy":
+            self.report_success(backend)
+        elif backend.status == "loading":
+            # Not broken, just not ready; requests would wait for the model
+            if backend.healthy:
+                backend.healthy = False
+                BACKEND_HEALTHY.labels(backend=backend.url).set(0)
+        else:
+            self.report_failure(backend, f"health status {backend.status}")
+
+    async def check_all(self) -> None:
+        await asyncio.gather(*(self.check(backend) for backend in self.backends.values()))
+
+    async def run_health_checks(self) -> None:
+        while True:
+            try:
+                await self.check_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Health check round failed: {str(e)}")
+            await asyncio.sleep(self.check_interval)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [backend.snapshot() for backend in self.backends.values()]
@@ -0,0 +1,85 @@
+from bisect import bisect
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple
+import hashlib
+import math
+
+def hash_key(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+class BoundedLoadRing:
+    """Consistent hashing with bounded loads
+
+    Each backend owns `replicas` points on a ring and a key belongs to the
+    first backend clockwise from its hash. A backend only takes the key
+    while its load is below ceil(load_factor * (total + 1) / n); otherwise
+    the key moves on to the next backend along the ring. A hot key thus
+    spills over onto the few backends that follow its owner instead of
+    landing anywhere, so its adapters and caches stay resident on a small
+    set of nodes, and no backend carries more than load_factor times the
+    average. Adding or removing a backend only moves the keys it owned.
+    """
+    def __init__(self, names: Iterable[str] = (), replicas: int = 100, load_factor: float = 1.25):
+        if load_factor < 1:
+            raise ValueError("load_factor must be at least 1")
+        self.replicas = replicas
+        self.load_factor = load_factor
+        self._names: Set[str] = set()
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        for name in names:
+            self.add(name)
+
+    def add(self, name: str) -> None:
+        if name not in self._names:
+            self._names.add(name)
+            self._rebuild()
+
+    def remove(self, name: str) -> None:
+        if name in self._names:
+            self._names.discard(name)
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        points = sorted(
+            (hash_key(f"{name}#{replica}"), name)
+            for name in self._names
+            for replica in range(self.replicas)
+        )
+        self._points = [point for point, _ in points]
+        self._owners = [name for _, name in points]
+
+    def candidates(self, key: str) -> Iterator[str]:
+        """Distinct backends in ring order, starting at the key's owner"""
+        if not self._points:
+            return
+        start = bisect(self._points, hash_key(key))
+        seen: Set[str] = set()
+        for offset in range(len(self._points)):
+            name = self._owners[(start + offset) % len(self._points)]
+            if name in seen:
+                continue
+            seen.add(name)
+            yield name
+            if len(seen) == len(self._names):
+                return
+
+    def capacity(self, total_load: int, backends: int) -> int:
+        """Most load one backend may carry before new keys pass it by"""
+        return max(1, math.ceil(self.load_factor * (total_load + 1) / backends))
+
+    def choose(
+        self,
+        key: str,
+        load: Callable[[str], int],
+        eligible: Callable[[str], bool] = lambda name: True
+    ) -> Tuple[Optional[str], bool]:
+        """Backend for key and whether it spilled past the key's first choice"""
+        names = [name for name in self.candidates(key) if eligible(name)]
+        if not names:
+            return None, False
+        capacity = self.capacity(sum(load(name) for name in names), len(names))
+        for position, name in enumerate(names):
+            if load(name) < capacity:
+                return name, position > 0
+        # Unreachable: capacities always sum to more than the total load
+        return names[0], False
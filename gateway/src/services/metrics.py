@@ -0,0 +1,39 @@
+from prometheus_client import Counter, Gauge
+
+# Backends
+BACKEND_IN_FLIGHT = Gauge(
+    'gateway_backend_in_flight',
+    'Requests the gateway has open to each backend',
+    ['backend']
+)
+
+BACKEND_QUEUE_DEPTH = Gauge(
+    'gateway_backend_queue_depth',
+    'Generations waiting in each backend\'s scheduler, from its last health check',
+    ['backend']
+)
+
+BACKEND_HEALTHY = Gauge(
+    'gateway_backend_healthy',
+    'Whether each backend currently receives traffic',
+    ['backend']
+)
+
+BACKEND_EJECTIONS = Counter(
+    'gateway_backend_ejections_total',
+    'Times a backend was taken out of rotation',
+    ['backend']
+)
+
+# Routing
+ROUTED_REQUESTS = Counter(
+    'gateway_requests_total',
+    'Proxied requests by backend and what the backend was chosen by',
+    ['backend', 'route']
+)
+
+UPSTREAM_ERRORS = Counter(
+    'gateway_upstream_errors_total',
+    'Requests a backend could not be reached for',
+    ['backend', 'reason']
+)
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from typing import Mapping, Optional, Tuple
+import re
+
+# Explicit style or adapter ids win over the prompt
+STYLE_HEADERS = ("X-Style-Id", "X-Adapter-Id")
+STYLE_FIELDS = ("style_id", "adapter_id", "style")
+
+# Paths that act on a generation whose latents live on one replica
+GENERATION_PATH = re.compile(r"^/generate/([0-9a-f]{32})(/|$)")
+
+def normalize_prompt(prompt: str) -> str:
+    """Prompt as the caches see it, so trivially different spellings share a node"""
+    return " ".join(prompt.lower().split())
+
+def routing_key(
+    headers: Mapping[str, str],
+    query: Mapping[str, str],
+    form: Mapping[str, str]
+) -> Tuple[Optional[str], str]:
+    """Affinity key for a request and what it came from
+
+    A style or adapter id keeps that style's weights loaded on few nodes;
+    otherwise the prompt keeps its result, semantic and embedding caches
+    warm on one node.
+    """
+    for name in STYLE_HEADERS:
+        if headers.get(name):
+            return f"style:{headers[name]}", "style"
+    for field in STYLE_FIELDS:
+        value = form.get(field) or query.get(field)
+        if value:
+            return f"style:{value}", "style"
+    prompt = form.get("prompt") or query.get("prompt")
+    if prompt and prompt.strip():
+        return f"prompt:{normalize_prompt(prompt)}", "prompt"
+    return None, "none"
+
+def generation_id(path: str) -> Optional[str]:
+    match = GENERATION_PATH.match(path)
+    return match.group(1) if match else None
+
+class AffinityMap:
+    """Bounded LRU of key -> backend URL for state held by a single replica"""
+    def __init__(self, capacity: int = 100000):
+        self.capacity = capacity
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        url = self._entries.get(key)
+        if url is not None:
+            self._entries.move_to_end(key)
+        return url
+
+    def set(self, key: str, url: str) -> None:
+        self._entries[key] = url
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Tests import the gateway as `src.`, like uvicorn run from the gateway directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
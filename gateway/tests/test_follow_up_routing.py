@@ -0,0 +1,61 @@
+"""Follow-up requests reach the replica holding a generation's latents"""
+import uuid
+import pytest
+
+pytest.importorskip("fastapi")
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("prometheus_client")
+
+from fastapi.testclient import TestClient
+
+from src import main
+from src.services.backends import BackendPool
+
+API_NODE = "http://api-node:8000"
+WORKER_NODE = "http://worker-node:8000"
+
+class Cluster:
+    """Answers for two replicas; the worker mints ids with its own prefix, as a queued job does"""
+    def __init__(self):
+        self.prefixes = {}
+        self.calls = []
+
+    def handle(self, request: "httpx.Request") -> "httpx.Response":
+        node = f"{request.url.scheme}://{request.url.host}:{request.url.port}"
+        if request.url.path == "/health":
+            self.prefixes[node] = request.headers["x-generation-prefix"]
+            return httpx.Response(200, json={"status": "healthy", "queue_depth": 0, "running": 0})
+        self.calls.append((node, request.url.path))
+        if request.url.path == "/generate":
+            generation_id = self.prefixes[WORKER_NODE] + uuid.uuid4().hex[8:]
+            return httpx.Response(200, content=b"png", headers={"X-Generation-Id": generation_id})
+        return httpx.Response(200, content=b"png")
+
+@pytest.fixture
+def cluster():
+    cluster = Cluster()
+    app = main.create_app()
+    app.state.client = httpx.AsyncClient(transport=httpx.MockTransport(cluster.handle))
+    app.state.pool = BackendPool([API_NODE, WORKER_NODE], client=app.state.client)
+    with TestClient(app) as client:
+        cluster.client = client
+        yield cluster
+
+def test_follow_up_goes_to_the_worker_that_rendered(cluster):
+    response = cluster.client.post("/generate", data={"prompt": "a red square"})
+    generation_id = response.headers["X-Generation-Id"]
+
+    # With a queue, the API node answers the generate, so that is what the gateway remembers
+    cluster.client.app.state.generations.set(generation_id, API_NODE)
+    response = cluster.client.post(f"/generate/{generation_id}/decode", data={"decoder": "full"})
+    assert response.status_code == 200
+    assert response.headers["X-Backend"] == WORKER_NODE
+    assert cluster.calls[-1] == (WORKER_NODE, f"/generate/{generation_id}/decode")
+
+def test_health_checks_tell_each_replica_its_prefix(cluster):
+    pool = cluster.client.app.state.pool
+    assert cluster.prefixes == {url: backend.prefix for url, backend in pool.backends.items()}
+
+def test_malformed_content_length_is_rejected(cluster):
+    response = cluster.client.post("/generate", content=b"prompt=x", headers={"Content-Length": "x1"})
+    assert response.status_code == 400
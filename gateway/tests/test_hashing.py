@@ -0,0 +1,54 @@
+from collections import Counter
+
+from src.services.hashing import BoundedLoadRing
+
+BACKENDS = ["http://a:8000", "http://b:8000", "http://c:8000"]
+
+def test_key_goes_to_its_owner_when_idle():
+    ring = BoundedLoadRing(BACKENDS)
+    owner = next(ring.candidates("prompt:cat"))
+    assert ring.choose("prompt:cat", load=lambda name: 0) == (owner, False)
+
+def test_same_key_always_has_the_same_owner():
+    first = BoundedLoadRing(BACKENDS)
+    second = BoundedLoadRing(reversed(BACKENDS))
+    for n in range(50):
+        assert next(first.candidates(f"prompt:{n}")) == next(second.candidates(f"prompt:{n}"))
+
+def test_candidates_visit_every_backend_once():
+    ring = BoundedLoadRing(BACKENDS)
+    assert sorted(ring.candidates("style:flat")) == sorted(BACKENDS)
+
+def test_busy_owner_spills_to_the_next_backend_on_the_ring():
+    ring = BoundedLoadRing(BACKENDS, load_factor=1.25)
+    owner, runner_up, _ = ring.candidates("style:flat")
+    loads = {name: 0 for name in BACKENDS}
+    loads[owner] = 5
+    # Capacity is ceil(1.25 * 6 / 3) = 3, so the owner at 5 is passed by
+    assert ring.capacity(5, 3) == 3
+    assert ring.choose("style:flat", load=loads.get) == (runner_up, True)
+
+def test_no_backend_exceeds_its_capacity():
+    ring = BoundedLoadRing(BACKENDS, load_factor=1.25)
+    loads = Counter()
+    # One hot key: its load spreads but stays bounded
+    for _ in range(60):
+        name, _ = ring.choose("prompt:hot", load=lambda name: loads[name])
+        assert loads[name] < ring.capacity(sum(loads.values()), len(BACKENDS))
+        loads[name] += 1
+    assert max(loads.values()) <= ring.capacity(59, len(BACKENDS))
+    assert len(loads) == len(BACKENDS)
+
+def test_ineligible_backends_are_skipped():
+    ring = BoundedLoadRing(BACKENDS)
+    owner = next(ring.candidates("prompt:cat"))
+    name, spilled = ring.choose("prompt:cat", load=lambda name: 0, eligible=lambda name: name != owner)
+    assert name != owner and not spilled
+    assert ring.choose("prompt:cat", load=lambda name: 0, eligible=lambda name: False) == (None, False)
+
+def test_removing_a_backend_only_moves_its_keys():
+    ring = BoundedLoadRing(BACKENDS)
+    before = {n: next(ring.candidates(f"prompt:{n}")) for n in range(200)}
+    ring.remove(BACKENDS[0])
+    after = {n: next(ring.candidates(f"prompt:{n}")) for n in range(200)}
+    assert all(after[n] == owner for n, owner in before.items() if owner != BACKENDS[0])
@@ -0,0 +1,33 @@
+from src.services.routing import AffinityMap, generation_id, normalize_prompt, routing_key
+
+def test_style_header_wins_over_fields_and_prompt():
+    key = routing_key({"X-Style-Id": "flat"}, {"style_id": "line"}, {"prompt": "a cat"})
+    assert key == ("style:flat", "style")
+
+def test_style_field_or_query_parameter():
+    assert routing_key({}, {}, {"adapter_id": "brand", "prompt": "a cat"}) == ("style:brand", "style")
+    assert routing_key({}, {"style": "pixel"}, {}) == ("style:pixel", "style")
+
+def test_prompt_is_normalized():
+    assert normalize_prompt("  A   Red\tCat ") == "a red cat"
+    assert routing_key({}, {}, {"prompt": "A  red cat"}) == routing_key({}, {"prompt": "a red CAT"}, {})
+
+def test_no_key_without_style_or_prompt():
+    assert routing_key({}, {}, {"prompt": "   "}) == (None, "none")
+
+def test_generation_id_from_follow_up_paths():
+    generation = "0123456789abcdef0123456789abcdef"
+    assert generation_id(f"/generate/{generation}/refine") == generation
+    assert generation_id(f"/generate/{generation}") == generation
+    assert generation_id("/generate/batch") is None
+    assert generation_id(f"/generate/{generation}x/refine") is None
+    assert generation_id(f"/generate/{generation.upper()}/refine") is None
+
+def test_affinity_map_evicts_least_recently_used():
+    affinity = AffinityMap(capacity=2)
+    affinity.set("a", "http://a")
+    affinity.set("b", "http://b")
+    affinity.get("a")
+    affinity.set("c", "http://c")
+    assert affinity.get("b") is None
+    assert affinity.get("a") == "http://a" and len(affinity) == 2
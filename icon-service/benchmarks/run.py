@@ -0,0 +1,316 @@
+"""CPU benchmark suite for the generation and training paths.
+
+Run from the icon-service directory:
+
+    python -m benchmarks.run                      # tiny random model, offline
+    python -m benchmarks.run --mode full          # real weights from /app/shared/models
+    python -m benchmarks.run --save-baseline      # record a new baseline
+    python -m benchmarks.run --check              # exit 1 on regression or over the startup budget
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+import torch
+import diffusers
+from PIL import Image
+
+from src.services.stable_diffusion import StableDiffusionService
+from src.services.fine_tuning import FineTuningService
+from .tiny_models import build_tiny_pipeline, tiny_resolution
+from .startup import measure_startup, profile_imports, heavy_imports
+
+logger = logging.getLogger("benchmarks")
+
+BASELINE_DIR = Path(__file__).parent / "baselines"
+PROMPT = "a blue cloud icon"
+
+# Metrics where a larger value is a regression; everything else is higher-is-better
+LOWER_IS_BETTER = (
+    "startup_import_s",
+    "cold_start_s",
+    "step_latency_ms_p50",
+    "step_latency_ms_p95",
+    "peak_rss_mb",
+    "train_image_processing_s",
+    "train_step_s",
+)
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return usage / 1024 if sys.platform != "darwin" else usage / (1024 * 1024)
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def build_service(mode: str, work_dir: Path) -> StableDiffusionService:
+    """Construct the generation service for the chosen mode"""
+    if mode == "tiny":
+        return StableDiffusionService(
+            models_dir=work_dir / "models",
+            cache_dir=work_dir / "cache",
+            pipeline=build_tiny_pipeline()
+        )
+    return StableDiffusionService()
+
+def full_model_available(models_dir: Path = Path("/app/shared/models")) -> bool:
+    """True when real weights are present locally"""
+    return (models_dir / "stable-diffusion-v1-4" / "model_index.json").exists()
+
+def bench_generation(service: StableDiffusionService, args) -> Dict[str, Any]:
+    """Per-step latency and throughput at several concurrency levels"""
+    results: Dict[str, Any] = {}
+    gen_kwargs = {
+        "num_steps": args.steps,
+        "guidance_scale": 7.5,
+        "height": args.resolution,
+        "width": args.resolution,
+        "seed": 0,
+    }
+
+    # Warm-up run so lazy initialization does not skew step timings
+    service.generate_image(PROMPT, **gen_kwargs)
+
+    step_times: List[float] = []
+    service.step_listeners.append(step_times.append)
+    try:
+        start = time.perf_counter()
+        service.generate_icon(PROMPT, **gen_kwargs)
+        results["single_image_s"] = time.perf_counter() - start
+    finally:
+        service.step_listeners.remove(step_times.append)
+
+    step_ms = [t * 1000 for t in step_times]
+    results["step_latency_ms_p50"] = statistics.median(step_ms)
+    results["step_latency_ms_p95"] = percentile(step_ms, 95)
+
+    for concurrency in args.concurrency:
+        total = max(concurrency, args.images)
+        errors = 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [
+                pool.submit(service.generate_icon, PROMPT, **{**gen_kwargs, "seed": i})
+                for i in range(total)
+            ]
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    errors += 1
+                    logger.warning(f"Generation failed at concurrency {concurrency}: {str(e)}")
+        elapsed = time.perf_counter() - start
+        results[f"images_per_min_c{concurrency}"] = (total - errors) / elapsed * 60
+        results[f"errors_c{concurrency}"] = errors
+
+    return results
+
+def _synthetic_training_zip(count: int, size: int) -> bytes:
+    """ZIP of flat-colored PNGs resembling an icon training set"""
+    rng = np.random.default_rng(0)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for i in range(count):
+            color = tuple(int(c) for c in rng.integers(0, 255, 3))
+            image = Image.new("RGB", (size, size), color)
+            image_bytes = io.BytesIO()
+            image.save(image_bytes, format="PNG")
+            archive.writestr(f"icon_{i}.png", image_bytes.getvalue())
+    return buffer.getvalue()
+
+def psnr(a: Image.Image, b: Image.Image) -> float:
+    """Peak signal-to-noise ratio between two images, in dB"""
+    x = np.asarray(a.convert("RGB"), dtype=np.float64)
+    y = np.asarray(b.convert("RGB"), dtype=np.float64)
+    mse = np.mean((x - y) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+def bench_fast_mode(service: StableDiffusionService, args) -> Dict[str, Any]:
+    """Speedup and fidelity of DeepCache fast mode against a full run"""
+    gen_kwargs = {
+        "num_steps": args.steps,
+        "guidance_scale": 7.5,
+        "height": args.resolution,
+        "width": args.resolution,
+        "seed": 0,
+    }
+
+    start = time.perf_counter()
+    reference = service.generate_image(PROMPT, **gen_kwargs)
+    full_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fast = service.generate_image(PROMPT, fast_mode=True, cache_interval=args.cache_interval, **gen_kwargs)
+    fast_s = time.perf_counter() - start
+
+    return {
+        "fast_mode_speedup": full_s / fast_s,
+        "fast_mode_psnr_db": min(psnr(reference, fast), 100.0),
+    }
+
+def bench_training(mode: str, work_dir: Path, args) -> Dict[str, Any]:
+    """Time image ingestion and fine-tuning steps"""
+    results: Dict[str, Any] = {}
+    pipeline = build_tiny_pipeline() if mode == "tiny" else None
+    service = FineTuningService(
+        model_path=work_dir / "fine_tuned",
+        models_dir=work_dir / "models" if mode == "tiny" else "/app/shared/models",
+        cache_dir=work_dir / "cache",
+        pipeline=pipeline,
+        resolution=args.resolution
+    )
+
+    archive = _synthetic_training_zip(args.train_images, args.resolution)
+    start = time.perf_counter()
+    images = asyncio.run(service.process_training_images(archive))
+    results["train_image_processing_s"] = time.perf_counter() - start
+
+    # One epoch over the synthetic set
+    start = time.perf_counter()
+    asyncio.run(service.fine_tune_model(images, num_epochs=1))
+    results["train_step_s"] = (time.perf_counter() - start) / len(images)
+    return results
+
+def bench_startup(args) -> Dict[str, Any]:
+    """Time for a fresh worker to import the API, before any model loads"""
+    entries = profile_imports("src.main")
+    return {
+        "startup_import_s": measure_startup("src.main", repeats=args.startup_repeats),
+        "startup_heavy_modules": heavy_imports(entries),
+    }
+
+def compare(current: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    """Describe metrics that regressed beyond the tolerance"""
+    regressions = []
+    for name, base_value in baseline.items():
+        value = current.get(name)
+        if not isinstance(value, (int, float)) or not isinstance(base_value, (int, float)):
+            continue
+        if name.startswith("errors_") or base_value == 0:
+            continue
+        change = (value - base_value) / base_value
+        worse = change > tolerance if name in LOWER_IS_BETTER else change < -tolerance
+        if worse:
+            regressions.append(f"{name}: {base_value:.3f} -> {value:.3f} ({change:+.1%})")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["tiny", "full"], default="tiny")
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--resolution", type=int, default=None)
+    parser.add_argument("--concurrency", type=lambda v: [int(c) for c in v.split(",")], default=[1, 2, 4])
+    parser.add_argument("--images", type=int, default=4, help="images per concurrency level")
+    parser.add_argument("--train-images", type=int, default=5)
+    parser.add_argument("--skip-training", action="store_true")
+    parser.add_argument("--skip-fast-mode", action="store_true")
+    parser.add_argument("--cache-interval", type=int, default=3, help="fast mode refresh interval")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--skip-startup", action="store_true")
+    parser.add_argument("--startup-budget", type=float, default=2.0, help="max seconds to import src.main")
+    parser.add_argument("--startup-repeats", type=int, default=3)
+    parser.add_argument("--baseline", type=Path, default=None)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true", help="exit non-zero on regression")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--output", type=Path, default=None, help="write results JSON here")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.WARNING)
+    args = parse_args(argv)
+
+    if args.mode == "full" and not full_model_available():
+        print("Full model weights not found in /app/shared/models", file=sys.stderr)
+        return 2
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    results: Dict[str, Any] = {}
+    if not args.skip_startup:
+        results.update(bench_startup(args))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = Path(tmp)
+
+        start = time.perf_counter()
+        service = build_service(args.mode, work_dir)
+        results["cold_start_s"] = time.perf_counter() - start
+
+        if args.resolution is None:
+            args.resolution = tiny_resolution(service.pipeline) if args.mode == "tiny" else service.resolution
+
+        results.update(bench_generation(service, args))
+        if not args.skip_fast_mode:
+            results.update(bench_fast_mode(service, args))
+        del service
+
+        if not args.skip_training:
+            results.update(bench_training(args.mode, work_dir, args))
+
+    results["peak_rss_mb"] = peak_rss_mb()
+
+    report = {
+        "mode": args.mode,
+        "steps": args.steps,
+        "resolution": args.resolution,
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "diffusers": diffusers.__version__,
+            "threads": torch.get_num_threads(),
+            "machine": platform.machine(),
+        },
+        "metrics": results,
+    }
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+    # Absolute limit, independent of any baseline
+    over_budget = []
+    if "startup_import_s" in results and results["startup_import_s"] > args.startup_budget:
+        over_budget.append(f"startup_import_s: {results['startup_import_s']:.3f} > {args.startup_budget:.3f}")
+    if results.get("startup_heavy_modules"):
+        over_budget.append(f"startup imports {', '.join(results['startup_heavy_modules'])}")
+    for line in over_budget:
+        print(f"STARTUP BUDGET {line}", file=sys.stderr)
+
+    baseline_path = args.baseline or BASELINE_DIR / f"{args.mode}.json"
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(report, indent=2))
+        print(f"Saved baseline to {baseline_path}", file=sys.stderr)
+        return 0
+
+    if baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text())
+        regressions = compare(results, baseline.get("metrics", {}), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions and args.check:
+            return 1
+
+    return 1 if over_budget and args.check else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""Import-time profile of the API module.
+
+Run from the icon-service directory:
+
+    python -m benchmarks.startup                          # slowest imports of src.main
+    python -m benchmarks.startup --top 40 --json
+    python -m benchmarks.startup --module src.services.stable_diffusion
+
+Each run imports the module in a fresh interpreter with -X importtime,
+so results are not skewed by modules this process already loaded.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+SERVICE_DIR = Path(__file__).parent.parent
+
+# Modules that should only be imported once a request needs them
+HEAVY_MODULES = (
+    "torch",
+    "diffusers",
+    "transformers",
+    "datasets",
+    "onnxruntime",
+    "numpy",
+    "PIL",
+    "psutil",
+    "opentelemetry",
+)
+
+def profile_imports(module: str = "src.main") -> List[Dict[str, Any]]:
+    """Per-module import times (microseconds) from -X importtime"""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SERVICE_DIR,
+        capture_output=True,
+        text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr[-2000:]}")
+
+    entries = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        entries.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us)
+        })
+
+    # Entries are printed post-order; keep the subtree ending at the module
+    # itself and drop what the interpreter imported at startup (site, ...)
+    end = max(i for i, entry in enumerate(entries) if entry["depth"] == 0 and entry["module"] == module)
+    start = max((i + 1 for i, entry in enumerate(entries[:end]) if entry["depth"] == 0), default=0)
+    return entries[start:end + 1]
+
+def measure_startup(module: str = "src.main", repeats: int = 3) -> float:
+    """Median wall time in seconds for a fresh interpreter to import the module"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {module}"], cwd=SERVICE_DIR, check=True, capture_output=True)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+def heavy_imports(entries: List[Dict[str, Any]]) -> List[str]:
+    """Heavy top-level packages pulled in by the import"""
+    loaded = {entry["module"].split(".")[0] for entry in entries}
+    return [name for name in HEAVY_MODULES if name in loaded]
+
+def summarize(entries: List[Dict[str, Any]], top: int = 20) -> Dict[str, Any]:
+    by_cumulative = sorted(entries, key=lambda entry: entry["cumulative_us"], reverse=True)
+    by_self = sorted(entries, key=lambda entry: entry["self_us"], reverse=True)
+    return {
+        "total_s": entries[-1]["cumulative_us"] / 1e6,
+        "modules": len(entries),
+        "heavy_modules": heavy_imports(entries),
+        "top_cumulative": by_cumulative[:top],
+        "top_self": by_self[:top]
+    }
+
+def print_report(module: str, summary: Dict[str, Any]) -> None:
+    print(f"{module}: {summary['total_s'] * 1000:.1f} ms over {summary['modules']} modules")
+    if summary["heavy_modules"]:
+        print(f"heavy modules imported: {', '.join(summary['heavy_modules'])}")
+    for title, key, field in (("cumulative", "top_cumulative", "cumulative_us"), ("self", "top_self", "self_us")):
+        print(f"\nslowest by {title} time:")
+        for entry in summary[key]:
+            print(f"  {entry[field] / 1000:9.1f} ms  {'  ' * entry['depth']}{entry['module']}")
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="src.main")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    summary = summarize(profile_imports(args.module), args.top)
+    if args.json:
+        print(json.dumps({"module": args.module, **summary}, indent=2))
+    else:
+        print_report(args.module, summary)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
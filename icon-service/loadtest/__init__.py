@@ -0,0 +1 @@
+# Load-generation harness for the icon service
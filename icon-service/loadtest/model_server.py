@@ -0,0 +1,22 @@
+"""Run the model server with the stub pipeline installed."""
+import argparse
+import os
+
+from .stub import install_stub
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--address", default="/tmp/microdawgs-loadtest.sock")
+    parser.add_argument("--step-ms", type=float, default=5.0)
+    parser.add_argument("--concurrency", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    install_stub(step_ms=args.step_ms)
+    os.environ["MODEL_SERVER_ADDRESS"] = args.address
+    os.environ["INFERENCE_CONCURRENCY"] = str(args.concurrency)
+
+    from src.model_server import main as serve
+    serve()
+
+if __name__ == "__main__":
+    main()
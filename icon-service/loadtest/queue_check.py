@@ -0,0 +1,176 @@
+"""Check the Redis job queue against a local redis-server.
+
+Run from the icon-service directory (redis-server must be on PATH):
+
+    python -m loadtest.queue_check
+    python -m loadtest.queue_check --workers 4 --jobs 40
+    python -m loadtest.queue_check --redis-url redis://localhost:6379/15
+
+Starts a throwaway redis-server (unless --redis-url is given), then runs
+one API-side queue and several worker-side queues in this process with a
+stub handler. Checks that every job completes, that work spreads over the
+workers, that a job held by a worker that dies without acking is
+reclaimed by another, and that cancelling a queued job returns at once.
+"""
+import argparse
+import asyncio
+import json
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List
+
+from src.services.cancellation import CancellationToken, GenerationCancelled
+from src.services.job_queue import RedisJobQueue
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_redis(port: int) -> subprocess.Popen:
+    server = subprocess.Popen(
+        ["redis-server", "--port", str(port), "--save", "", "--appendonly", "no", "--dir", tempfile.mkdtemp(prefix="icon-redis-")],
+        stdout=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    server.terminate()
+    raise RuntimeError("redis-server did not start")
+
+def stub_handler(job_ms: float):
+    async def handle(payload: Dict, token: CancellationToken) -> Dict:
+        # Cooperative like the real pipeline: notice cancellation between steps
+        for _ in range(10):
+            token.raise_if_cancelled()
+            await asyncio.sleep(job_ms / 10000)
+        if payload.get("invalid"):
+            raise ValueError("Unsupported decoder: bogus")
+        return {"generation_id": uuid.uuid4().hex, "artifact_id": payload["n"], "seconds": job_ms / 1000}
+    return handle
+
+async def hang(payload: Dict, token: CancellationToken) -> Dict:
+    await asyncio.Event().wait()
+
+async def run_checks(url: str, args) -> Dict[str, object]:
+    failures: List[str] = []
+    prefix = f"check-{uuid.uuid4().hex[:6]}"
+    queue_options = {"prefix": prefix, "claim_idle_ms": args.claim_idle_ms}
+
+    api = RedisJobQueue(url, consumer="api", **queue_options)
+    await api.start_api()
+    workers = [RedisJobQueue(url, consumer=f"worker-{i}", **queue_options) for i in range(args.workers)]
+    worker_tasks = [asyncio.create_task(worker.run_worker(stub_handler(args.job_ms), concurrency=1)) for worker in workers]
+
+    # Distribution: every job completes, spread over the idle workers
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        api.submit({"n": str(n)}, priority="bulk" if n % 2 else "interactive")
+        for n in range(args.jobs)
+    ))
+    elapsed = time.perf_counter() - start
+    if sorted(result["artifact_id"] for result in results) != sorted(str(n) for n in range(args.jobs)):
+        failures.append("results do not match the submitted jobs")
+    per_worker = Counter(result["worker"] for result in results)
+    if len(per_worker) < min(args.workers, args.jobs):
+        failures.append(f"only {len(per_worker)} of {args.workers} workers took jobs")
+
+    # Worker-side validation errors surface as ValueError
+    try:
+        await api.submit({"n": "invalid", "invalid": True})
+        failures.append("invalid job did not raise ValueError")
+    except ValueError:
+        pass
+
+    # Cancelling a queued job resolves the caller right away
+    for task in worker_tasks:
+        task.cancel()
+    token = CancellationToken()
+    asyncio.get_running_loop().call_later(0.2, token.cancel, "disconnected")
+    cancel_started = time.perf_counter()
+    try:
+        await api.submit({"n": "cancelled"}, token=token)
+        failures.append("cancelled job completed")
+    except GenerationCancelled as e:
+        if e.reason != "disconnected":
+            failures.append(f"cancellation reason {e.reason!r}")
+    if time.perf_counter() - cancel_started > 1.0:
+        failures.append("cancelled submit waited for a worker")
+
+    for worker in workers:
+        await worker.close()
+
+    # Reclaim: a worker takes a job and dies without acking; another finishes it
+    doomed = RedisJobQueue(url, consumer="doomed", **queue_options)
+    doomed_task = asyncio.create_task(doomed.run_worker(hang, concurrency=1))
+    reclaimed = asyncio.create_task(api.submit({"n": "reclaimed"}))
+    while not doomed._running:
+        await asyncio.sleep(0.05)
+    doomed_task.cancel()
+    await doomed.close()
+
+    rescuer = RedisJobQueue(url, consumer="rescuer", **queue_options)
+    rescuer_task = asyncio.create_task(rescuer.run_worker(stub_handler(args.job_ms), concurrency=1))
+    reclaim_started = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(reclaimed, timeout=args.claim_idle_ms / 1000 * 4)
+        if result["worker"] != "rescuer":
+            failures.append(f"reclaimed job finished on {result['worker']}")
+    except asyncio.TimeoutError:
+        failures.append("job held by a dead worker was never reclaimed")
+    reclaim_seconds = time.perf_counter() - reclaim_started
+
+    rescuer_task.cancel()
+    for queue in [api, rescuer]:
+        await queue.close()
+
+    return {
+        "jobs": args.jobs,
+        "workers": args.workers,
+        "seconds": round(elapsed, 3),
+        "jobs_per_s": round(args.jobs / elapsed, 2),
+        "per_worker": dict(per_worker),
+        "reclaim_seconds": round(reclaim_seconds, 3),
+        "failures": failures
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis-url", default=None, help="use this Redis instead of starting one")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--jobs", type=int, default=30)
+    parser.add_argument("--job-ms", type=float, default=50.0)
+    parser.add_argument("--claim-idle-ms", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    server = None
+    url = args.redis_url
+    if url is None:
+        if shutil.which("redis-server") is None:
+            print("redis-server not found; install it or pass --redis-url", file=sys.stderr)
+            return 2
+        port = free_port()
+        server = start_redis(port)
+        url = f"redis://127.0.0.1:{port}/0"
+    try:
+        report = asyncio.run(run_checks(url, args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    print(json.dumps(report, indent=2))
+    return 1 if report["failures"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
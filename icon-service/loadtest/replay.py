@@ -0,0 +1,219 @@
+"""Replay captured /generate and /train requests against the icon-service app.
+
+Capture traffic by starting the service with REQUEST_LOG_PATH=requests.jsonl,
+then replay it from the icon-service directory:
+
+    python -m loadtest.replay requests.jsonl --rate 2,5,10 --count 200
+    python -m loadtest.replay requests.jsonl --concurrency 1,4,16 --mode uvicorn
+    python -m loadtest.replay requests.jsonl --mode uvicorn --model-server /tmp/model.sock --workers 4
+"""
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import random
+import subprocess
+import sys
+import time
+import zipfile
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+from PIL import Image
+
+from src.services.request_log import read_request_log
+
+class Result:
+    __slots__ = ("endpoint", "status", "latency", "error")
+
+    def __init__(self, endpoint: str, status: int, latency: float, error: Optional[str] = None):
+        self.endpoint = endpoint
+        self.status = status
+        self.latency = latency
+        self.error = error
+
+def _training_zip(count: int = 5, size: int = 64) -> bytes:
+    """Small ZIP of PNGs standing in for the uploaded training set"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for i in range(count):
+            image = Image.new("RGB", (size, size), (i * 40 % 256, 128, 200))
+            image_bytes = io.BytesIO()
+            image.save(image_bytes, format="PNG")
+            archive.writestr(f"image_{i}.png", image_bytes.getvalue())
+    return buffer.getvalue()
+
+TRAINING_ZIP = _training_zip()
+
+async def send(client: httpx.AsyncClient, entry: Dict[str, Any]) -> Result:
+    """Issue one recorded request"""
+    endpoint = entry["endpoint"]
+    params = dict(entry["params"])
+    start = time.perf_counter()
+    try:
+        if endpoint == "/train":
+            response = await client.post(
+                "/train",
+                data={"num_epochs": str(params.get("num_epochs", 1))},
+                files={"file": (params.get("filename", "train.zip"), TRAINING_ZIP, "application/zip")}
+            )
+        else:
+            headers = {}
+            accept = params.pop("accept", None)
+            if accept:
+                headers["Accept"] = accept
+            form = {key: str(value) for key, value in params.items() if value is not None}
+            response = await client.post(endpoint, data=form, headers=headers)
+        return Result(endpoint, response.status_code, time.perf_counter() - start)
+    except Exception as e:
+        return Result(endpoint, 0, time.perf_counter() - start, error=str(e))
+
+async def open_loop(client: httpx.AsyncClient, entries: List[Dict[str, Any]], rate: float, count: int, seed: int) -> List[Result]:
+    """Poisson arrivals at a fixed rate, independent of completions"""
+    rng = random.Random(seed)
+    source = itertools.cycle(entries)
+    tasks = []
+    next_arrival = time.perf_counter()
+    for _ in range(count):
+        delay = next_arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send(client, next(source))))
+        next_arrival += rng.expovariate(rate)
+    return list(await asyncio.gather(*tasks))
+
+async def closed_loop(client: httpx.AsyncClient, entries: List[Dict[str, Any]], concurrency: int, count: int) -> List[Result]:
+    """Fixed number of clients, each sending its next request on completion"""
+    source: Iterator[Dict[str, Any]] = itertools.islice(itertools.cycle(entries), count)
+    results: List[Result] = []
+
+    async def worker():
+        for entry in source:
+            results.append(await send(client, entry))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def summarize(results: List[Result], elapsed: float) -> Dict[str, Any]:
+    """Latency percentiles, error rate and throughput for one run"""
+    latencies = [r.latency * 1000 for r in results if r.error is None and r.status < 400]
+    errors = [r for r in results if r.error is not None or r.status >= 400]
+    statuses: Dict[str, int] = {}
+    for r in results:
+        key = str(r.status) if r.error is None else "exception"
+        statuses[key] = statuses.get(key, 0) + 1
+
+    return {
+        "requests": len(results),
+        "errors": len(errors),
+        "error_rate": len(errors) / len(results) if results else 0.0,
+        "throughput_rps": len(results) / elapsed if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies) if latencies else 0.0,
+        },
+        "statuses": statuses,
+    }
+
+async def run_suite(client: httpx.AsyncClient, entries: List[Dict[str, Any]], args) -> List[Dict[str, Any]]:
+    """Run every requested open-loop rate and closed-loop concurrency level"""
+    runs = []
+    for rate in args.rate:
+        start = time.perf_counter()
+        results = await open_loop(client, entries, rate, args.count, args.seed)
+        runs.append({"kind": "open_loop", "rate": rate, **summarize(results, time.perf_counter() - start)})
+    for concurrency in args.concurrency:
+        start = time.perf_counter()
+        results = await closed_loop(client, entries, concurrency, args.count)
+        runs.append({"kind": "closed_loop", "concurrency": concurrency, **summarize(results, time.perf_counter() - start)})
+    return runs
+
+async def run_inprocess(entries: List[Dict[str, Any]], args) -> List[Dict[str, Any]]:
+    """Drive main.app through the ASGI transport, no sockets involved"""
+    from .stub import install_stub
+    install_stub(step_ms=args.step_ms)
+    from src.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout) as client:
+        return await run_suite(client, entries, args)
+
+async def run_uvicorn(entries: List[Dict[str, Any]], args) -> List[Dict[str, Any]]:
+    """Drive the app over HTTP in a separate uvicorn process"""
+    command = [
+        sys.executable, "-m", "loadtest.serve",
+        "--port", str(args.port),
+        "--step-ms", str(args.step_ms)
+    ]
+    if args.model_server:
+        command += ["--model-server", args.model_server, "--workers", str(args.workers)]
+    server = subprocess.Popen(command)
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        limits = httpx.Limits(max_connections=max(args.concurrency + [64]))
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+            deadline = time.monotonic() + 60
+            while True:
+                try:
+                    if (await client.get("/health")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise RuntimeError("uvicorn server did not become healthy")
+                await asyncio.sleep(0.2)
+            return await run_suite(client, entries, args)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+def parse_list(value: str, cast):
+    return [cast(item) for item in value.split(",") if item]
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log", help="JSONL request log")
+    parser.add_argument("--endpoint", choices=["/generate", "/train"], default=None)
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--rate", type=lambda v: parse_list(v, float), default=[], help="open-loop arrival rates (req/s)")
+    parser.add_argument("--concurrency", type=lambda v: parse_list(v, int), default=[], help="closed-loop client counts")
+    parser.add_argument("--count", type=int, default=100, help="requests per run")
+    parser.add_argument("--step-ms", type=float, default=5.0, help="stub cost per diffusion step")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--model-server", default=None, metavar="ADDRESS", help="uvicorn mode: split model and API workers")
+    parser.add_argument("--workers", type=int, default=2, help="API worker processes with --model-server")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write the report JSON here")
+    args = parser.parse_args(argv)
+
+    entries = list(read_request_log(args.log, args.endpoint))
+    if not entries:
+        print(f"No replayable requests in {args.log}", file=sys.stderr)
+        return 2
+    if not args.rate and not args.concurrency:
+        args.concurrency = [1, 4, 16]
+
+    runner = run_inprocess if args.mode == "inprocess" else run_uvicorn
+    runs = asyncio.run(runner(entries, args))
+
+    report = json.dumps({"mode": args.mode, "step_ms": args.step_ms, "runs": runs}, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(report)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""Run the icon-service app under uvicorn with the stub pipeline installed.
+
+With --model-server the stub model runs in its own process and --workers
+API worker processes share it, as in a split deployment.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+from .stub import install_stub
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--step-ms", type=float, default=5.0)
+    parser.add_argument("--log-level", default="warning")
+    parser.add_argument("--model-server", default=None, metavar="ADDRESS", help="run the model in a separate process at ADDRESS")
+    parser.add_argument("--workers", type=int, default=1, help="API worker processes (with --model-server)")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    if not args.model_server:
+        install_stub(step_ms=args.step_ms)
+        from src.main import app
+        uvicorn.run(app, host=args.host, port=args.port, log_level=args.log_level)
+        return
+
+    model_server = subprocess.Popen([
+        sys.executable, "-m", "loadtest.model_server",
+        "--address", args.model_server,
+        "--step-ms", str(args.step_ms)
+    ])
+    try:
+        # Workers are fresh processes; they find the model server through the environment
+        work_dir = tempfile.mkdtemp(prefix="icon-loadtest-")
+        os.environ.setdefault("CACHE_DIR", os.path.join(work_dir, "cache"))
+        os.environ.setdefault("ARTIFACTS_DIR", os.path.join(work_dir, "artifacts"))
+        os.environ["MODEL_SERVER_ADDRESS"] = args.model_server
+        uvicorn.run("src.main:app", host=args.host, port=args.port, workers=args.workers, log_level=args.log_level)
+    finally:
+        model_server.terminate()
+        model_server.wait(timeout=10)
+
+if __name__ == "__main__":
+    main()
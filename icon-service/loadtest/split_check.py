@@ -0,0 +1,103 @@
+"""Smoke-check the model server split: stub model process plus IPC clients.
+
+Run from the icon-service directory:
+
+    python -m loadtest.split_check
+    python -m loadtest.split_check --clients 4 --requests 8
+
+Starts the stub model server, talks to it through RemoteModelService from
+several threads (one connection per simulated API worker), and checks the
+returned images, error mapping, cancellation and that no shared memory
+segments are left behind.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Set
+
+from src.services.cancellation import CancellationToken, GenerationCancelled
+from src.services.ipc import DEFAULT_AUTHKEY
+from src.services.model_client import RemoteModelService
+
+def shared_segments() -> Set[str]:
+    """Names of POSIX shared memory segments created by multiprocessing"""
+    try:
+        return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")}
+    except FileNotFoundError:
+        return set()
+
+def run_checks(address: str, args) -> Dict[str, object]:
+    failures: List[str] = []
+    clients = [RemoteModelService(address, DEFAULT_AUTHKEY, connect_timeout=60) for _ in range(args.clients)]
+    segments_before = shared_segments()
+
+    def generate(i: int):
+        client = clients[i % len(clients)]
+        image = client.generate_image(f"icon {i}", num_steps=args.steps, height=64, width=64, seed=i)
+        if image.size != (64, 64):
+            failures.append(f"request {i}: unexpected size {image.size}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients * 2) as pool:
+        list(pool.map(generate, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    try:
+        clients[0].redecode("no-such-generation")
+        failures.append("redecode of an unknown id did not raise KeyError")
+    except KeyError:
+        pass
+
+    token = CancellationToken()
+    threading.Timer(args.step_ms * 3 / 1000, token.cancel, args=("disconnected",)).start()
+    try:
+        clients[0].generate_image("cancelled icon", num_steps=200, height=64, width=64, cancel_token=token)
+        failures.append("cancelled generation completed")
+    except GenerationCancelled as e:
+        if e.reason != "disconnected":
+            failures.append(f"cancellation reason {e.reason!r}")
+
+    leaked = shared_segments() - segments_before
+    if leaked:
+        failures.append(f"leaked shared memory segments: {sorted(leaked)}")
+
+    return {
+        "requests": args.requests,
+        "clients": args.clients,
+        "seconds": round(elapsed, 3),
+        "images_per_s": round(args.requests / elapsed, 2),
+        "backend": clients[0].backend.name,
+        "failures": failures
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--step-ms", type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    address = os.path.join(tempfile.mkdtemp(prefix="icon-split-"), "model.sock")
+    server = subprocess.Popen([
+        sys.executable, "-m", "loadtest.model_server",
+        "--address", address,
+        "--step-ms", str(args.step_ms)
+    ])
+    try:
+        report = run_checks(address, args)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    print(json.dumps(report, indent=2))
+    return 1 if report["failures"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
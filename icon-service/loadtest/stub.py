@@ -0,0 +1,64 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from typing import List
+
+from PIL import Image
+
+class StubOutput:
+    """Mimics the diffusers pipeline output"""
+    def __init__(self, images: List[Image.Image]):
+        self.images = images
+
+class StubPipeline:
+    """Fast stand-in for StableDiffusionPipeline with a fixed cost per step"""
+    def __init__(self, step_ms: float = 5.0):
+        self.step_ms = step_ms
+
+    def to(self, device):
+        return self
+
+    def enable_attention_slicing(self, *args, **kwargs):
+        pass
+
+    def __call__(
+        self,
+        prompt: str,
+        num_inference_steps: int = 20,
+        height: int = 512,
+        width: int = 512,
+        callback=None,
+        callback_steps: int = 1,
+        **kwargs
+    ) -> StubOutput:
+        for step in range(num_inference_steps):
+            time.sleep(self.step_ms / 1000)
+            if callback is not None and step % callback_steps == 0:
+                callback(step, 0, None)
+
+        # Flat color derived from the prompt, like a trivially simple icon
+        color = tuple(hashlib.sha1(prompt.encode()).digest()[:3])
+        return StubOutput([Image.new("RGB", (width, height), color)])
+
+def install_stub(step_ms: float = 5.0, train_epoch_ms: float = 50.0) -> None:
+    """Patch the services so importing src.main never loads real models"""
+    work_dir = tempfile.mkdtemp(prefix="icon-loadtest-")
+    os.environ.setdefault("MODELS_DIR", os.path.join(work_dir, "models"))
+    os.environ.setdefault("CACHE_DIR", os.path.join(work_dir, "cache"))
+    os.environ.setdefault("FINE_TUNED_DIR", os.path.join(work_dir, "fine_tuned"))
+    os.environ.setdefault("ARTIFACTS_DIR", os.path.join(work_dir, "artifacts"))
+
+    from src.services.stable_diffusion import StableDiffusionService
+    from src.services.fine_tuning import FineTuningService
+
+    def initialize_stub_model(service):
+        service.pipeline = StubPipeline(step_ms)
+
+    async def stub_fine_tune_model(service, processed_images, num_epochs=20):
+        await asyncio.sleep(num_epochs * train_epoch_ms / 1000)
+        return {"status": "success", "model_path": str(service.model_path)}
+
+    StableDiffusionService._initialize_model = initialize_stub_model
+    FineTuningService.fine_tune_model = stub_fine_tune_model
@@ -0,0 +1,169 @@
+"""Render a JSONL catalog of /generate requests offline, in large batches.
+
+Run from the icon-service directory:
+
+    python -m src.batch catalog.jsonl --output icons/
+    python -m src.batch catalog.jsonl --output icons.zip --batch-size 16 --format webp
+
+The catalog uses the REQUEST_LOG_PATH format (or bare parameter objects).
+Finished items are checkpointed in the output directory (for a zip, in a
+staging directory next to it), so rerunning the same command after a
+crash only renders what is missing.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+import zipfile
+from pathlib import Path
+from typing import Any, Dict, List
+
+from .services.batch import BatchItem, parse_batch, plan_batches, render_batch
+
+logger = logging.getLogger("batch")
+
+CHECKPOINT_NAME = "checkpoint.jsonl"
+
+def load_checkpoint(path: Path) -> Dict[str, Dict[str, Any]]:
+    """Finished items by item_id; a torn last line from a crash is ignored"""
+    done = {}
+    if not path.exists():
+        return done
+    with path.open(encoding="utf-8") as checkpoint:
+        for line in checkpoint:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done[entry["item_id"]] = entry
+    return done
+
+def write_file(path: Path, data: bytes) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+def write_zip(output: Path, staging: Path, manifest: List[Dict[str, Any]]) -> None:
+    """Assemble the finished files into the output zip in one pass"""
+    tmp_path = output.with_name(output.name + ".tmp")
+    with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_STORED) as archive:
+        for entry in manifest:
+            archive.write(staging / entry["file"], entry["file"])
+        archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+    os.replace(tmp_path, output)
+
+def build_service():
+    from .services.encoding import ImageEncoder
+    from .services.stable_diffusion import StableDiffusionService
+
+    encoder = ImageEncoder(
+        max_workers=1,
+        png_compress_level=int(os.getenv("PNG_COMPRESS_LEVEL", "6")),
+        webp_quality=int(os.getenv("WEBP_QUALITY", "90")),
+        palette_tolerance=float(os.getenv("PNG_PALETTE_TOLERANCE", "0")),
+        avif_quality=int(os.getenv("AVIF_QUALITY", "70"))
+    )
+    service = StableDiffusionService(
+        encoder=encoder,
+        models_dir=os.getenv("MODELS_DIR", "/app/shared/models"),
+        cache_dir=os.getenv("CACHE_DIR", "/app/shared/cache")
+    )
+    return service, encoder
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("catalog", type=Path, help="JSONL of /generate requests")
+    parser.add_argument("--output", type=Path, required=True, help="output directory, or a .zip file")
+    parser.add_argument("--batch-size", type=int, default=8, help="images per diffusion run")
+    parser.add_argument("--format", default="png", help="default output format")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    to_zip = args.output.suffix == ".zip"
+    staging = args.output.with_name(args.output.name + ".parts") if to_zip else args.output
+    staging.mkdir(parents=True, exist_ok=True)
+    checkpoint_path = staging / CHECKPOINT_NAME
+
+    service, encoder = build_service()
+    if args.format not in encoder.supported_formats:
+        print(f"Unsupported output format: {args.format}", file=sys.stderr)
+        return 2
+
+    with args.catalog.open(encoding="utf-8") as catalog:
+        items, errors = parse_batch(
+            catalog,
+            resolution=service.resolution,
+            negotiate=encoder.negotiate,
+            resolve_decoder=service.resolve_decoder,
+            default_format=args.format
+        )
+    for error in errors:
+        logger.warning(f"Skipping line {error['index']}: {error['detail']}")
+
+    # Resume: skip items already written, unless their parameters changed
+    done = load_checkpoint(checkpoint_path)
+    pending: List[BatchItem] = [
+        item for item in items
+        if item.item_id not in done
+        or done[item.item_id]["digest"] != item.digest
+        or not (staging / done[item.item_id]["file"]).exists()
+    ]
+    batches = plan_batches(pending, max(args.batch_size, 1))
+    logger.info(f"{len(items)} items, {len(items) - len(pending)} already done, {len(batches)} batches to run")
+
+    started = time.perf_counter()
+    rendered = 0
+    failed = 0
+    with checkpoint_path.open("a", encoding="utf-8") as checkpoint:
+        for number, batch in enumerate(batches, start=1):
+            try:
+                images = render_batch(service, batch)
+            except Exception as e:
+                logger.error(f"Batch {number} failed: {str(e)}")
+                failed += len(batch)
+                continue
+
+            for item, image in zip(batch, images):
+                file_name = f"{item.item_id}.{item.output_format}"
+                write_file(staging / file_name, encoder.encode(image, item.output_format))
+                entry = {
+                    "item_id": item.item_id,
+                    "index": item.index,
+                    "request_id": item.request_id,
+                    "digest": item.digest,
+                    "prompt": item.params["prompt"],
+                    "seed": item.params["seed"],
+                    "file": file_name
+                }
+                done[item.item_id] = entry
+                checkpoint.write(json.dumps(entry) + "\n")
+
+            # One durable checkpoint write per batch
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+            rendered += len(batch)
+            elapsed = time.perf_counter() - started
+            logger.info(f"Batch {number}/{len(batches)}: {rendered} rendered, {rendered / elapsed * 60:.1f} images/min")
+
+    manifest = [
+        {key: value for key, value in done[item.item_id].items() if key != "digest"}
+        for item in items if item.item_id in done
+    ]
+    if to_zip:
+        if failed:
+            logger.warning(f"{failed} items failed; not writing {args.output} until a rerun completes them")
+        else:
+            write_zip(args.output, staging, manifest)
+            shutil.rmtree(staging)
+            logger.info(f"Wrote {len(manifest)} images to {args.output}")
+    else:
+        write_file(staging / "manifest.json", json.dumps(manifest, indent=2).encode())
+        logger.info(f"Wrote {len(manifest)} images to {args.output}")
+
+    return 1 if failed or errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,75 +1,940 @@
-from fastapi import FastAPI, Form, HTTPException, File, UploadFile
-from fastapi.responses import Response, JSONResponse
+from fastapi import APIRouter, FastAPI, Form, HTTPException, File, UploadFile, Header, Request
+from fastapi.responses import Response, JSONResponse, FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import logging
 import asyncio
+import json
+import mimetypes
+import os
+import re
+import time
+import uuid
+import zipfile
+from typing import Any, Callable, List, Optional, Tuple
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from starlette.concurrency import run_in_threadpool
-from .services.stable_diffusion import StableDiffusionService
-from .services.fine_tuning import FineTuningService, training_status
-from .services.state import generation_state
+from .services.state import generation_state, training_status
+from .services.request_log import RequestRecorder
+from .services.coalescing import RequestCoalescer
+from .services.cancellation import CancellationToken, GenerationCancelled, watch_request
+from .services.adaptive_quality import QualityController
+from .services.scheduler import FairScheduler, PRIORITIES, parse_role_weights
+from .services.artifacts import ArtifactStore, parse_range, etag_matches, iter_file_range
+from .services.container import ServiceContainer
+from .services.batch import BatchItem, parse_batch, plan_batches, render_batch
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# The model, training and image stacks (torch, diffusers, datasets, PIL)
+# are imported by the factories below on first use, so importing this
+# module stays cheap for worker start and --reload
+services = ServiceContainer()
 
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:3001"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+def _build_encoder():
+    from .services.encoding import ImageEncoder
+    return ImageEncoder(
+        max_workers=int(os.getenv("ENCODER_WORKERS", "2")),
+        png_compress_level=int(os.getenv("PNG_COMPRESS_LEVEL", "6")),
+        webp_quality=int(os.getenv("WEBP_QUALITY", "90")),
+        palette_tolerance=float(os.getenv("PNG_PALETTE_TOLERANCE", "0")),
+        avif_quality=int(os.getenv("AVIF_QUALITY", "70"))
+    )
+
+def _build_sd():
+    if os.getenv("MODEL_SERVER_ADDRESS"):
+        # The model lives in a separate model-server process shared by all workers
+        from .services.ipc import parse_address, resolve_authkey
+        from .services.model_client import RemoteModelService
+        address = parse_address(os.getenv("MODEL_SERVER_ADDRESS"))
+        return RemoteModelService(
+            address=address,
+            authkey=resolve_authkey(address, os.getenv("MODEL_SERVER_AUTHKEY")),
+            connect_timeout=float(os.getenv("MODEL_SERVER_CONNECT_TIMEOUT", "120"))
+        )
+    from .services.stable_diffusion import StableDiffusionService
+    return StableDiffusionService(
+        encoder=services.get("encoder"),
+        models_dir=os.getenv("MODELS_DIR", "/app/shared/models"),
+        cache_dir=os.getenv("CACHE_DIR", "/app/shared/cache")
+    )
+
+def _build_fine_tuning():
+    # Only the first /train pays for importing the training stack
+    from .services.fine_tuning import FineTuningService
+    return FineTuningService(
+        model_path=os.getenv("FINE_TUNED_DIR", "/app/models/fine_tuned")
+    )
+
+def _queue_role() -> Optional[str]:
+    """This node's part in the Redis job queue, or None when jobs run locally"""
+    if os.getenv("QUEUE_MODE", "local") != "redis":
+        return None
+    return os.getenv("QUEUE_ROLE", "both")
+
+def _runs_model() -> bool:
+    # API-only queue nodes hand generation to workers and never load the model
+    return _queue_role() != "api"
+
+def _build_quality():
+    # Degrades opted-in requests when the latency target is at risk
+    return QualityController(
+        p95_target_ms=float(os.getenv("QUALITY_P95_TARGET_MS")) if os.getenv("QUALITY_P95_TARGET_MS") else None,
+        default_resolution=(
+            services.get("sd").resolution if _runs_model()
+            else int(os.getenv("MODEL_RESOLUTION", "512"))
+        ),
+        low_resolution=int(os.getenv("QUALITY_LOW_RESOLUTION", "384")),
+        min_steps=int(os.getenv("QUALITY_MIN_STEPS", "10")),
+        # The backlog drains this many generations at a time
+        workers=int(os.getenv("INFERENCE_CONCURRENCY", "1"))
+    )
+
+def _build_jwt_auth():
+    # Tenants are identified from JWTs when a secret is configured
+    if not os.getenv("JWT_SECRET"):
+        return None
+    from shared.middleware.auth import JWTAuth
+    return JWTAuth(os.getenv("JWT_SECRET"))
+
+def _build_semantic_cache():
+    # Opt-in reuse of images generated for near-duplicate prompts
+    if os.getenv("SEMANTIC_CACHE_MODE", "off") == "off":
+        return None
+    if not _runs_model():
+        logger.warning("Semantic cache needs the model's text encoder; disabled on API-only queue nodes")
+        return None
+    sd_service = services.get("sd")
+    if sd_service.embedding_dim is None:
+        logger.warning("Semantic cache needs a pipeline with a text encoder; disabled")
+        return None
+    from .services.semantic_cache import SemanticPromptCache
+    return SemanticPromptCache(
+        cache_dir=os.path.join(os.getenv("CACHE_DIR", "/app/shared/cache"), "semantic"),
+        dim=sd_service.embedding_dim,
+        mode=os.getenv("SEMANTIC_CACHE_MODE"),
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+        capacity=int(os.getenv("SEMANTIC_CACHE_CAPACITY", "50000")),
+        ivf_threshold=int(os.getenv("SEMANTIC_CACHE_IVF_THRESHOLD", "20000"))
+    )
+
+def _build_artifacts():
+    # Generated outputs, served by hash from GET /artifacts/{id}
+    return ArtifactStore(
+        root=os.getenv("ARTIFACTS_DIR", "/app/shared/artifacts"),
+        max_bytes=int(os.getenv("ARTIFACTS_MAX_BYTES", str(5 * 1024 ** 3)))
+    )
+
+def _build_job_queue():
+    # Cluster-wide queue: API nodes enqueue /generate jobs, workers pull them
+    role = _queue_role()
+    if role is None:
+        return None
+    from .services.job_queue import QUEUE_ROLES, RedisJobQueue
+    if role not in QUEUE_ROLES:
+        raise ValueError(f"QUEUE_ROLE must be one of {', '.join(QUEUE_ROLES)}")
+    return RedisJobQueue(
+        url=os.getenv("REDIS_URL", "redis://redis:6379/0"),
+        prefix=os.getenv("QUEUE_PREFIX", "icon"),
+        consumer=os.getenv("QUEUE_CONSUMER") or None,
+        max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "32")),
+        claim_idle_ms=int(os.getenv("QUEUE_CLAIM_IDLE_MS", "60000")),
+        max_deliveries=int(os.getenv("QUEUE_MAX_DELIVERIES", "3")),
+        result_ttl=int(os.getenv("QUEUE_RESULT_TTL", "3600"))
+    )
+
+def _build_request_recorder():
+    # Optional JSONL capture of request parameters for load-test replay
+    return RequestRecorder(os.getenv("REQUEST_LOG_PATH")) if os.getenv("REQUEST_LOG_PATH") else None
+
+services.register("encoder", _build_encoder)
+services.register("sd", _build_sd)
+services.register("fine_tuning", _build_fine_tuning)
+services.register("quality", _build_quality)
+services.register("jwt_auth", _build_jwt_auth)
+services.register("semantic_cache", _build_semantic_cache)
+services.register("artifacts", _build_artifacts)
+services.register("request_recorder", _build_request_recorder)
+services.register("job_queue", _build_job_queue)
+
+# Fair-share queuing of inference across tenants
+scheduler = FairScheduler(
+    max_concurrency=int(os.getenv("INFERENCE_CONCURRENCY", "1")),
+    quantum=float(os.getenv("SCHEDULER_QUANTUM", "20"))
 )
+role_weights = parse_role_weights(os.getenv("SCHEDULER_ROLE_WEIGHTS", "admin=4,pro=2,user=1,anonymous=1"))
+
+# Identical concurrent generations share one run
+coalescer = RequestCoalescer()
+
+router = APIRouter()
+
+async def resolve_tenant(request: Request) -> Tuple[str, str]:
+    """Tenant id and role for scheduling, from the bearer token if any"""
+    jwt_auth = await services.aget("jwt_auth")
+    authorization = request.headers.get("Authorization")
+    if jwt_auth and authorization and authorization.startswith("Bearer "):
+        from shared.utils.error_handling import AuthenticationError
+        try:
+            payload = await jwt_auth.verify_token(authorization.split(" ", 1)[1])
+        except AuthenticationError as e:
+            raise HTTPException(status_code=401, detail=e.message)
+        return str(payload["user_id"]), payload.get("role", "user")
+
+    # Unauthenticated callers share fairness per client address
+    host = request.client.host if request.client else "unknown"
+    return f"anonymous:{host}", "anonymous"
+
+async def schedule_inference(
+    request: Request,
+    fn: Callable[[CancellationToken], Any],
+    cost: float,
+    priority: str = "interactive",
+    deadline_ms: Optional[int] = None
+) -> Any:
+    """Run fn on the inference pool in the caller's fair-share queue
+
+    The token passed to fn is cancelled on client disconnect or deadline.
+    """
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of {', '.join(PRIORITIES)}")
+    tenant, role = await resolve_tenant(request)
+    token = CancellationToken.from_deadline_ms(deadline_ms)
+    watcher = asyncio.create_task(watch_request(request, token))
+    try:
+        return await scheduler.submit(
+            lambda: fn(token),
+            tenant=tenant,
+            weight=role_weights.get(role, 1.0),
+            priority=priority,
+            cost=cost,
+            token=token,
+            role=role
+        )
+    except GenerationCancelled as e:
+        if e.reason == "deadline":
+            raise HTTPException(status_code=504, detail="Generation deadline exceeded")
+        raise HTTPException(status_code=499, detail=str(e))
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown or expired generation")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        watcher.cancel()
+
+# Set by the gateway so ids minted here lead follow-up requests back to this replica
+GENERATION_PREFIX = re.compile(r"^[0-9a-f]{8}$")
+
+# This replica's own prefix, for ids of queued jobs it runs for other nodes.
+# Learned from the gateway's health checks unless GENERATION_PREFIX is set.
+node_prefix = {"value": os.getenv("GENERATION_PREFIX", "")}
+
+def _with_prefix(generation_id: str, prefix: str) -> str:
+    if GENERATION_PREFIX.match(prefix):
+        return prefix + generation_id[len(prefix):]
+    return generation_id
+
+def mint_generation_id(request: Request) -> str:
+    """Fresh generation id, starting with the gateway's prefix for this replica if any"""
+    return _with_prefix(uuid.uuid4().hex, request.headers.get("x-generation-prefix", ""))
+
+async def run_queued_job(payload: dict, token: CancellationToken) -> dict:
+    """Run a /generate job taken from the Redis queue on this node's inference pool"""
+    sd_service = await services.aget("sd")
+    image_encoder = await services.aget("encoder")
+    artifact_store = await services.aget("artifacts")
+    params = dict(payload["params"])
+    # API-only nodes have no model to check decoder names against
+    params["decoder"] = sd_service.resolve_decoder(params["decoder"])
+    # The latents stay here, so the id must lead the gateway here rather than to the submitting node
+    generation_id = _with_prefix(payload.get("generation_id") or uuid.uuid4().hex, node_prefix["value"])
+
+    def run_inference():
+        inference_started = time.perf_counter()
+        image = sd_service.generate_image(cancel_token=token, generation_id=generation_id, **params)
+        return image, time.perf_counter() - inference_started
+
+    image, seconds = await scheduler.submit(
+        run_inference,
+        tenant=payload["tenant"],
+        weight=payload["weight"],
+        priority=payload["priority"],
+        cost=payload["cost"],
+        token=token,
+        role=payload.get("role", "default")
+    )
+    image_bytes = await image_encoder.encode_async(image, payload["output_format"])
+    artifact_id = await run_in_threadpool(artifact_store.put, image_bytes, payload["output_format"])
+    return {"generation_id": generation_id, "artifact_id": artifact_id, "seconds": seconds}
 
-# Initialize services
-sd_service = StableDiffusionService()
-fine_tuning_service = FineTuningService()
+def _write_zip(encoded: List[bytes], manifest: List[dict], output_format: str) -> str:
+    artifact_store = services.get("artifacts")
+    with artifact_store.writer("zip") as (zip_file, result):
+        with zipfile.ZipFile(zip_file, "w", zipfile.ZIP_STORED) as archive:
+            for entry, data in zip(manifest, encoded):
+                entry["file"] = f"{entry['generation_id']}.{output_format}"
+                entry["artifact_id"] = artifact_store.put(data, output_format)
+                archive.writestr(entry["file"], data)
+            archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+    return result["id"]
 
-@app.post("/generate")
+async def zip_response(images: List, manifest: List[dict], output_format: str) -> FileResponse:
+    """ZIP of encoded images plus a manifest.json, written to the artifact store and served from disk"""
+    image_encoder = await services.aget("encoder")
+    artifact_store = await services.aget("artifacts")
+    encoded = await asyncio.gather(*(image_encoder.encode_async(image, output_format) for image in images))
+    artifact_id = await run_in_threadpool(_write_zip, encoded, manifest, output_format)
+    return FileResponse(
+        artifact_store.path(artifact_id),
+        media_type="application/zip",
+        headers={"Vary": "Accept", "X-Artifact-Id": artifact_id, "ETag": f'"{artifact_id}"'}
+    )
+
+def _log_semantic_cache_failure(future: asyncio.Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Failed to index generation in the semantic cache: {str(future.exception())}")
+
+@router.post("/generate")
 async def generate_icon(
+    request: Request,
     prompt: str = Form(...),
     num_steps: int = Form(20),
-    guidance_scale: float = Form(7.5)
+    guidance_scale: float = Form(7.5),
+    guidance_cutoff: Optional[float] = Form(None),
+    fast_mode: bool = Form(False),
+    cache_interval: Optional[int] = Form(None),
+    decoder: str = Form("full"),
+    seed: Optional[int] = Form(None),
+    deadline_ms: Optional[int] = Form(None),
+    allow_degrade: bool = Form(False),
+    priority: str = Form("interactive"),
+    use_semantic_cache: bool = Form(True),
+    keep_trajectory: bool = Form(False),
+    accept: Optional[str] = Header(None)
 ):
     logger.info(f"Received request to generate icon with prompt: {prompt}")
+    sd_service = await services.aget("sd") if _runs_model() else None
+    job_queue = await services.aget("job_queue") if _queue_role() in ("api", "both") else None
+    image_encoder = await services.aget("encoder")
+    quality_controller = await services.aget("quality")
+    semantic_cache = await services.aget("semantic_cache")
+    artifact_store = await services.aget("artifacts")
+    request_recorder = await services.aget("request_recorder")
+    if guidance_cutoff is not None and not 0 <= guidance_cutoff <= 1:
+        raise HTTPException(status_code=400, detail="guidance_cutoff must be between 0 and 1")
+    if cache_interval is not None and cache_interval < 1:
+        raise HTTPException(status_code=400, detail="cache_interval must be at least 1")
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of {', '.join(PRIORITIES)}")
+    if sd_service is not None:
+        try:
+            decoder = sd_service.resolve_decoder(decoder)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    tenant, role = await resolve_tenant(request)
+    cancel_token = CancellationToken.from_deadline_ms(deadline_ms)
+    watcher = asyncio.create_task(watch_request(request, cancel_token))
     try:
         # Reset progress
         generation_state.reset()
+        output_format = image_encoder.negotiate(accept)
 
-        # Run generation in a separate thread
-        image_bytes = await run_in_threadpool(
-            sd_service.generate_icon,
-            prompt=prompt,
-            num_steps=min(num_steps, 50),
-            guidance_scale=min(guidance_scale, 20.0)
+        if request_recorder:
+            request_recorder.record("/generate", {
+                "prompt": prompt,
+                "num_steps": num_steps,
+                "guidance_scale": guidance_scale,
+                "guidance_cutoff": guidance_cutoff,
+                "fast_mode": fast_mode,
+                "cache_interval": cache_interval,
+                "decoder": decoder,
+                "seed": seed,
+                "deadline_ms": deadline_ms,
+                "allow_degrade": allow_degrade,
+                "priority": priority,
+                "use_semantic_cache": use_semantic_cache,
+                "keep_trajectory": keep_trajectory,
+                "accept": accept
+            })
+
+        quality_controller.started()
+        plan = quality_controller.plan(min(num_steps, 50), allow_degrade=allow_degrade)
+
+        params = {
+            "prompt": prompt,
+            "num_steps": plan.num_steps,
+            "guidance_scale": min(guidance_scale, 20.0),
+            "guidance_cutoff": guidance_cutoff,
+            "fast_mode": fast_mode,
+            "cache_interval": min(cache_interval, 10) if cache_interval else None,
+            "decoder": decoder,
+            "seed": seed,
+            "height": plan.resolution,
+            "width": plan.resolution,
+            "scheduler": plan.scheduler,
+            "keep_trajectory": keep_trajectory
+        }
+
+        # Near-duplicate prompts: serve (unseeded) or offer a cached image
+        embedding = None
+        semantic_headers = {}
+        try:
+            if semantic_cache is not None and use_semantic_cache:
+                embedding = await run_in_threadpool(sd_service.prompt_embedding, prompt)
+                settings_key = semantic_cache.settings_key(params)
+                matches = await run_in_threadpool(semantic_cache.lookup, embedding, settings_key)
+                if matches:
+                    best = matches[0]
+                    semantic_headers = {
+                        "X-Semantic-Cache": "hit",
+                        "X-Semantic-Similarity": f"{best['similarity']:.4f}",
+                        "X-Semantic-Candidate": f"/semantic-cache/{best['id']}"
+                    }
+                    # A seed asks for that exact image, so never substitute one
+                    if semantic_cache.mode == "return" and seed is None:
+                        cached_image = await run_in_threadpool(semantic_cache.load_image, best["id"])
+                        if cached_image is not None:
+                            content = await image_encoder.encode_async(cached_image, output_format)
+                            quality_controller.abandoned()
+                            return Response(
+                                content=content,
+                                media_type=image_encoder.media_type(output_format),
+                                headers={"Vary": "Accept", **semantic_headers}
+                            )
+                else:
+                    semantic_headers = {"X-Semantic-Cache": "miss"}
+        except BaseException:
+            quality_controller.abandoned()
+            raise
+
+        inference = {}
+
+        # Charge tenants roughly by the denoising work they ask for
+        cost = plan.num_steps * (plan.resolution / quality_controller.default_resolution) ** 2
+
+        def run_inference(token: CancellationToken, generation_id: str):
+            inference_started = time.perf_counter()
+            image = sd_service.generate_image(cancel_token=token, generation_id=generation_id, **params)
+            inference["seconds"] = time.perf_counter() - inference_started
+            return image
+
+        async def compute_queued(token: CancellationToken):
+            # Whichever worker has a free slot runs it; the image comes back through the shared store
+            result = await job_queue.submit(
+                {
+                    "params": params,
+                    "output_format": output_format,
+                    "generation_id": mint_generation_id(request),
+                    "tenant": tenant,
+                    "weight": role_weights.get(role, 1.0),
+                    "role": role,
+                    "priority": priority,
+                    "cost": cost
+                },
+                priority=priority,
+                token=token
+            )
+            image_bytes = await run_in_threadpool(artifact_store.read, result["artifact_id"])
+            if image_bytes is None:
+                raise RuntimeError(f"Artifact {result['artifact_id']} is not in the shared store")
+            inference["seconds"] = result["seconds"]
+            return result["generation_id"], image_bytes, result["artifact_id"]
+
+        async def compute(token: CancellationToken):
+            if job_queue is not None:
+                return await compute_queued(token)
+
+            # Latents are kept under this id so a draft can be decoded again
+            generation_id = mint_generation_id(request)
+
+            # Wait for this tenant's turn on the inference pool
+            image = await scheduler.submit(
+                lambda: run_inference(token, generation_id),
+                tenant=tenant,
+                weight=role_weights.get(role, 1.0),
+                priority=priority,
+                cost=cost,
+                token=token,
+                role=role
+            )
+
+            if embedding is not None:
+                # Index the result in the background; the response need not wait
+                asyncio.get_running_loop().run_in_executor(
+                    None, semantic_cache.add, embedding, prompt, settings_key, image
+                ).add_done_callback(_log_semantic_cache_failure)
+
+            # Encode on the encoder pool so inference threads stay free
+            image_bytes = await image_encoder.encode_async(image, output_format)
+            artifact_id = await run_in_threadpool(artifact_store.put, image_bytes, output_format)
+            return generation_id, image_bytes, artifact_id
+
+        # Only seeded requests are deterministic enough to share a result
+        key = (
+            coalescer.make_key({**params, "output_format": output_format})
+            if seed is not None else None
+        )
+        try:
+            generation_id, image_bytes, artifact_id = await coalescer.run(key, compute, cancel_token)
+        except BaseException:
+            quality_controller.abandoned()
+            raise
+        if "seconds" in inference:
+            quality_controller.finished(inference["seconds"], plan)
+        else:
+            # Joined someone else's run; no timing sample of our own
+            quality_controller.abandoned()
+
+        return Response(
+            content=image_bytes,
+            media_type=image_encoder.media_type(output_format),
+            headers={
+                "Vary": "Accept",
+                "X-Generation-Id": generation_id,
+                "X-Artifact-Id": artifact_id,
+                "X-Decoder": decoder,
+                **plan.headers(),
+                **semantic_headers
+            }
         )
-        
-        return Response(content=image_bytes, media_type="image/png")
 
+    except GenerationCancelled as e:
+        if e.reason == "deadline":
+            raise HTTPException(status_code=504, detail="Generation deadline exceeded")
+        # 499: client closed the request; nobody is listening for the body
+        raise HTTPException(status_code=499, detail=str(e))
+    except ValueError as e:
+        # Parameters a queue worker rejected, e.g. an unknown decoder
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error during icon generation: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        watcher.cancel()
+
+@router.post("/generate/{generation_id}/decode")
+async def decode_generation(
+    request: Request,
+    generation_id: str,
+    decoder: str = Form("full"),
+    accept: Optional[str] = Header(None)
+):
+    """Decode a previous generation's latents again, e.g. a tiny-decoder draft at full quality"""
+    sd_service = await services.aget("sd")
+    image_encoder = await services.aget("encoder")
+    try:
+        decoder = sd_service.resolve_decoder(decoder)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    output_format = image_encoder.negotiate(accept)
+
+    # A decode is roughly one denoising step of work
+    image = await schedule_inference(request, lambda token: sd_service.redecode(generation_id, decoder), cost=1.0)
+
+    return Response(
+        content=await image_encoder.encode_async(image, output_format),
+        media_type=image_encoder.media_type(output_format),
+        headers={"Vary": "Accept", "X-Generation-Id": generation_id, "X-Decoder": decoder}
+    )
+
+@router.post("/generate/{generation_id}/variations")
+async def generate_variations(
+    request: Request,
+    generation_id: str,
+    count: int = Form(4),
+    strength: float = Form(0.5),
+    num_steps: Optional[int] = Form(None),
+    prompt: Optional[str] = Form(None),
+    seed: Optional[int] = Form(None),
+    priority: str = Form("interactive"),
+    deadline_ms: Optional[int] = Form(None),
+    accept: Optional[str] = Header(None)
+):
+    """Variations of a previous generation, re-running only part of the schedule"""
+    sd_service = await services.aget("sd")
+    image_encoder = await services.aget("encoder")
+    if not 0 < strength <= 1:
+        raise HTTPException(status_code=400, detail="strength must be in (0, 1]")
+    count = min(max(count, 1), 8)
+    num_steps = min(num_steps, 50) if num_steps else None
+    output_format = image_encoder.negotiate(accept)
+    generation_ids = [mint_generation_id(request) for _ in range(count)]
 
-@app.get("/generate/progress")
+    images = await schedule_inference(
+        request,
+        lambda token: sd_service.generate_variations(
+            generation_id,
+            count,
+            strength=strength,
+            seed=seed,
+            generation_ids=generation_ids,
+            num_steps=num_steps,
+            prompt=prompt,
+            cancel_token=token
+        ),
+        cost=count * (num_steps or 20) * strength,
+        priority=priority,
+        deadline_ms=deadline_ms
+    )
+
+    manifest = [
+        {"generation_id": new_id, "parent_id": generation_id, "seed": seed + i if seed is not None else None}
+        for i, new_id in enumerate(generation_ids)
+    ]
+    return await zip_response(images, manifest, output_format)
+
+@router.post("/generate/{generation_id}/refine")
+async def refine_generation(
+    request: Request,
+    generation_id: str,
+    num_steps: Optional[int] = Form(None),
+    from_step: Optional[int] = Form(None),
+    strength: float = Form(0.3),
+    prompt: Optional[str] = Form(None),
+    guidance_scale: Optional[float] = Form(None),
+    decoder: str = Form("full"),
+    priority: str = Form("interactive"),
+    deadline_ms: Optional[int] = Form(None),
+    accept: Optional[str] = Header(None)
+):
+    """Continue a previous generation with more steps or a tweaked prompt"""
+    sd_service = await services.aget("sd")
+    image_encoder = await services.aget("encoder")
+    if not 0 < strength <= 1:
+        raise HTTPException(status_code=400, detail="strength must be in (0, 1]")
+    try:
+        decoder = sd_service.resolve_decoder(decoder)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    num_steps = min(num_steps, 50) if num_steps else None
+    output_format = image_encoder.negotiate(accept)
+    new_generation_id = mint_generation_id(request)
+
+    image = await schedule_inference(
+        request,
+        lambda token: sd_service.refine(
+            generation_id,
+            from_step=from_step,
+            strength=strength,
+            new_generation_id=new_generation_id,
+            num_steps=num_steps,
+            prompt=prompt,
+            guidance_scale=min(guidance_scale, 20.0) if guidance_scale is not None else None,
+            decoder=decoder,
+            cancel_token=token
+        ),
+        cost=(num_steps or 20) * strength,
+        priority=priority,
+        deadline_ms=deadline_ms
+    )
+
+    return Response(
+        content=await image_encoder.encode_async(image, output_format),
+        media_type=image_encoder.media_type(output_format),
+        headers={"Vary": "Accept", "X-Generation-Id": new_generation_id, "X-Decoder": decoder}
+    )
+
+@router.post("/generate/sweep")
+async def generate_sweep(
+    request: Request,
+    prompt: str = Form(...),
+    seeds: Optional[str] = Form(None),
+    count: int = Form(4),
+    num_steps: int = Form(20),
+    guidance_scale: float = Form(7.5),
+    guidance_cutoff: Optional[float] = Form(None),
+    priority: str = Form("interactive"),
+    deadline_ms: Optional[int] = Form(None),
+    accept: Optional[str] = Header(None)
+):
+    """Same prompt over several seeds in one batched run sharing the prompt embeddings"""
+    sd_service = await services.aget("sd")
+    image_encoder = await services.aget("encoder")
+    try:
+        seed_list = [int(seed) for seed in seeds.split(",")] if seeds else list(range(min(max(count, 1), 8)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="seeds must be a comma-separated list of integers")
+    if len(seed_list) > 8:
+        raise HTTPException(status_code=400, detail="At most 8 seeds per sweep")
+    num_steps = min(num_steps, 50)
+    output_format = image_encoder.negotiate(accept)
+    generation_ids = [mint_generation_id(request) for _ in seed_list]
+
+    images = await schedule_inference(
+        request,
+        lambda token: sd_service.generate_images(
+            prompt,
+            seed_list,
+            generation_ids,
+            num_steps=num_steps,
+            guidance_scale=min(guidance_scale, 20.0),
+            guidance_cutoff=guidance_cutoff,
+            cancel_token=token
+        ),
+        cost=len(seed_list) * num_steps,
+        priority=priority,
+        deadline_ms=deadline_ms
+    )
+
+    manifest = [
+        {"generation_id": generation_id, "seed": seed}
+        for generation_id, seed in zip(generation_ids, seed_list)
+    ]
+    return await zip_response(images, manifest, output_format)
+
+async def read_body_lines(request: Request, max_bytes: int) -> List[str]:
+    """Request body as text lines, read as it arrives and refused past max_bytes"""
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Request body is larger than {max_bytes} bytes")
+    lines: List[str] = []
+    pending = b""
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Request body is larger than {max_bytes} bytes")
+        *complete, pending = (pending + chunk).split(b"\n")
+        lines.extend(line.decode("utf-8", errors="replace") for line in complete)
+    if pending:
+        lines.append(pending.decode("utf-8", errors="replace"))
+    return lines
+
+@router.post("/generate/batch")
+async def generate_batch(
+    request: Request,
+    batch_size: int = 8,
+    output_format: str = "png",
+    priority: str = "bulk",
+    deadline_ms: Optional[int] = None
+):
+    """Render a JSONL batch of /generate requests, streaming NDJSON status lines as items finish
+
+    Lines use the REQUEST_LOG_PATH format (or are bare parameter objects).
+    Items sharing their settings run together in batches of batch_size.
+    """
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of {', '.join(PRIORITIES)}")
+    sd_service = await services.aget("sd")
+    image_encoder = await services.aget("encoder")
+    artifact_store = await services.aget("artifacts")
+    if output_format not in image_encoder.supported_formats:
+        raise HTTPException(status_code=400, detail=f"Unsupported output format: {output_format}")
+
+    lines = await read_body_lines(request, int(os.getenv("BATCH_MAX_BYTES", str(16 * 1024 * 1024))))
+    try:
+        items, errors = parse_batch(
+            lines,
+            resolution=sd_service.resolution,
+            negotiate=image_encoder.negotiate,
+            resolve_decoder=sd_service.resolve_decoder,
+            default_format=output_format,
+            max_items=int(os.getenv("BATCH_MAX_ITEMS", "10000"))
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    batches = plan_batches(items, min(max(batch_size, 1), 16))
+
+    tenant, role = await resolve_tenant(request)
+    token = CancellationToken.from_deadline_ms(deadline_ms)
+
+    async def run(batch: List[BatchItem]) -> List[dict]:
+        generation_ids = [mint_generation_id(request) for _ in batch]
+        try:
+            images = await scheduler.submit(
+                lambda: render_batch(sd_service, batch, generation_ids, token),
+                tenant=tenant,
+                weight=role_weights.get(role, 1.0),
+                priority=priority,
+                cost=len(batch) * batch[0].params["num_steps"],
+                token=token,
+                role=role
+            )
+        except GenerationCancelled as e:
+            return [item.status("cancelled", detail=e.reason) for item in batch]
+        except Exception as e:
+            logger.error(f"Batch of {len(batch)} failed: {str(e)}")
+            return [item.status("error", detail=str(e)) for item in batch]
+
+        lines = []
+        for item, generation_id, image in zip(batch, generation_ids, images):
+            data = await image_encoder.encode_async(image, item.output_format)
+            artifact_id = await run_in_threadpool(artifact_store.put, data, item.output_format)
+            lines.append(item.status(
+                "done",
+                generation_id=generation_id,
+                seed=item.params["seed"],
+                artifact_id=artifact_id,
+                url=f"/artifacts/{artifact_id}"
+            ))
+        return lines
+
+    async def stream():
+        yield json.dumps({"status": "accepted", "items": len(items), "invalid": len(errors), "batches": len(batches)}) + "\n"
+        for error in errors:
+            yield json.dumps(error) + "\n"
+
+        # Queue every batch at once; the scheduler decides the order and results stream as they land
+        tasks = [asyncio.ensure_future(run(batch)) for batch in batches]
+        counts = {"done": 0, "error": len(errors), "cancelled": 0}
+        try:
+            for finished in asyncio.as_completed(tasks):
+                for line in await finished:
+                    counts[line["status"]] += 1
+                    yield json.dumps(line) + "\n"
+        finally:
+            if not all(task.done() for task in tasks):
+                # The client went away; drop whatever is still queued
+                token.cancel("disconnected")
+                for task in tasks:
+                    task.cancel()
+        yield json.dumps({"status": "complete", **counts}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@router.get("/generate/progress")
 async def get_generation_progress():
     """Get the current generation progress"""
-    return JSONResponse(content=generation_state.get_progress())
+    sd_service = services.peek("sd")
+    if sd_service is None:
+        return JSONResponse(content=generation_state.get_progress())
+    return JSONResponse(content=await run_in_threadpool(sd_service.get_progress))
+
+@router.get("/generate/preview")
+async def get_generation_preview():
+    """Latest tiny-decoder preview of the running generation"""
+    image_encoder = await services.aget("encoder")
+    sd_service = services.peek("sd")
+    preview = await run_in_threadpool(sd_service.get_preview) if sd_service is not None else None
+    if preview is None:
+        raise HTTPException(status_code=404, detail="No preview available")
+    return Response(content=await image_encoder.encode_async(preview, "png"), media_type="image/png")
+
+@router.get("/semantic-cache/candidates")
+async def semantic_cache_candidates(prompt: str, limit: int = 4):
+    """Cached images for prompts similar to this one, for instant candidates"""
+    semantic_cache = await services.aget("semantic_cache")
+    if semantic_cache is None:
+        raise HTTPException(status_code=404, detail="Semantic cache is disabled")
+    sd_service = await services.aget("sd")
+    embedding = await run_in_threadpool(sd_service.prompt_embedding, prompt)
+    matches = await run_in_threadpool(semantic_cache.lookup, embedding, k=min(max(limit, 1), 16))
+    return JSONResponse(content=[
+        {
+            "id": match["id"],
+            "prompt": match["prompt"],
+            "similarity": round(match["similarity"], 4),
+            "url": f"/semantic-cache/{match['id']}"
+        }
+        for match in matches
+    ])
+
+@router.get("/semantic-cache/{entry_id}")
+async def semantic_cache_image(entry_id: str, accept: Optional[str] = Header(None)):
+    """Image stored in the semantic cache"""
+    semantic_cache = await services.aget("semantic_cache")
+    if semantic_cache is None:
+        raise HTTPException(status_code=404, detail="Semantic cache is disabled")
+    image = await run_in_threadpool(semantic_cache.load_image, entry_id)
+    if image is None:
+        raise HTTPException(status_code=404, detail="Unknown or evicted cache entry")
+    image_encoder = await services.aget("encoder")
+    output_format = image_encoder.negotiate(accept)
+    return Response(
+        content=await image_encoder.encode_async(image, output_format),
+        media_type=image_encoder.media_type(output_format),
+        headers={"Vary": "Accept"}
+    )
+
+@router.get("/artifacts/{artifact_id}")
+async def get_artifact(request: Request, artifact_id: str):
+    """Serve a stored artifact with a strong ETag, immutable caching and byte ranges"""
+    artifact_store = await services.aget("artifacts")
+    path = artifact_store.path(artifact_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Unknown artifact")
+
+    # Content-addressed: the hash is the validator and the bytes never change
+    etag = f'"{artifact_id}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes"
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    from .services.encoding import MEDIA_TYPES
+    extension = path.suffix.lstrip(".")
+    media_type = MEDIA_TYPES.get(extension) or mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range.strip() != etag:
+        range_header = None
+
+    # Collection may delete the file at any point; open it before answering
+    try:
+        size = path.stat().st_size
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        start, end = byte_range or (0, size - 1)
+        body = iter_file_range(path, start, end)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Unknown artifact")
+    artifact_store.touch(path)
+
+    if byte_range is None:
+        return StreamingResponse(
+            body,
+            media_type=media_type,
+            headers={**headers, "Content-Length": str(size)}
+        )
+
+    return StreamingResponse(
+        body,
+        status_code=206,
+        media_type=media_type,
+        headers={
+            **headers,
+            "Content-Range": f"bytes {start}-{end}/{size}",
+            "Content-Length": str(end - start + 1)
+        }
+    )
 
-@app.get("/health")
-async def health_check():
+@router.get("/metrics")
+async def metrics():
+    """Prometheus metrics"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@router.get("/health")
+async def health_check(request: Request):
     logger.info("Health check requested.")
+    prefix = request.headers.get("x-generation-prefix", "")
+    if GENERATION_PREFIX.match(prefix) and not os.getenv("GENERATION_PREFIX"):
+        node_prefix["value"] = prefix
     try:
-        # Verify services are initialized
-        if not sd_service or not fine_tuning_service:
-            return {"status": "unhealthy", "detail": "Services not initialized"}
-        return {"status": "healthy"}
+        if not _runs_model():
+            return {"status": "healthy", "queue_role": "api"}
+        # The model loads in the background after startup
+        sd_service = services.peek("sd")
+        if sd_service is None:
+            return {"status": "loading"}
+        return {
+            "status": "healthy",
+            "backend": sd_service.backend.name,
+            # Read by the gateway to report per-replica load
+            "queue_depth": scheduler.queue_depth(),
+            "running": scheduler.running
+        }
     except Exception as e:
         logger.error(f"Health check failed: {str(e)}")
         return {"status": "unhealthy", "detail": str(e)}
 
-@app.post("/train")
+@router.post("/train")
 async def train_model(
     file: UploadFile = File(...),
     num_epochs: int = Form(20)
@@ -100,9 +965,18 @@ async def train_model(
                     detail="File too large. Please limit to 100MB of images."
                 )
             file_bytes.extend(chunk)
+
+        request_recorder = await services.aget("request_recorder")
+        if request_recorder:
+            request_recorder.record("/train", {
+                "num_epochs": num_epochs,
+                "filename": file.filename,
+                "file_size": file_size
+            })
         
         # Process training images
         training_status.update("processing_images")
+        fine_tuning_service = await services.aget("fine_tuning")
         processed_images = await fine_tuning_service.process_training_images(bytes(file_bytes))
         
         if len(processed_images) < 5:
@@ -125,4 +999,69 @@ async def train_model(
     except Exception as e:
         logger.error(f"Training error: {str(e)}")
         training_status.update("error", error=str(e))
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+def create_app() -> FastAPI:
+    """Build the API; subsystems load on first use rather than at import"""
+    app = FastAPI()
+
+    # Add CORS middleware
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["http://localhost:3001"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.include_router(router)
+
+    @app.on_event("startup")
+    async def check_model_server_authkey():
+        # Fail the worker now rather than on the first generation
+        if os.getenv("MODEL_SERVER_ADDRESS"):
+            from .services.ipc import parse_address, resolve_authkey
+            resolve_authkey(parse_address(os.getenv("MODEL_SERVER_ADDRESS")), os.getenv("MODEL_SERVER_AUTHKEY"))
+
+    @app.on_event("startup")
+    async def preload_model():
+        # Load the model in the background so the worker starts serving at once
+        if os.getenv("PRELOAD_MODEL", "1") != "1" or not _runs_model():
+            return
+
+        async def preload():
+            try:
+                await services.aget("sd")
+            except Exception as e:
+                # Retried by the first request that needs the model
+                logger.error(f"Model preload failed: {str(e)}")
+
+        app.state.preload = asyncio.create_task(preload())
+
+    @app.on_event("startup")
+    async def start_job_queue():
+        role = _queue_role()
+        if role is None:
+            return
+        job_queue = await services.aget("job_queue")
+        if role in ("api", "both"):
+            await job_queue.start_api()
+        if role in ("worker", "both"):
+            # Pull only as many jobs as the local inference pool can run
+            app.state.queue_worker = asyncio.create_task(
+                job_queue.run_worker(run_queued_job, concurrency=scheduler.max_concurrency)
+            )
+
+    @app.on_event("shutdown")
+    async def stop_job_queue():
+        job_queue = services.peek("job_queue")
+        if job_queue is None:
+            return
+        worker = getattr(app.state, "queue_worker", None)
+        if worker is not None:
+            worker.cancel()
+        # Unfinished jobs stay pending and are reclaimed by other workers
+        await job_queue.close()
+
+    return app
+
+app = create_app()
@@ -0,0 +1,37 @@
+"""Run the diffusion model in its own process for API workers to share.
+
+    python -m src.model_server
+
+API workers started with MODEL_SERVER_ADDRESS set to the same address
+forward generations here instead of loading the model themselves.
+"""
+import logging
+import os
+
+from .services.encoding import ImageEncoder
+from .services.ipc import parse_address, resolve_authkey
+from .services.model_server import ModelServer
+from .services.stable_diffusion import StableDiffusionService
+
+logging.basicConfig(level=logging.INFO)
+
+def main() -> None:
+    address = parse_address(os.getenv("MODEL_SERVER_ADDRESS", "/tmp/microdawgs-model.sock"))
+    # Checked before the model loads so a misconfigured server fails at once
+    authkey = resolve_authkey(address, os.getenv("MODEL_SERVER_AUTHKEY"))
+    service = StableDiffusionService(
+        encoder=ImageEncoder(max_workers=1),
+        models_dir=os.getenv("MODELS_DIR", "/app/shared/models"),
+        cache_dir=os.getenv("CACHE_DIR", "/app/shared/cache")
+    )
+    server = ModelServer(
+        service,
+        address=address,
+        authkey=authkey,
+        max_concurrency=int(os.getenv("INFERENCE_CONCURRENCY", "1")),
+        quantum=float(os.getenv("SCHEDULER_QUANTUM", "20"))
+    )
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+from collections import deque
+from typing import Deque, Dict, Optional
+import logging
+import statistics
+import threading
+from .metrics import QUALITY_TIER, QUALITY_PREDICTED_SECONDS
+
+class QualityPlan:
+    """Generation settings actually used for a request"""
+    def __init__(
+        self,
+        tier: str,
+        num_steps: int,
+        resolution: int,
+        scheduler: Optional[str] = None,
+        predicted_seconds: Optional[float] = None
+    ):
+        self.tier = tier
+        self.num_steps = num_steps
+        self.resolution = resolution
+        self.scheduler = scheduler
+        self.predicted_seconds = predicted_seconds
+
+    def headers(self) -> Dict[str, str]:
+        """Response headers describing the tier that was served"""
+        return {
+            "X-Quality-Tier": self.tier,
+            "X-Num-Steps": str(self.num_steps),
+            "X-Resolution": str(self.resolution),
+            "X-Scheduler": self.scheduler or "default"
+        }
+
+class QualityController:
+    """Lowers generation cost for opted-in requests when the p95 target is at risk
+
+    Latency is predicted from the current queue depth and the recent
+    per-step latency (normalized to the default resolution). If the
+    prediction misses the target, degrade in order: fewer steps, a
+    cheaper multistep scheduler, then a lower resolution.
+    """
+    def __init__(
+        self,
+        p95_target_ms: Optional[float] = None,
+        default_resolution: int = 512,
+        low_resolution: int = 384,
+        min_steps: int = 10,
+        fast_scheduler: str = "dpm",
+        fast_scheduler_steps: int = 12,
+        workers: int = 1,
+        window: int = 200
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.p95_target_s = p95_target_ms / 1000 if p95_target_ms else None
+        self.default_resolution = default_resolution
+        self.low_resolution = low_resolution
+        self.min_steps = min_steps
+        self.fast_scheduler = fast_scheduler
+        self.fast_scheduler_steps = fast_scheduler_steps
+        self.workers = max(1, workers)
+        self._step_seconds: Deque[float] = deque(maxlen=window)
+        self._request_steps: Deque[int] = deque(maxlen=window)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.p95_target_s is not None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._in_flight
+
+    def _resolution_factor(self, resolution: int) -> float:
+        """UNet cost scales roughly with the number of latent pixels"""
+        return (resolution / self.default_resolution) ** 2
+
+    def started(self) -> None:
+        with self._lock:
+            self._in_flight += 1
+
+    def finished(self, elapsed_s: float, plan: QualityPlan) -> None:
+        """Record a completed generation"""
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            if plan.num_steps > 0:
+                normalized = elapsed_s / plan.num_steps / self._resolution_factor(plan.resolution)
+                self._step_seconds.append(normalized)
+                self._request_steps.append(plan.num_steps)
+
+    def abandoned(self) -> None:
+        """A request left without a usable timing sample"""
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+
+    def _predict(self, step_s: float, backlog_s: float, num_steps: int, resolution: int) -> float:
+        return backlog_s + num_steps * step_s * self._resolution_factor(resolution)
+
+    def plan(self, num_steps: int, allow_degrade: bool = False) -> QualityPlan:
+        """Choose the quality tier for a new request"""
+        resolution = self.default_resolution
+        with self._lock:
+            samples = list(self._step_seconds)
+            recent_steps = list(self._request_steps)
+            ahead = max(0, self._in_flight - 1)
+
+        if not self.enabled or not samples:
+            return self._chosen(QualityPlan("full", num_steps, resolution))
+
+        step_s = statistics.median(samples)
+        backlog_s = ahead * statistics.mean(recent_steps) * step_s / self.workers
+        predicted = self._predict(step_s, backlog_s, num_steps, resolution)
+        if predicted <= self.p95_target_s or not allow_degrade:
+            return self._chosen(QualityPlan("full", num_steps, resolution, predicted_seconds=predicted))
+
+        # Tier 1: as many steps as still fit the budget, never more than asked for
+        budget_steps = int((self.p95_target_s - backlog_s) / step_s)
+        steps = min(num_steps, max(self.min_steps, budget_steps))
+        predicted = self._predict(step_s, backlog_s, steps, resolution)
+        if predicted <= self.p95_target_s and steps < num_steps:
+            return self._chosen(QualityPlan("reduced_steps", steps, resolution, predicted_seconds=predicted))
+
+        # Tier 2: a multistep solver keeps quality at far fewer steps
+        steps = min(steps, self.fast_scheduler_steps)
+        predicted = self._predict(step_s, backlog_s, steps, resolution)
+        if predicted <= self.p95_target_s:
+            return self._chosen(QualityPlan("fast_scheduler", steps, resolution, self.fast_scheduler, predicted))
+
+        # Tier 3: drop the resolution as well
+        resolution = self.low_resolution
+        predicted = self._predict(step_s, backlog_s, steps, resolution)
+        return self._chosen(QualityPlan("low_resolution", steps, resolution, self.fast_scheduler, predicted))
+
+    def _chosen(self, plan: QualityPlan) -> QualityPlan:
+        QUALITY_TIER.labels(tier=plan.tier).inc()
+        if plan.predicted_seconds is not None:
+            QUALITY_PREDICTED_SECONDS.set(plan.predicted_seconds)
+        return plan
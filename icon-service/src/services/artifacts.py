@@ -0,0 +1,239 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from .locks import file_lock
+
+HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+# An entity tag in a list: optional W/ then a quoted opaque string
+ENTITY_TAG_PATTERN = re.compile(r'(?:W/)?"[^"]*"')
+
+class ArtifactStore:
+    """Content-addressed files on the shared volume
+
+    Artifacts are named by the SHA-256 of their bytes, so identical
+    outputs are stored once and a name never changes meaning. Writes go
+    to a temp file and are renamed into place. When the store grows
+    past max_bytes, the least recently used files are deleted.
+
+    Several worker processes write to the same directory, so the size
+    is taken from a scan of the disk, repeated whenever this process has
+    written another scan_fraction of the budget, and only one process
+    collects at a time.
+    """
+    def __init__(
+        self,
+        root: str = "/app/shared/artifacts",
+        max_bytes: int = 5 * 1024 ** 3,
+        scan_fraction: float = 0.05
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.root = Path(root)
+        self.tmp_dir = self.root / "tmp"
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._scan_bytes = int(max_bytes * scan_fraction)
+        # Size at the last scan plus what this process wrote since
+        self.total_bytes = self._disk_bytes()
+        self._unscanned_bytes = 0
+
+    @property
+    def _lock_path(self) -> Path:
+        return self.root / "gc.lock"
+
+    def _disk_bytes(self) -> int:
+        total = 0
+        for path in self._files():
+            try:
+                total += path.stat().st_size
+            except FileNotFoundError:
+                # Collected by another process mid-scan
+                pass
+        return total
+
+    def _files(self) -> Iterator[Path]:
+        for shard in self.root.iterdir():
+            if shard.is_dir() and shard != self.tmp_dir:
+                yield from (path for path in shard.iterdir() if path.is_file())
+
+    def _target(self, digest: str, extension: str) -> Path:
+        return self.root / digest[:2] / f"{digest}.{extension}"
+
+    def _commit(self, tmp_path: Path, digest: str, extension: str) -> str:
+        target = self._target(digest, extension)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            if target.exists():
+                # Same content already stored; refresh it for LRU purposes
+                tmp_path.unlink(missing_ok=True)
+                os.utime(target)
+                return digest
+            size = tmp_path.stat().st_size
+            os.replace(tmp_path, target)
+            self.total_bytes += size
+            self._unscanned_bytes += size
+        if self.total_bytes > self.max_bytes or self._unscanned_bytes >= self._scan_bytes:
+            self.collect_garbage()
+        return digest
+
+    def put(self, data: bytes, extension: str) -> str:
+        """Store bytes and return their artifact id"""
+        digest = hashlib.sha256(data).hexdigest()
+        if self._target(digest, extension).exists():
+            os.utime(self._target(digest, extension))
+            return digest
+        with tempfile.NamedTemporaryFile(dir=self.tmp_dir, delete=False) as tmp_file:
+            tmp_file.write(data)
+        return self._commit(Path(tmp_file.name), digest, extension)
+
+    @contextmanager
+    def writer(self, extension: str):
+        """Write an artifact incrementally; yields (file, result) and fills result["id"] on exit"""
+        tmp_file = tempfile.NamedTemporaryFile(dir=self.tmp_dir, delete=False)
+        result = {}
+        try:
+            yield tmp_file, result
+            tmp_file.close()
+            digest = hashlib.sha256()
+            with open(tmp_file.name, "rb") as written:
+                for chunk in iter(lambda: written.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            result["id"] = self._commit(Path(tmp_file.name), digest.hexdigest(), extension)
+        finally:
+            tmp_file.close()
+            Path(tmp_file.name).unlink(missing_ok=True)
+
+    def path(self, artifact_id: str) -> Optional[Path]:
+        """Location of an artifact, or None if unknown or collected"""
+        if not HASH_PATTERN.match(artifact_id):
+            return None
+        shard = self.root / artifact_id[:2]
+        if not shard.is_dir():
+            return None
+        for path in shard.glob(f"{artifact_id}.*"):
+            return path
+        return None
+
+    def read(self, artifact_id: str) -> Optional[bytes]:
+        """Contents of an artifact, or None if unknown or collected"""
+        path = self.path(artifact_id)
+        if path is None:
+            return None
+        self.touch(path)
+        return path.read_bytes()
+
+    def touch(self, path: Path) -> None:
+        """Mark an artifact as recently used"""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def collect_garbage(self) -> int:
+        """Rescan the store; if over budget, delete least recently used artifacts down to 90%"""
+        with self._lock, file_lock(self._lock_path, blocking=False) as locked:
+            if not locked:
+                # Another process is already collecting
+                return 0
+            entries = []
+            for path in self._files():
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            self.total_bytes = sum(size for _, size, _ in entries)
+            self._unscanned_bytes = 0
+            if self.total_bytes <= self.max_bytes:
+                return 0
+            target = int(self.max_bytes * 0.9)
+            entries.sort()
+
+            removed = 0
+            for _, size, path in entries:
+                if self.total_bytes <= target:
+                    break
+                path.unlink(missing_ok=True)
+                self.total_bytes -= size
+                removed += 1
+        self.logger.info(f"Collected {removed} artifacts; {self.total_bytes / 1024 ** 2:.1f} MiB in use")
+        return removed
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Single byte range of a Range header as inclusive (start, end)
+
+    Returns None when there is no usable range, including a malformed
+    header, which is ignored as RFC 9110 asks (serve the whole file),
+    and a multi-range request, which is answered with the whole file
+    rather than multipart/byteranges. Raises ValueError only for a
+    well-formed range that cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+    spec = header[len("bytes="):].strip()
+    if "," in spec:
+        return None
+    start_text, _, end_text = spec.partition("-")
+    start_text, end_text = start_text.strip(), end_text.strip()
+    if not (start_text or end_text) or not all(text.isdigit() for text in (start_text, end_text) if text):
+        return None
+    if start_text:
+        start = int(start_text)
+        end = int(end_text) if end_text else max(start, size - 1)
+        if end < start:
+            return None
+    else:
+        # Suffix range: the last N bytes
+        length = int(end_text)
+        if length == 0:
+            raise ValueError(f"Range not satisfiable: {header}")
+        start = max(size - length, 0)
+        end = size - 1
+    if start >= size:
+        raise ValueError(f"Range not satisfiable: {header}")
+    return start, min(end, size - 1)
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches etag
+
+    Uses the weak comparison RFC 9110 requires for If-None-Match: a
+    W/ prefix is ignored on either side. The header is "*" or a comma
+    separated list of entity tags.
+    """
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for tag in ENTITY_TAG_PATTERN.findall(header):
+        if (tag[2:] if tag.startswith("W/") else tag) == opaque:
+            return True
+    return False
+
+def iter_file_range(path: Path, start: int, end: int, chunk_size: int = 256 * 1024) -> Iterator[bytes]:
+    """Bytes start..end (inclusive) of a file
+
+    The file is opened before this returns, so a missing file raises
+    FileNotFoundError here rather than partway through a response, and
+    a collection that unlinks it afterwards cannot cut the body short.
+    """
+    file = open(path, "rb")
+
+    def chunks() -> Iterator[bytes]:
+        with file:
+            file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = file.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    return chunks()
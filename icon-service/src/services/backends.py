@@ -0,0 +1,225 @@
+from pathlib import Path
+from typing import Optional
+import logging
+import os
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "onnx", "openvino")
+
+class TorchBackend:
+    """Eager PyTorch execution of the pipeline's modules"""
+    name = "torch"
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+
+    def encode_text(self, input_ids: torch.Tensor) -> torch.Tensor:
+        return self.pipeline.text_encoder(input_ids)[0]
+
+    def unet(self, sample: torch.Tensor, timestep: torch.Tensor, encoder_hidden_states: torch.Tensor) -> torch.Tensor:
+        return self.pipeline.unet(sample, timestep, encoder_hidden_states=encoder_hidden_states).sample
+
+    def decode(self, latents: torch.Tensor) -> torch.Tensor:
+        return self.pipeline.vae.decode(latents).sample
+
+class _TextEncoderGraph(torch.nn.Module):
+    def __init__(self, text_encoder):
+        super().__init__()
+        self.text_encoder = text_encoder
+
+    def forward(self, input_ids):
+        return self.text_encoder(input_ids)[0]
+
+class _UNetGraph(torch.nn.Module):
+    def __init__(self, unet):
+        super().__init__()
+        self.unet = unet
+
+    def forward(self, sample, timestep, encoder_hidden_states):
+        return self.unet(sample, timestep, encoder_hidden_states=encoder_hidden_states).sample
+
+class _VaeDecoderGraph(torch.nn.Module):
+    def __init__(self, vae):
+        super().__init__()
+        self.vae = vae
+
+    def forward(self, latents):
+        return self.vae.decode(latents).sample
+
+class OnnxBackend:
+    """Runs exported ONNX graphs of the text encoder, UNet and VAE decoder
+
+    Graphs are exported once into export_dir and reused across restarts.
+    With provider="OpenVINOExecutionProvider" (onnxruntime-openvino) the
+    same graphs run through OpenVINO.
+    """
+    def __init__(
+        self,
+        pipeline,
+        export_dir: Path,
+        threads: Optional[int] = None,
+        provider: str = "CPUExecutionProvider",
+        opset: int = 14
+    ):
+        import onnxruntime as ort
+
+        self.name = "openvino" if provider == "OpenVINOExecutionProvider" else "onnx"
+        self.export_dir = Path(export_dir)
+        self.opset = opset
+        self.export(pipeline)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        if threads:
+            options.intra_op_num_threads = threads
+
+        if provider not in ort.get_available_providers():
+            raise RuntimeError(f"ONNX Runtime provider {provider} is not available")
+        providers = [provider] if provider == "CPUExecutionProvider" else [provider, "CPUExecutionProvider"]
+
+        self.sessions = {
+            name: ort.InferenceSession(str(self._graph_path(name)), options, providers=providers)
+            for name in ("text_encoder", "unet", "vae_decoder")
+        }
+
+    def _graph_path(self, name: str) -> Path:
+        # One directory per graph: the UNet is stored with external weight files
+        return self.export_dir / name / "model.onnx"
+
+    def export(self, pipeline) -> None:
+        """Export any graph not already on disk"""
+        unet_config = pipeline.unet.config
+        latent_channels = unet_config.in_channels
+        hidden_size = pipeline.text_encoder.config.hidden_size
+        max_length = pipeline.tokenizer.model_max_length
+
+        specs = {
+            "text_encoder": (
+                _TextEncoderGraph(pipeline.text_encoder),
+                (torch.zeros(1, max_length, dtype=torch.int64),),
+                ["input_ids"],
+                ["last_hidden_state"],
+                {"input_ids": {0: "batch"}, "last_hidden_state": {0: "batch"}}
+            ),
+            "unet": (
+                _UNetGraph(pipeline.unet),
+                (
+                    torch.randn(2, latent_channels, 64, 64),
+                    torch.ones(2, dtype=torch.float32),
+                    torch.randn(2, max_length, hidden_size)
+                ),
+                ["sample", "timestep", "encoder_hidden_states"],
+                ["noise_pred"],
+                {
+                    "sample": {0: "batch", 2: "height", 3: "width"},
+                    "timestep": {0: "batch"},
+                    "encoder_hidden_states": {0: "batch"},
+                    "noise_pred": {0: "batch", 2: "height", 3: "width"}
+                }
+            ),
+            "vae_decoder": (
+                _VaeDecoderGraph(pipeline.vae),
+                (torch.randn(1, pipeline.vae.config.latent_channels, 64, 64),),
+                ["latents"],
+                ["sample"],
+                {"latents": {0: "batch", 2: "height", 3: "width"}, "sample": {0: "batch", 2: "height", 3: "width"}}
+            )
+        }
+
+        for name, (module, args, input_names, output_names, dynamic_axes) in specs.items():
+            path = self._graph_path(name)
+            if path.exists():
+                continue
+            path.parent.mkdir(parents=True, exist_ok=True)
+            logger.info(f"Exporting {name} to {path}")
+            tmp_path = path.with_suffix(".onnx.tmp")
+            with torch.no_grad():
+                torch.onnx.export(
+                    module,
+                    args,
+                    str(tmp_path),
+                    input_names=input_names,
+                    output_names=output_names,
+                    dynamic_axes=dynamic_axes,
+                    opset_version=self.opset,
+                    do_constant_folding=True
+                )
+            os.replace(tmp_path, path)
+
+    def encode_text(self, input_ids: torch.Tensor) -> torch.Tensor:
+        output = self.sessions["text_encoder"].run(None, {"input_ids": input_ids.numpy().astype(np.int64)})[0]
+        return torch.from_numpy(output)
+
+    def unet(self, sample: torch.Tensor, timestep: torch.Tensor, encoder_hidden_states: torch.Tensor) -> torch.Tensor:
+        output = self.sessions["unet"].run(None, {
+            "sample": np.ascontiguousarray(sample.numpy()),
+            "timestep": np.full((sample.shape[0],), float(timestep), dtype=np.float32),
+            "encoder_hidden_states": np.ascontiguousarray(encoder_hidden_states.numpy())
+        })[0]
+        return torch.from_numpy(output)
+
+    def decode(self, latents: torch.Tensor) -> torch.Tensor:
+        output = self.sessions["vae_decoder"].run(None, {"latents": np.ascontiguousarray(latents.numpy())})[0]
+        return torch.from_numpy(output)
+
+def check_parity(reference: TorchBackend, candidate, tolerance: float = 1e-2) -> float:
+    """Largest relative deviation of the candidate from torch on a small input"""
+    pipeline = reference.pipeline
+    generator = torch.Generator().manual_seed(0)
+    max_length = pipeline.tokenizer.model_max_length
+    input_ids = pipeline.tokenizer(
+        ["a blue cloud icon"],
+        padding="max_length",
+        max_length=max_length,
+        truncation=True,
+        return_tensors="pt"
+    ).input_ids
+    latents = torch.randn(1, pipeline.unet.config.in_channels, 32, 32, generator=generator)
+    timestep = torch.tensor(500)
+
+    def deviation(expected: torch.Tensor, actual: torch.Tensor) -> float:
+        scale = expected.abs().max().clamp(min=1e-6)
+        return float((expected - actual).abs().max() / scale)
+
+    with torch.inference_mode():
+        embeds = reference.encode_text(input_ids)
+        worst = max(
+            deviation(embeds, candidate.encode_text(input_ids)),
+            deviation(reference.unet(latents, timestep, embeds), candidate.unet(latents, timestep, embeds)),
+            deviation(reference.decode(latents), candidate.decode(latents))
+        )
+
+    if worst > tolerance:
+        raise RuntimeError(f"{candidate.name} backend deviates from torch by {worst:.2e} (tolerance {tolerance:.0e})")
+    return worst
+
+def create_backend(
+    name: str,
+    pipeline,
+    export_dir: Path,
+    threads: Optional[int] = None,
+    parity_tolerance: float = 1e-2
+):
+    """Build the requested backend, falling back to torch if it is unusable"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unsupported inference backend: {name}")
+
+    reference = TorchBackend(pipeline)
+    if name == "torch":
+        return reference
+
+    provider = "OpenVINOExecutionProvider" if name == "openvino" else "CPUExecutionProvider"
+    try:
+        backend = OnnxBackend(pipeline, export_dir, threads=threads, provider=provider)
+        deviation = check_parity(reference, backend, parity_tolerance)
+        logger.info(f"Using {backend.name} backend (max deviation from torch {deviation:.2e})")
+        return backend
+    except ImportError:
+        logger.warning(f"onnxruntime is not installed; using torch instead of {name}")
+    except Exception as e:
+        logger.warning(f"Could not start {name} backend, using torch: {str(e)}")
+    return reference
@@ -0,0 +1,159 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import hashlib
+import json
+import re
+import secrets
+from .cancellation import CancellationToken
+
+# Settings that must match for items to share one batched diffusion run
+BATCH_SETTINGS = (
+    "num_steps",
+    "guidance_scale",
+    "guidance_cutoff",
+    "fast_mode",
+    "cache_interval",
+    "decoder",
+    "height",
+    "width",
+    "scheduler"
+)
+
+_SAFE_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+class BatchItem:
+    """One /generate request from a batch file"""
+    __slots__ = ("index", "item_id", "request_id", "params", "output_format", "digest")
+
+    def __init__(
+        self,
+        index: int,
+        item_id: str,
+        request_id: Optional[str],
+        params: Dict[str, Any],
+        output_format: str,
+        digest: str
+    ):
+        self.index = index
+        self.item_id = item_id
+        self.request_id = request_id
+        self.params = params
+        self.output_format = output_format
+        self.digest = digest
+
+    @property
+    def settings(self) -> Tuple:
+        return tuple(self.params[key] for key in BATCH_SETTINGS)
+
+    def status(self, status: str, **fields) -> Dict[str, Any]:
+        """NDJSON status line for this item"""
+        return {
+            "index": self.index,
+            "item_id": self.item_id,
+            "request_id": self.request_id,
+            "status": status,
+            **fields
+        }
+
+def normalize_params(raw: Dict[str, Any], resolution: int) -> Dict[str, Any]:
+    """generate_images arguments for a recorded /generate request, clamped like the endpoint"""
+    prompt = raw.get("prompt")
+    if not isinstance(prompt, str) or not prompt.strip():
+        raise ValueError("prompt is required")
+    guidance_cutoff = raw.get("guidance_cutoff")
+    if guidance_cutoff is not None and not 0 <= float(guidance_cutoff) <= 1:
+        raise ValueError("guidance_cutoff must be between 0 and 1")
+    cache_interval = raw.get("cache_interval")
+    if cache_interval is not None and int(cache_interval) < 1:
+        raise ValueError("cache_interval must be at least 1")
+    seed = raw.get("seed")
+    return {
+        "prompt": prompt,
+        # Unseeded items get a seed now so the output can be reproduced
+        "seed": int(seed) if seed is not None else secrets.randbelow(2 ** 31),
+        "num_steps": min(int(raw.get("num_steps") or 20), 50),
+        "guidance_scale": min(float(raw.get("guidance_scale", 7.5)), 20.0),
+        "guidance_cutoff": float(guidance_cutoff) if guidance_cutoff is not None else None,
+        "fast_mode": bool(raw.get("fast_mode", False)),
+        "cache_interval": min(int(cache_interval), 10) if cache_interval else None,
+        "decoder": raw.get("decoder") or "full",
+        "height": resolution,
+        "width": resolution,
+        "scheduler": None
+    }
+
+def parse_batch(
+    lines: Iterable[str],
+    resolution: int,
+    negotiate: Callable[[str], str],
+    resolve_decoder: Callable[[str], str],
+    default_format: str = "png",
+    max_items: Optional[int] = None
+) -> Tuple[List[BatchItem], List[Dict[str, Any]]]:
+    """Parse JSONL in the request log format into items and error lines
+
+    Each line is either a recorded request ({"endpoint": "/generate",
+    "params": {...}}) or a bare parameter object with a prompt.
+    negotiate maps a recorded Accept header to an output format and
+    resolve_decoder validates decoder names, as in the endpoint.
+    """
+    items: List[BatchItem] = []
+    errors: List[Dict[str, Any]] = []
+    index = -1
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        index += 1
+        if max_items is not None and index >= max_items:
+            raise ValueError(f"At most {max_items} items per batch")
+        try:
+            entry = json.loads(line)
+            if not isinstance(entry, dict):
+                raise ValueError("line is not a JSON object")
+            if "params" in entry:
+                if entry.get("endpoint", "/generate") != "/generate":
+                    raise ValueError(f"unsupported endpoint {entry.get('endpoint')}")
+                raw = entry["params"]
+            else:
+                raw = entry
+            request_id = entry.get("request_id")
+            params = normalize_params(raw, resolution)
+            params["decoder"] = resolve_decoder(params["decoder"])
+            output_format = negotiate(raw["accept"]) if raw.get("accept") else default_format
+        except (ValueError, TypeError, KeyError) as e:
+            errors.append({"index": index, "status": "error", "detail": str(e)})
+            continue
+
+        # The index keeps ids unique when request ids repeat or look like another line's index
+        item_id = f"{request_id}-{index:06d}" if isinstance(request_id, str) and _SAFE_ID.match(request_id) else f"{index:06d}"
+        digest = hashlib.sha256(json.dumps(raw, sort_keys=True).encode()).hexdigest()[:16]
+        items.append(BatchItem(index, item_id, request_id, params, output_format, digest))
+    return items, errors
+
+def plan_batches(items: List[BatchItem], batch_size: int) -> List[List[BatchItem]]:
+    """Group items with identical settings, in first-seen order, into runs of batch_size"""
+    groups: "OrderedDict[Tuple, List[BatchItem]]" = OrderedDict()
+    for item in items:
+        groups.setdefault(item.settings, []).append(item)
+    batches = []
+    for group in groups.values():
+        for start in range(0, len(group), batch_size):
+            batches.append(group[start:start + batch_size])
+    return batches
+
+def render_batch(
+    sd_service,
+    batch: List[BatchItem],
+    generation_ids: Optional[List[str]] = None,
+    cancel_token: Optional[CancellationToken] = None
+) -> List:
+    """Run one batched diffusion pass for items sharing their settings"""
+    settings = {key: batch[0].params[key] for key in BATCH_SETTINGS}
+    return sd_service.generate_images(
+        [item.params["prompt"] for item in batch],
+        [item.params["seed"] for item in batch],
+        generation_ids,
+        cancel_token=cancel_token,
+        **settings
+    )
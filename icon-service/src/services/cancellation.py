@@ -0,0 +1,78 @@
+from typing import Callable, List, Optional
+import asyncio
+import threading
+import time
+
+class GenerationCancelled(Exception):
+    """Raised inside a generation when its token is cancelled"""
+    def __init__(self, reason: str = "cancelled"):
+        super().__init__(f"Generation cancelled: {reason}")
+        self.reason = reason
+
+class CancellationToken:
+    """Thread-safe cancellation flag with an optional deadline
+
+    The HTTP side cancels it (client disconnect, deadline); the
+    inference thread polls it once per denoising step.
+    """
+    def __init__(self, deadline: Optional[float] = None):
+        self.deadline = deadline
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @classmethod
+    def from_deadline_ms(cls, deadline_ms: Optional[int]) -> "CancellationToken":
+        """Token that expires deadline_ms from now"""
+        if deadline_ms is None or deadline_ms <= 0:
+            return cls()
+        return cls(deadline=time.monotonic() + deadline_ms / 1000)
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel("deadline")
+        return self._event.is_set()
+
+    def raise_if_cancelled(self) -> None:
+        if self.cancelled:
+            raise GenerationCancelled(self.reason)
+
+    def add_callback(self, callback: Callable[[], None]) -> None:
+        """Run callback once the token is cancelled (immediately if it already is)"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    async def wait(self) -> str:
+        """Resolve when the token is cancelled, returning the reason"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        self.add_callback(wake)
+        await future
+        return self.reason
+
+async def watch_request(request, token: CancellationToken, interval: float = 0.1) -> None:
+    """Cancel the token when the client disconnects or the deadline passes"""
+    while not token.cancelled:
+        if await request.is_disconnected():
+            token.cancel("disconnected")
+            return
+        await asyncio.sleep(interval)
@@ -0,0 +1,95 @@
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import hashlib
+import json
+import logging
+from .cancellation import CancellationToken, GenerationCancelled
+from .metrics import COALESCE_LEADERS, COALESCED_JOINS, COALESCE_FAILURES, COALESCE_INFLIGHT
+
+class _Flight:
+    """One shared computation and the number of requests waiting on it"""
+    def __init__(self, task: asyncio.Future, token: CancellationToken):
+        self.task = task
+        self.token = token
+        self.waiters = 0
+
+class RequestCoalescer:
+    """Singleflight: identical concurrent requests share one computation
+
+    The computation runs as its own task, so the request that started it
+    can go away without failing the others. Errors reach every waiter and
+    clear the entry, so the next request retries from scratch. When the
+    last waiter leaves, the computation is cancelled through its own
+    token, which every waiter's token can only release, never trigger.
+    """
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._inflight: Dict[str, _Flight] = {}
+
+    @staticmethod
+    def make_key(params: Dict[str, Any]) -> str:
+        """Canonical key over the parameters that determine the output"""
+        canonical = dict(params)
+        if isinstance(canonical.get("prompt"), str):
+            # The CLIP tokenizer lowercases and splits on whitespace anyway
+            canonical["prompt"] = " ".join(canonical["prompt"].lower().split())
+        encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def _finished(self, key: str, flight: _Flight, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+        COALESCE_INFLIGHT.set(len(self._inflight))
+        if task.cancelled() or isinstance(task.exception(), GenerationCancelled):
+            COALESCE_FAILURES.labels(reason="cancelled").inc()
+        elif task.exception() is not None:
+            COALESCE_FAILURES.labels(reason="error").inc()
+
+    async def run(
+        self,
+        key: Optional[str],
+        compute: Callable[[CancellationToken], Awaitable[Any]],
+        token: Optional[CancellationToken] = None
+    ) -> Any:
+        """Run compute(token), or join an identical computation already in flight"""
+        token = token or CancellationToken()
+        if key is None:
+            return await compute(token)
+
+        flight = self._inflight.get(key)
+        if flight is None:
+            shared_token = CancellationToken()
+            flight = _Flight(asyncio.ensure_future(compute(shared_token)), shared_token)
+            self._inflight[key] = flight
+            flight.task.add_done_callback(
+                lambda task, flight=flight: self._finished(key, flight, task)
+            )
+            COALESCE_LEADERS.inc()
+            COALESCE_INFLIGHT.set(len(self._inflight))
+        else:
+            COALESCED_JOINS.inc()
+            self.logger.info(f"Coalesced request onto in-flight generation {key[:12]}")
+
+        flight.waiters += 1
+        waiter_cancelled = asyncio.ensure_future(token.wait())
+        try:
+            result = asyncio.shield(flight.task)
+            done, _ = await asyncio.wait(
+                {result, waiter_cancelled},
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if result not in done:
+                # This waiter gave up; the others keep waiting
+                result.cancel()
+                raise GenerationCancelled(token.reason)
+            return result.result()
+        finally:
+            waiter_cancelled.cancel()
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Nobody is left to receive the result; pass on why the last one left
+                flight.token.cancel(token.reason or "abandoned")
+                flight.task.cancel()
+
+    def inflight(self) -> int:
+        return len(self._inflight)
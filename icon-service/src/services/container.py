@@ -0,0 +1,57 @@
+from typing import Any, Callable, Dict, Optional
+import logging
+import threading
+import time
+from starlette.concurrency import run_in_threadpool
+from .metrics import SERVICE_LOAD_SECONDS
+
+class ServiceContainer:
+    """Subsystems built on first use instead of at import
+
+    Factories are registered by name and run at most once; they may
+    import heavy modules and may get() other services they depend on.
+    Concurrent first uses of the same service wait for one build.
+    """
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._locks: Dict[str, threading.RLock] = {}
+        self._guard = threading.Lock()
+        self.load_seconds: Dict[str, float] = {}
+
+    def register(self, name: str, factory: Callable[[], Any]) -> None:
+        """Declare how to build a service; replaces any unbuilt registration"""
+        with self._guard:
+            self._factories[name] = factory
+            self._locks.setdefault(name, threading.RLock())
+
+    def get(self, name: str) -> Any:
+        """The service, building it on this thread if needed"""
+        if name in self._instances:
+            return self._instances[name]
+        if name not in self._factories:
+            raise KeyError(f"Unknown service: {name}")
+        with self._locks[name]:
+            if name not in self._instances:
+                started = time.perf_counter()
+                instance = self._factories[name]()
+                elapsed = time.perf_counter() - started
+                self._instances[name] = instance
+                self.load_seconds[name] = elapsed
+                SERVICE_LOAD_SECONDS.labels(service=name).set(elapsed)
+                self.logger.info(f"Loaded {name} in {elapsed:.2f}s")
+            return self._instances[name]
+
+    async def aget(self, name: str) -> Any:
+        """The service, building it on a worker thread so the event loop stays free"""
+        if name in self._instances:
+            return self._instances[name]
+        return await run_in_threadpool(self.get, name)
+
+    def peek(self, name: str) -> Optional[Any]:
+        """The service if already built, without triggering a build"""
+        return self._instances.get(name)
+
+    def loaded(self, name: str) -> bool:
+        return name in self._instances
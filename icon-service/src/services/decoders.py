@@ -0,0 +1,72 @@
+from pathlib import Path
+from typing import Callable, Optional
+import logging
+import torch
+
+logger = logging.getLogger(__name__)
+
+# full: the pipeline's VAE; tiled: same VAE in overlapping tiles; tiny: TAESD
+DECODERS = ("full", "tiled", "tiny")
+
+def _feather(length: int, ramp: int) -> torch.Tensor:
+    """1-D blend weights rising over `ramp` pixels at both ends"""
+    position = torch.arange(length, dtype=torch.float32)
+    distance = torch.minimum(position + 1, length - position)
+    return torch.clamp(distance / (ramp + 1), max=1.0)
+
+def _tile_starts(size: int, tile: int, stride: int):
+    if size <= tile:
+        return [0]
+    starts = list(range(0, size - tile + 1, stride))
+    if starts[-1] + tile < size:
+        starts.append(size - tile)
+    return starts
+
+def tiled_decode(
+    decode: Callable[[torch.Tensor], torch.Tensor],
+    latents: torch.Tensor,
+    scale: int = 8,
+    tile_size: int = 32,
+    overlap: int = 8
+) -> torch.Tensor:
+    """Decode latents tile by tile, blending the overlaps
+
+    Peak memory follows the tile size instead of the image size; the
+    VAE's full-resolution activations and mid-block attention are what
+    dominate decode RSS.
+    """
+    _, _, height, width = latents.shape
+    if height <= tile_size and width <= tile_size:
+        return decode(latents)
+
+    stride = tile_size - overlap
+    output = None
+    weights = torch.zeros(1, 1, height * scale, width * scale)
+
+    for y in _tile_starts(height, tile_size, stride):
+        for x in _tile_starts(width, tile_size, stride):
+            decoded = decode(latents[:, :, y:y + tile_size, x:x + tile_size])
+            if output is None:
+                output = torch.zeros(decoded.shape[0], decoded.shape[1], height * scale, width * scale, dtype=decoded.dtype)
+            tile_h, tile_w = decoded.shape[-2:]
+            mask = torch.outer(_feather(tile_h, overlap * scale), _feather(tile_w, overlap * scale)).to(decoded.dtype)
+            top, left = y * scale, x * scale
+            output[:, :, top:top + tile_h, left:left + tile_w] += decoded * mask
+            weights[:, :, top:top + tile_h, left:left + tile_w] += mask
+
+    return output / weights.to(output.dtype)
+
+def load_tiny_decoder(path: Path, device: str = "cpu") -> Optional[torch.nn.Module]:
+    """Load a TAESD autoencoder from local weights, if present"""
+    if not (Path(path) / "config.json").exists():
+        return None
+    try:
+        from diffusers import AutoencoderTiny
+        decoder = AutoencoderTiny.from_pretrained(path, local_files_only=True, torch_dtype=torch.float32)
+        decoder.to(device)
+        decoder.eval()
+        logger.info(f"Loaded tiny decoder from {path}")
+        return decoder
+    except Exception as e:
+        logger.warning(f"Could not load tiny decoder from {path}: {str(e)}")
+        return None
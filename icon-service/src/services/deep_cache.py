@@ -0,0 +1,92 @@
+from typing import Optional, Tuple
+import torch
+
+class DeepCacheUNet:
+    """Runs a UNet2DConditionModel reusing its deep features between steps
+
+    High-level UNet features change little between adjacent denoising
+    steps. Every ``cache_interval`` steps the full UNet runs and the
+    input to the last (shallowest) up block is kept; the steps in
+    between only run conv_in, the first down block and the last up
+    block on top of that cached feature map.
+
+    One instance belongs to one generation; it holds per-run state.
+    """
+    def __init__(self, unet, cache_interval: int = 3):
+        self.unet = unet
+        self.cache_interval = max(1, cache_interval)
+        self.step = 0
+        self.full_steps = 0
+        self.cached: Optional[torch.Tensor] = None
+
+    def __call__(
+        self,
+        sample: torch.Tensor,
+        timestep: torch.Tensor,
+        encoder_hidden_states: torch.Tensor
+    ) -> torch.Tensor:
+        full = (
+            self.cached is None
+            or self.step % self.cache_interval == 0
+            # Guidance cutoff halves the batch mid-run; the cache no longer fits
+            or self.cached.shape[0] != sample.shape[0]
+        )
+        self.step += 1
+        if full:
+            self.full_steps += 1
+        return self._forward(sample, timestep, encoder_hidden_states, full)
+
+    @staticmethod
+    def _run_block(block, sample: torch.Tensor, emb: torch.Tensor, encoder_hidden_states: torch.Tensor, **kwargs):
+        if getattr(block, "has_cross_attention", False):
+            return block(hidden_states=sample, temb=emb, encoder_hidden_states=encoder_hidden_states, **kwargs)
+        return block(hidden_states=sample, temb=emb, **kwargs)
+
+    def _forward(
+        self,
+        sample: torch.Tensor,
+        timestep: torch.Tensor,
+        encoder_hidden_states: torch.Tensor,
+        full: bool
+    ) -> torch.Tensor:
+        """UNet2DConditionModel.forward without class/added conditioning"""
+        unet = self.unet
+
+        timesteps = timestep
+        if not torch.is_tensor(timesteps):
+            timesteps = torch.tensor([timesteps], device=sample.device)
+        elif timesteps.dim() == 0:
+            timesteps = timesteps[None].to(sample.device)
+        timesteps = timesteps.expand(sample.shape[0])
+        emb = unet.time_embedding(unet.time_proj(timesteps).to(dtype=sample.dtype))
+
+        sample = unet.conv_in(sample)
+        down_residuals: Tuple[torch.Tensor, ...] = (sample,)
+        down_blocks = unet.down_blocks if full else unet.down_blocks[:1]
+        for block in down_blocks:
+            sample, residuals = self._run_block(block, sample, emb, encoder_hidden_states)
+            down_residuals += residuals
+
+        if full:
+            sample = unet.mid_block(sample, emb, encoder_hidden_states=encoder_hidden_states)
+            for block in unet.up_blocks[:-1]:
+                residuals = down_residuals[-len(block.resnets):]
+                down_residuals = down_residuals[:-len(block.resnets)]
+                sample = self._run_block(block, sample, emb, encoder_hidden_states, res_hidden_states_tuple=residuals)
+            self.cached = sample
+        else:
+            sample = self.cached
+
+        # The last up block only needs conv_in and first down block skips
+        last_block = unet.up_blocks[-1]
+        sample = self._run_block(
+            last_block,
+            sample,
+            emb,
+            encoder_hidden_states,
+            res_hidden_states_tuple=down_residuals[:len(last_block.resnets)]
+        )
+
+        if unet.conv_norm_out is not None:
+            sample = unet.conv_act(unet.conv_norm_out(sample))
+        return unet.conv_out(sample)
@@ -0,0 +1,152 @@
+from PIL import Image, ImageChops, ImageStat, features
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+import asyncio
+import io
+import logging
+
+try:
+    # AVIF support ships as a plugin for Pillow < 11
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pillow_avif = None
+
+MEDIA_TYPES = {
+    "png": "image/png",
+    "webp": "image/webp",
+    "avif": "image/avif",
+}
+
+class ImageEncoder:
+    """Encodes generated images off the inference threads"""
+    def __init__(
+        self,
+        max_workers: int = 2,
+        png_compress_level: int = 6,
+        webp_quality: int = 90,
+        avif_quality: int = 70,
+        palette_max_colors: int = 256,
+        palette_tolerance: float = 0.0,
+        default_format: str = "png"
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.png_compress_level = png_compress_level
+        self.webp_quality = webp_quality
+        self.avif_quality = avif_quality
+        self.palette_max_colors = palette_max_colors
+        self.palette_tolerance = palette_tolerance
+        self.default_format = default_format
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="image-encoder"
+        )
+        self.supported_formats = self._detect_formats()
+        self.logger.info(f"Supported output formats: {', '.join(self.supported_formats)}")
+
+    def _detect_formats(self) -> List[str]:
+        """Formats this Pillow build can actually write"""
+        Image.init()
+        formats = ["png"]
+        if features.check("webp"):
+            formats.append("webp")
+        if "AVIF" in Image.SAVE:
+            formats.append("avif")
+        return formats
+
+    def negotiate(self, accept: Optional[str]) -> str:
+        """Pick the output format from an HTTP Accept header"""
+        if not accept:
+            return self.default_format
+
+        candidates: List[Tuple[float, int, str]] = []
+        for position, part in enumerate(accept.split(",")):
+            fields = [field.strip() for field in part.split(";")]
+            media_range = fields[0].lower()
+            q = 1.0
+            for param in fields[1:]:
+                if param.startswith("q="):
+                    try:
+                        q = float(param[2:])
+                    except ValueError:
+                        q = 0.0
+            if q <= 0:
+                continue
+            candidates.append((q, -position, media_range))
+
+        # Lossy formats only when the client names them; wildcards keep the default
+        for q, _, media_range in sorted(candidates, reverse=True):
+            if media_range in ("*/*", "image/*"):
+                return self.default_format
+            for fmt in self.supported_formats:
+                if media_range == MEDIA_TYPES[fmt]:
+                    return fmt
+
+        return self.default_format
+
+    def media_type(self, fmt: str) -> str:
+        """Media type for an output format"""
+        return MEDIA_TYPES[fmt]
+
+    def _palette_colors(self, image: Image.Image) -> Optional[int]:
+        """Number of distinct colors if the image fits in a palette"""
+        colors = image.getcolors(self.palette_max_colors)
+        return len(colors) if colors is not None else None
+
+    def _palettize(self, image: Image.Image) -> Optional[Image.Image]:
+        """Palette version of the image for PNG, or None to keep it truecolor
+
+        Exact when the image already has few colors. Diffusion output
+        rarely does, so with a palette_tolerance it is quantized and the
+        palette kept if the mean per-channel error stays within tolerance.
+        """
+        num_colors = self._palette_colors(image)
+        if num_colors is not None:
+            return image.quantize(
+                colors=num_colors,
+                method=Image.Quantize.MEDIANCUT if image.mode == "RGB" else Image.Quantize.FASTOCTREE,
+                dither=Image.Dither.NONE
+            )
+        if self.palette_tolerance <= 0 or image.mode not in ("RGB", "RGBA"):
+            return None
+        quantized = image.quantize(
+            colors=self.palette_max_colors,
+            method=Image.Quantize.FASTOCTREE,
+            dither=Image.Dither.NONE
+        )
+        error = ImageStat.Stat(ImageChops.difference(image, quantized.convert(image.mode))).mean
+        return quantized if sum(error) / len(error) <= self.palette_tolerance else None
+
+    def encode(self, image: Image.Image, fmt: str = "png") -> bytes:
+        """Encode an image into the requested format"""
+        if fmt not in self.supported_formats:
+            raise ValueError(f"Unsupported output format: {fmt}")
+
+        buffer = io.BytesIO()
+
+        if fmt == "png":
+            # Flat icon art (or near-flat, within tolerance) as a palette PNG
+            palette_image = self._palettize(image)
+            if palette_image is not None:
+                palette_image.save(buffer, format="PNG", compress_level=self.png_compress_level, optimize=True)
+            else:
+                image.save(buffer, format="PNG", compress_level=self.png_compress_level)
+        elif fmt == "webp":
+            if self._palette_colors(image) is not None:
+                image.save(buffer, format="WEBP", lossless=True, method=4)
+            else:
+                image.save(buffer, format="WEBP", quality=self.webp_quality, method=4)
+        elif fmt == "avif":
+            image.save(buffer, format="AVIF", quality=self.avif_quality)
+
+        # getvalue() hands back the internal buffer without copying when
+        # nothing else holds a view on it
+        return buffer.getvalue()
+
+    async def encode_async(self, image: Image.Image, fmt: str = "png") -> bytes:
+        """Encode on the encoder pool instead of the inference threads"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.encode, image, fmt)
+
+    def shutdown(self) -> None:
+        """Stop the encoder pool"""
+        self.executor.shutdown(wait=False)
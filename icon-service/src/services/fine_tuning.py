@@ -1,20 +1,36 @@
 import torch
+import torch.nn.functional as F
 from pathlib import Path
-from diffusers import StableDiffusionPipeline
+from diffusers import StableDiffusionPipeline, DDPMScheduler
 from datasets import Dataset
-import os
 import logging
 from PIL import Image
 import zipfile
 import io
 import gc
+import copy
 from fastapi import APIRouter, HTTPException
+from starlette.concurrency import run_in_threadpool
+from .state import training_status
 
 class FineTuningService:
-    def __init__(self, model_path="/app/models/fine_tuned"):
+    def __init__(
+        self,
+        model_path="/app/models/fine_tuned",
+        models_dir="/app/shared/models",
+        cache_dir="/app/shared/cache/diffusers",
+        base_model_id="CompVis/stable-diffusion-v1-4",
+        pipeline=None,
+        resolution=512
+    ):
         self.logger = logging.getLogger(__name__)
         self.model_path = Path(model_path)
         self.model_path.mkdir(parents=True, exist_ok=True)
+        self.models_dir = Path(models_dir)
+        self.cache_dir = Path(cache_dir)
+        self.base_model_id = base_model_id
+        self.pipeline = pipeline
+        self.resolution = resolution
         self.device = "cpu"
         self.router = APIRouter()
         self.setup_routes()
@@ -35,6 +51,9 @@ class FineTuningService:
         
     async def process_training_images(self, zip_file_bytes):
         """Process uploaded ZIP file containing training images"""
+        return await run_in_threadpool(self._extract_training_images, zip_file_bytes)
+
+    def _extract_training_images(self, zip_file_bytes):
         try:
             # Create temporary directory for extracted images
             temp_dir = Path("/tmp/training_images")
@@ -64,14 +83,25 @@ class FineTuningService:
             self.logger.error(f"Error processing training data: {str(e)}")
             raise
             
-    async def _load_base_model(self):
+    def _ensure_cache_dir(self):
+        """Create the download cache directory"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _is_model_cached(self, model_id):
+        """Check if the model was already saved to the models directory"""
+        return (self.models_dir / model_id.split('/')[-1] / "model_index.json").exists()
+
+    def _load_base_model(self):
         """Load the base model for fine-tuning, using cache if available"""
+        if self.pipeline is not None:
+            return self.pipeline
+
         self._ensure_cache_dir()
         
         if self._is_model_cached(self.base_model_id):
             self.logger.info("Loading base model from cache...")
             return StableDiffusionPipeline.from_pretrained(
-                os.path.join(self.cache_dir, self.base_model_id),
+                self.models_dir / self.base_model_id.split('/')[-1],
                 local_files_only=True
             )
         else:
@@ -82,7 +112,14 @@ class FineTuningService:
             )
     
     async def fine_tune_model(self, processed_images, num_epochs=20):
-        """Fine-tune the model on the icon aesthetic"""
+        """Fine-tune the model on the icon aesthetic
+
+        Loading, training and saving all block, so they run on a worker
+        thread and the event loop keeps serving requests meanwhile.
+        """
+        return await run_in_threadpool(self._fine_tune, processed_images, num_epochs)
+
+    def _fine_tune(self, processed_images, num_epochs):
         try:
             dataset = Dataset.from_dict({
                 "image": [item["image"] for item in processed_images],
@@ -90,25 +127,26 @@ class FineTuningService:
             })
             
             # Load base model with memory optimizations
-            pipeline = await self._load_base_model()
+            pipeline = self._load_base_model()
+            if pipeline is self.pipeline:
+                # A pipeline shared with generation keeps serving its own weights
+                pipeline = type(pipeline)(**{**pipeline.components, "unet": copy.deepcopy(pipeline.unet)})
             
             # Enable memory efficient settings
             pipeline.enable_attention_slicing(slice_size="auto")
             
             # Training configuration
             training_args = {
-                "output_dir": self.model_path,
                 "learning_rate": 1e-5,
                 "max_train_steps": num_epochs * len(processed_images),
-                "train_batch_size": 1,
                 "gradient_accumulation_steps": 4,
-                "gradient_checkpointing": True,
-                "mixed_precision": "no"
+                "gradient_checkpointing": True
             }
             
             # Train the model
-            pipeline.train(
-                dataset=dataset,
+            self._train_unet(
+                pipeline,
+                dataset,
                 **training_args
             )
             
@@ -126,17 +164,71 @@ class FineTuningService:
         finally:
             gc.collect()
 
-class TrainingStatus:
-    def __init__(self):
-        self.status = "idle"
-        self.progress = 0
-        self.error = None
+    def _train_unet(
+        self,
+        pipeline,
+        dataset,
+        learning_rate=1e-5,
+        max_train_steps=100,
+        gradient_accumulation_steps=1,
+        gradient_checkpointing=True
+    ):
+        """Fine-tune the UNet with the standard noise-prediction objective"""
+        unet, vae, text_encoder = pipeline.unet, pipeline.vae, pipeline.text_encoder
+        noise_scheduler = DDPMScheduler.from_config(pipeline.scheduler.config)
+
+        vae.requires_grad_(False)
+        text_encoder.requires_grad_(False)
+        unet.train()
+        if gradient_checkpointing:
+            unet.enable_gradient_checkpointing()
+
+        optimizer = torch.optim.AdamW(unet.parameters(), lr=learning_rate)
 
-    def update(self, status, progress=None, error=None):
-        self.status = status
-        if progress is not None:
-            self.progress = progress
-        if error is not None:
-            self.error = error
+        # Every image shares the same caption; encode it once
+        with torch.no_grad():
+            token_ids = pipeline.tokenizer(
+                dataset[0]["text"],
+                padding="max_length",
+                max_length=pipeline.tokenizer.model_max_length,
+                truncation=True,
+                return_tensors="pt"
+            ).input_ids.to(self.device)
+            encoder_hidden_states = text_encoder(token_ids)[0]
 
-training_status = TrainingStatus()
\ No newline at end of file
+        try:
+            for step in range(max_train_steps):
+                image = dataset[step % len(dataset)]["image"]
+                pixel_values = pipeline.image_processor.preprocess(
+                    image.resize((self.resolution, self.resolution))
+                ).to(self.device)
+
+                with torch.no_grad():
+                    latents = vae.encode(pixel_values).latent_dist.sample()
+                    latents = latents * vae.config.scaling_factor
+
+                noise = torch.randn_like(latents)
+                timesteps = torch.randint(
+                    0,
+                    noise_scheduler.config.num_train_timesteps,
+                    (latents.shape[0],),
+                    device=self.device
+                )
+                noisy_latents = noise_scheduler.add_noise(latents, noise, timesteps)
+
+                noise_pred = unet(noisy_latents, timesteps, encoder_hidden_states).sample
+                loss = F.mse_loss(noise_pred.float(), noise.float()) / gradient_accumulation_steps
+                loss.backward()
+
+                if (step + 1) % gradient_accumulation_steps == 0 or step + 1 == max_train_steps:
+                    optimizer.step()
+                    optimizer.zero_grad()
+
+                training_status.update(
+                    "training",
+                    progress=int((step + 1) / max_train_steps * 100)
+                )
+        finally:
+            unet.eval()
+            if gradient_checkpointing:
+                unet.disable_gradient_checkpointing()
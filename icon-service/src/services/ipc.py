@@ -0,0 +1,101 @@
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Optional, Tuple, Union
+import numpy as np
+from PIL import Image
+from .cancellation import GenerationCancelled
+
+Address = Union[str, Tuple[str, int]]
+
+def parse_address(spec: str) -> Address:
+    """'host:port' for TCP on localhost, anything else is a Unix socket path"""
+    host, sep, port = spec.rpartition(":")
+    if sep and port.isdigit() and "/" not in spec:
+        return host or "127.0.0.1", int(port)
+    return spec
+
+# Fine for a Unix socket, which file permissions already guard
+DEFAULT_AUTHKEY = b"microdawgs"
+
+def resolve_authkey(address: Address, authkey: Optional[str]) -> bytes:
+    """Authkey for a model server address; TCP needs an explicit one
+
+    Connections unpickle whatever an authenticated peer sends, so a
+    well-known key on a TCP port lets anyone who can reach it run code.
+    """
+    if authkey:
+        return authkey.encode()
+    if isinstance(address, tuple):
+        raise ValueError("MODEL_SERVER_AUTHKEY must be set when the model server listens on TCP")
+    return DEFAULT_AUTHKEY
+
+def share_image(image: Image.Image) -> Tuple[SharedMemory, Dict[str, Any]]:
+    """Copy an image's pixels into a new shared memory segment
+
+    Returns the segment and a small descriptor to send instead of the
+    pixels. The receiver owns the segment and unlinks it after reading.
+    """
+    if image.mode not in ("RGB", "RGBA", "L"):
+        image = image.convert("RGB")
+    pixels = np.asarray(image)
+    segment = SharedMemory(create=True, size=max(pixels.nbytes, 1))
+    np.ndarray(pixels.shape, dtype=np.uint8, buffer=segment.buf)[...] = pixels
+    return segment, {"__image__": segment.name, "shape": pixels.shape, "mode": image.mode}
+
+def release_segment(segment: SharedMemory, handed_off: bool) -> None:
+    """Close our handle; unlink unless the receiver took ownership"""
+    segment.close()
+    if handed_off:
+        # The receiver unlinks it; stop our resource tracker from doing so at exit
+        resource_tracker.unregister(segment._name, "shared_memory")
+    else:
+        segment.unlink()
+
+def receive_image(descriptor: Dict[str, Any]) -> Image.Image:
+    """Read an image from shared memory and free the segment"""
+    segment = SharedMemory(name=descriptor["__image__"])
+    try:
+        pixels = np.ndarray(tuple(descriptor["shape"]), dtype=np.uint8, buffer=segment.buf).copy()
+    finally:
+        segment.close()
+        segment.unlink()
+    # The array shape already determines L, RGB or RGBA
+    return Image.fromarray(pixels)
+
+def pack(value: Any, segments: List[SharedMemory]) -> Any:
+    """Replace images (also inside lists) with shared memory descriptors"""
+    if isinstance(value, Image.Image):
+        segment, descriptor = share_image(value)
+        segments.append(segment)
+        return descriptor
+    if isinstance(value, list):
+        return [pack(item, segments) for item in value]
+    return value
+
+def unpack(value: Any) -> Any:
+    if isinstance(value, dict) and "__image__" in value:
+        return receive_image(value)
+    if isinstance(value, list):
+        return [unpack(item) for item in value]
+    return value
+
+def error_reply(request_id: int, error: BaseException) -> Dict[str, Any]:
+    """Reply describing an exception the API worker should re-raise"""
+    if isinstance(error, GenerationCancelled):
+        return {"id": request_id, "error": "cancelled", "reason": error.reason}
+    if isinstance(error, KeyError):
+        return {"id": request_id, "error": "key", "message": str(error)}
+    if isinstance(error, ValueError):
+        return {"id": request_id, "error": "value", "message": str(error)}
+    return {"id": request_id, "error": "internal", "message": str(error)}
+
+def raise_error(reply: Dict[str, Any]) -> None:
+    """Re-raise an error_reply() as the matching local exception"""
+    kind = reply["error"]
+    if kind == "cancelled":
+        raise GenerationCancelled(reply["reason"])
+    if kind == "key":
+        raise KeyError(reply["message"])
+    if kind == "value":
+        raise ValueError(reply["message"])
+    raise RuntimeError(f"Model server error: {reply['message']}")
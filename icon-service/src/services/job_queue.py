@@ -0,0 +1,359 @@
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+import asyncio
+import json
+import logging
+import socket
+import time
+import uuid
+from .cancellation import CancellationToken, GenerationCancelled
+from .scheduler import PRIORITIES
+
+QUEUE_ROLES = ("api", "worker", "both")
+
+JobHandler = Callable[[Dict[str, Any], CancellationToken], Awaitable[Dict[str, Any]]]
+
+class RedisJobQueue:
+    """Generation jobs in Redis streams shared by every replica
+
+    API nodes add jobs to one stream per priority. Worker nodes read them
+    through a consumer group, only while they have a free inference slot,
+    so idle replicas pull work and busy ones do not. A job is acked once
+    its result is stored; jobs left pending longer than claim_idle_ms (a
+    dead worker stops heartbeating them) are reclaimed with XAUTOCLAIM by
+    another worker. Results are stored under a key with a TTL and
+    announced on the submitting node's reply channel.
+    """
+    def __init__(
+        self,
+        url: str,
+        prefix: str = "icon",
+        consumer: Optional[str] = None,
+        max_connections: int = 32,
+        claim_idle_ms: int = 60000,
+        max_deliveries: int = 3,
+        result_ttl: int = 3600,
+        max_length: int = 100000
+    ):
+        import redis.asyncio as redis
+
+        self.logger = logging.getLogger(__name__)
+        self.redis = redis.Redis(connection_pool=redis.ConnectionPool.from_url(
+            url,
+            max_connections=max_connections,
+            decode_responses=True
+        ))
+        self.prefix = prefix
+        self.group = f"{prefix}:workers"
+        self.consumer = consumer or f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self.claim_idle_ms = claim_idle_ms
+        self.max_deliveries = max_deliveries
+        self.result_ttl = result_ttl
+        self.max_length = max_length
+
+        self.reply_channel = f"{prefix}:replies:{self.consumer}"
+        self.cancel_channel = f"{prefix}:cancel"
+        self._waiters: Dict[str, asyncio.Future] = {}
+        self._running: Dict[str, CancellationToken] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._jobs: Set[asyncio.Task] = set()
+        # Jobs delivered by a read that returned more than one, waiting for a slot
+        self._backlog: Deque[Tuple[str, str, Dict[str, str], asyncio.Task]] = deque()
+
+    def stream(self, priority: str) -> str:
+        return f"{self.prefix}:jobs:{priority}"
+
+    def _result_key(self, job_id: str) -> str:
+        return f"{self.prefix}:result:{job_id}"
+
+    def _cancelled_key(self, job_id: str) -> str:
+        return f"{self.prefix}:cancelled:{job_id}"
+
+    async def close(self) -> None:
+        """Stop listening and working; unfinished jobs stay pending for other workers to reclaim"""
+        heartbeats = [heartbeat for *_, heartbeat in self._backlog]
+        self._backlog.clear()
+        for task in [*self._tasks, *self._jobs, *heartbeats]:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._jobs, *heartbeats, return_exceptions=True)
+        await self.redis.close(close_connection_pool=True)
+
+    def _start_job(self, stream: str, message_id: str, fields: Dict[str, str], handler, slots: asyncio.Semaphore) -> None:
+        task = asyncio.create_task(self._process(stream, message_id, fields, handler, slots))
+        self._jobs.add(task)
+        task.add_done_callback(self._jobs.discard)
+
+    async def _subscribe(self, channel: str, on_message: Callable[[Dict[str, Any]], None]) -> None:
+        """Deliver JSON messages from a pub/sub channel, resubscribing after connection errors"""
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(channel)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        on_message(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.warning(f"Lost subscription to {channel}: {str(e)}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    # API side
+
+    async def start_api(self) -> None:
+        """Listen for results of jobs this node submits"""
+        self._tasks.append(asyncio.create_task(self._subscribe(self.reply_channel, self._on_result)))
+
+    def _on_result(self, result: Dict[str, Any]) -> None:
+        future = self._waiters.get(result.get("id"))
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    async def submit(
+        self,
+        payload: Dict[str, Any],
+        priority: str = "interactive",
+        token: Optional[CancellationToken] = None,
+        poll_interval: float = 5.0
+    ) -> Dict[str, Any]:
+        """Enqueue a job and wait for a worker's result
+
+        Raises GenerationCancelled if the job was cancelled (deadline or
+        disconnect) and ValueError if a worker rejected its parameters.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unsupported priority: {priority}")
+        token = token or CancellationToken()
+        loop = asyncio.get_running_loop()
+        job_id = uuid.uuid4().hex
+        future = loop.create_future()
+        self._waiters[job_id] = future
+
+        # Wall-clock deadline so it means the same thing on the worker
+        deadline = time.time() + (token.deadline - time.monotonic()) if token.deadline is not None else None
+        await self.redis.xadd(
+            self.stream(priority),
+            {
+                "id": job_id,
+                "reply_to": self.reply_channel,
+                "payload": json.dumps(payload),
+                "deadline": "" if deadline is None else str(deadline),
+                "enqueued_at": str(time.time())
+            },
+            maxlen=self.max_length,
+            approximate=True
+        )
+        token.add_callback(lambda: loop.call_soon_threadsafe(self._abandon, job_id, token.reason))
+
+        try:
+            while True:
+                try:
+                    result = await asyncio.wait_for(asyncio.shield(future), timeout=poll_interval)
+                except asyncio.TimeoutError:
+                    # Deadlines are only noticed when polled
+                    token.raise_if_cancelled()
+                    # A notification can be missed across a reconnect; the stored result cannot
+                    stored = await self.redis.get(self._result_key(job_id))
+                    if stored is None:
+                        continue
+                    result = json.loads(stored)
+                return self._unwrap(result)
+        finally:
+            self._waiters.pop(job_id, None)
+
+    def _abandon(self, job_id: str, reason: Optional[str]) -> None:
+        """Stop waiting for a job and tell the workers to drop it"""
+        future = self._waiters.get(job_id)
+        if future is not None and not future.done():
+            future.set_result({"id": job_id, "status": "cancelled", "reason": reason})
+        asyncio.ensure_future(self.cancel(job_id, reason))
+
+    @staticmethod
+    def _unwrap(result: Dict[str, Any]) -> Dict[str, Any]:
+        status = result.get("status")
+        if status == "done":
+            return result
+        if status == "cancelled":
+            raise GenerationCancelled(result.get("reason") or "cancelled")
+        if status == "invalid":
+            raise ValueError(result.get("detail"))
+        raise RuntimeError(f"Queued generation failed: {result.get('detail')}")
+
+    async def cancel(self, job_id: str, reason: Optional[str] = None) -> None:
+        """Cancel a job whether it is still queued or already running"""
+        reason = reason or "cancelled"
+        try:
+            await self.redis.set(self._cancelled_key(job_id), reason, ex=self.result_ttl)
+            await self.redis.publish(self.cancel_channel, json.dumps({"id": job_id, "reason": reason}))
+        except Exception as e:
+            self.logger.warning(f"Could not cancel job {job_id}: {str(e)}")
+
+    # Worker side
+
+    async def _ensure_groups(self) -> None:
+        from redis.exceptions import ResponseError
+
+        for priority in PRIORITIES:
+            try:
+                await self.redis.xgroup_create(self.stream(priority), self.group, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    def _on_cancel(self, message: Dict[str, Any]) -> None:
+        token = self._running.get(message.get("id"))
+        if token is not None:
+            token.cancel(message.get("reason") or "cancelled")
+
+    async def run_worker(self, handler: JobHandler, concurrency: int = 1) -> None:
+        """Pull and run jobs until cancelled, keeping at most `concurrency` in flight"""
+        await self._ensure_groups()
+        slots = asyncio.Semaphore(concurrency)
+        self._tasks.append(asyncio.create_task(self._subscribe(self.cancel_channel, self._on_cancel)))
+        self._tasks.append(asyncio.create_task(self._reclaim(handler, slots)))
+        self.logger.info(f"Queue worker {self.consumer} pulling up to {concurrency} jobs")
+
+        while True:
+            await slots.acquire()
+            try:
+                entry = await self._read_one()
+            except asyncio.CancelledError:
+                slots.release()
+                raise
+            except Exception as e:
+                slots.release()
+                self.logger.warning(f"Reading the job stream failed: {str(e)}")
+                await asyncio.sleep(1)
+                continue
+            if entry is None:
+                slots.release()
+                continue
+            self._start_job(*entry, handler, slots)
+
+    async def _read_one(self):
+        """Next new job, interactive before bulk; None if nothing arrived in a second"""
+        if self._backlog:
+            stream, message_id, fields, heartbeat = self._backlog.popleft()
+            heartbeat.cancel()
+            return stream, message_id, fields
+        for priority in PRIORITIES:
+            response = await self.redis.xreadgroup(self.group, self.consumer, {self.stream(priority): ">"}, count=1)
+            if response:
+                break
+        else:
+            response = await self.redis.xreadgroup(
+                self.group,
+                self.consumer,
+                {self.stream(priority): ">" for priority in PRIORITIES},
+                count=1,
+                block=1000
+            )
+        if not response:
+            return None
+        # COUNT is per stream, so the blocking read can deliver a job from each
+        order = [self.stream(priority) for priority in PRIORITIES]
+        entries = sorted(
+            ((stream, message_id, fields) for stream, messages in response for message_id, fields in messages),
+            key=lambda entry: order.index(entry[0])
+        )
+        for stream, message_id, fields in entries[1:]:
+            # Already ours; heartbeat it so nobody reclaims it before a slot frees
+            self._backlog.append((stream, message_id, fields, asyncio.create_task(self._heartbeat(stream, message_id))))
+        return entries[0]
+
+    async def _reclaim(self, handler: JobHandler, slots: asyncio.Semaphore) -> None:
+        """Take over jobs whose worker stopped heartbeating them"""
+        while True:
+            await asyncio.sleep(self.claim_idle_ms / 2000)
+            for priority in PRIORITIES:
+                stream = self.stream(priority)
+                try:
+                    # Only claim what there is room to run right away
+                    while not slots.locked():
+                        response = await self.redis.xautoclaim(
+                            stream, self.group, self.consumer,
+                            min_idle_time=self.claim_idle_ms,
+                            start_id="0-0",
+                            count=1
+                        )
+                        messages = [message for message in response[1] if message[1]]
+                        if not messages:
+                            break
+                        message_id, fields = messages[0]
+                        self.logger.warning(f"Reclaimed job {fields.get('id')} from a stalled worker")
+                        await slots.acquire()
+                        self._start_job(stream, message_id, fields, handler, slots)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.logger.warning(f"Reclaiming from {stream} failed: {str(e)}")
+
+    async def _heartbeat(self, stream: str, message_id: str) -> None:
+        """Keep a running job's idle time low so nobody reclaims it"""
+        while True:
+            await asyncio.sleep(self.claim_idle_ms / 3000)
+            await self.redis.xclaim(stream, self.group, self.consumer, 0, [message_id], justid=True)
+
+    async def _deliveries(self, stream: str, message_id: str) -> int:
+        pending = await self.redis.xpending_range(stream, self.group, min=message_id, max=message_id, count=1)
+        return pending[0]["times_delivered"] if pending else 1
+
+    async def _process(
+        self,
+        stream: str,
+        message_id: str,
+        fields: Dict[str, str],
+        handler: JobHandler,
+        slots: asyncio.Semaphore
+    ) -> None:
+        job_id = fields.get("id", message_id)
+        try:
+            if await self._deliveries(stream, message_id) > self.max_deliveries:
+                result = {"status": "error", "detail": "Job failed on too many workers"}
+            elif await self.redis.exists(self._cancelled_key(job_id)):
+                result = {"status": "cancelled", "reason": await self.redis.get(self._cancelled_key(job_id))}
+            else:
+                result = await self._run(job_id, stream, message_id, fields, handler)
+
+            result["id"] = job_id
+            await self.redis.set(self._result_key(job_id), json.dumps(result), ex=self.result_ttl)
+            if fields.get("reply_to"):
+                await self.redis.publish(fields["reply_to"], json.dumps(result))
+            await self.redis.xack(stream, self.group, message_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Left pending; another worker reclaims it once it goes idle
+            self.logger.error(f"Could not complete job {job_id}: {str(e)}")
+        finally:
+            slots.release()
+
+    async def _run(
+        self,
+        job_id: str,
+        stream: str,
+        message_id: str,
+        fields: Dict[str, str],
+        handler: JobHandler
+    ) -> Dict[str, Any]:
+        deadline = float(fields["deadline"]) if fields.get("deadline") else None
+        token = CancellationToken(
+            deadline=time.monotonic() + (deadline - time.time()) if deadline is not None else None
+        )
+        self._running[job_id] = token
+        heartbeat = asyncio.create_task(self._heartbeat(stream, message_id))
+        try:
+            token.raise_if_cancelled()
+            return {"status": "done", "worker": self.consumer, **await handler(json.loads(fields["payload"]), token)}
+        except GenerationCancelled as e:
+            return {"status": "cancelled", "reason": e.reason}
+        except ValueError as e:
+            return {"status": "invalid", "detail": str(e)}
+        except Exception as e:
+            self.logger.error(f"Job {job_id} failed: {str(e)}")
+            return {"status": "error", "detail": str(e)}
+        finally:
+            heartbeat.cancel()
+            self._running.pop(job_id, None)
@@ -0,0 +1,85 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+import logging
+import os
+import threading
+import torch
+
+class LatentStore:
+    """Latents of recent generations: an in-memory LRU that spills to disk
+
+    Records are small dicts of CPU tensors plus the parameters that made
+    them. Records evicted from memory are written to spill_dir, which is
+    itself capped at disk_items files, oldest first.
+    """
+    def __init__(
+        self,
+        memory_items: int = 16,
+        spill_dir: Optional[Path] = None,
+        disk_items: int = 256
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self.memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.disk: "OrderedDict[str, Path]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        if self.spill_dir is not None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            # Keep spilled records from previous runs, oldest first
+            for path in sorted(self.spill_dir.glob("*.pt"), key=lambda p: p.stat().st_mtime):
+                self.disk[path.stem] = path
+
+    def _spill(self, generation_id: str, record: Dict[str, Any]) -> None:
+        if self.spill_dir is None:
+            return
+        if generation_id not in self.disk:
+            path = self.spill_dir / f"{generation_id}.pt"
+            tmp_path = path.with_suffix(".tmp")
+            try:
+                torch.save(record, tmp_path)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                self.logger.warning(f"Could not spill latents {generation_id}: {str(e)}")
+                return
+            self.disk[generation_id] = path
+        self.disk.move_to_end(generation_id)
+
+        while len(self.disk) > self.disk_items:
+            _, stale = self.disk.popitem(last=False)
+            stale.unlink(missing_ok=True)
+
+    def put(self, generation_id: str, record: Dict[str, Any]) -> None:
+        """Store a record, spilling the least recently used one if memory is full"""
+        with self._lock:
+            self.memory[generation_id] = record
+            self.memory.move_to_end(generation_id)
+            while len(self.memory) > self.memory_items:
+                evicted_id, evicted = self.memory.popitem(last=False)
+                self._spill(evicted_id, evicted)
+
+    def get(self, generation_id: str) -> Optional[Dict[str, Any]]:
+        """Look up a record, promoting disk hits back into memory"""
+        with self._lock:
+            record = self.memory.get(generation_id)
+            if record is not None:
+                self.memory.move_to_end(generation_id)
+                return record
+            path = self.disk.get(generation_id)
+
+        if path is None:
+            return None
+        try:
+            record = torch.load(path, map_location="cpu")
+        except (OSError, RuntimeError) as e:
+            self.logger.warning(f"Could not read spilled latents {generation_id}: {str(e)}")
+            return None
+        self.put(generation_id, record)
+        return record
+
+    def __contains__(self, generation_id: str) -> bool:
+        with self._lock:
+            return generation_id in self.memory or generation_id in self.disk
@@ -0,0 +1,23 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+import fcntl
+
+@contextmanager
+def file_lock(path: Path, shared: bool = False, blocking: bool = True) -> Iterator[bool]:
+    """flock a lock file for coordination between worker processes
+
+    Yields whether the lock was taken; only a non-blocking attempt can
+    yield False.
+    """
+    with open(path, "a") as lock_file:
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        try:
+            fcntl.flock(lock_file, flags if blocking else flags | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
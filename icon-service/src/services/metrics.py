@@ -0,0 +1,82 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Request coalescing
+COALESCE_LEADERS = Counter(
+    'coalesce_leaders_total',
+    'Generations started on behalf of a group of identical requests'
+)
+
+COALESCED_JOINS = Counter(
+    'coalesce_joins_total',
+    'Requests that attached to an identical in-flight generation'
+)
+
+COALESCE_FAILURES = Counter(
+    'coalesce_failures_total',
+    'Shared generations that did not produce a result',
+    ['reason']
+)
+
+COALESCE_INFLIGHT = Gauge(
+    'coalesce_inflight',
+    'Distinct shared generations currently in flight'
+)
+
+# Cancellation
+GENERATIONS_CANCELLED = Counter(
+    'generations_cancelled_total',
+    'Generations stopped before completion',
+    ['reason']
+)
+
+CANCELLED_COMPUTE_SECONDS = Counter(
+    'cancelled_compute_seconds_total',
+    'Inference time spent on generations that were later cancelled',
+    ['reason']
+)
+
+# Adaptive quality
+QUALITY_TIER = Counter(
+    'quality_tier_total',
+    'Requests served per adaptive quality tier',
+    ['tier']
+)
+
+QUALITY_PREDICTED_SECONDS = Gauge(
+    'quality_predicted_latency_seconds',
+    'Predicted latency of the most recently planned request'
+)
+
+# Fair-share scheduling
+SCHEDULER_QUEUE_WAIT = Histogram(
+    'scheduler_queue_wait_seconds',
+    'Time generation jobs wait for an inference slot',
+    ['role', 'priority'],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+
+SCHEDULER_QUEUE_DEPTH = Gauge(
+    'scheduler_queue_depth',
+    'Generation jobs waiting for an inference slot',
+    ['priority']
+)
+
+# Semantic prompt cache
+SEMANTIC_CACHE_LOOKUPS = Counter(
+    'semantic_cache_lookups_total',
+    'Semantic prompt cache lookups',
+    ['result']
+)
+
+SEMANTIC_CACHE_LOOKUP_SECONDS = Histogram(
+    'semantic_cache_lookup_seconds',
+    'Time to search the semantic prompt index',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+)
+
+# Startup
+SERVICE_LOAD_SECONDS = Gauge(
+    'service_load_seconds',
+    'Time taken to import and construct a lazily loaded subsystem',
+    ['service']
+)
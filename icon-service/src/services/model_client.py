@@ -0,0 +1,154 @@
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Connection
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+import itertools
+import logging
+import threading
+import time
+from .cancellation import CancellationToken
+from .ipc import Address, raise_error, unpack
+
+class RemoteModelService:
+    """Stand-in for StableDiffusionService that forwards to a ModelServer
+
+    Calls block the calling thread (an inference pool thread) until the
+    server replies; many calls can be in flight over one connection.
+    Cancelling a call's token asks the server to stop that generation.
+    """
+    def __init__(self, address: Address, authkey: bytes, connect_timeout: float = 60.0):
+        self.logger = logging.getLogger(__name__)
+        self.address = address
+        self.authkey = authkey
+        self.connect_timeout = connect_timeout
+        self._connection: Optional[Connection] = None
+        self._pending: Dict[int, Future] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+
+        info = self._call("info")
+        self.resolution = info["resolution"]
+        self.embedding_dim = info["embedding_dim"]
+        self.backend = SimpleNamespace(name=info["backend"])
+        self.decoders = info["decoders"]
+
+    def _connect(self) -> Connection:
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                connection = Client(self.address, authkey=self.authkey)
+                break
+            except (ConnectionRefusedError, FileNotFoundError):
+                # The model server may still be loading weights
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.5)
+        self.logger.info(f"Connected to model server at {self.address}")
+        threading.Thread(target=self._receive, args=(connection,), name="model-client", daemon=True).start()
+        return connection
+
+    def _receive(self, connection: Connection) -> None:
+        while True:
+            try:
+                reply = connection.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                future = self._pending.pop(reply["id"], None)
+            if future is not None:
+                future.set_result(reply)
+
+        # Fail whatever was waiting; the next call reconnects
+        with self._lock:
+            if self._connection is connection:
+                self._connection = None
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(ConnectionError("Lost connection to model server"))
+
+    def _call(self, method: str, *args, cancel_token: Optional[CancellationToken] = None, cost: float = 1.0, **kwargs) -> Any:
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        future: Future = Future()
+        with self._lock:
+            if self._connection is None:
+                self._connection = self._connect()
+            connection = self._connection
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+        message = {"id": request_id, "method": method, "args": list(args), "kwargs": kwargs, "cost": cost}
+        with self._send_lock:
+            connection.send(message)
+
+        if cancel_token is not None:
+            cancel_token.add_callback(lambda: self._send_cancel(connection, request_id, cancel_token.reason))
+
+        reply = future.result()
+        if "error" in reply:
+            raise_error(reply)
+        return unpack(reply["value"])
+
+    def _send_cancel(self, connection: Connection, request_id: int, reason: Optional[str]) -> None:
+        with self._lock:
+            if request_id not in self._pending:
+                return
+        try:
+            with self._send_lock:
+                connection.send({"cancel": request_id, "reason": reason})
+        except (OSError, ValueError):
+            pass
+
+    def resolve_decoder(self, decoder: Optional[str]) -> str:
+        """Validate a decoder name, falling back to full when the server has no TAESD"""
+        decoder = decoder or "full"
+        if decoder == "tiny" and "tiny" not in self.decoders:
+            self.logger.warning("Tiny decoder requested but the model server has none; using full VAE")
+            return "full"
+        if decoder not in self.decoders:
+            raise ValueError(f"Unsupported decoder: {decoder}")
+        return decoder
+
+    def prompt_embedding(self, prompt: str):
+        return self._call("prompt_embedding", prompt)
+
+    def get_progress(self) -> Dict[str, Any]:
+        return self._call("get_progress")
+
+    def get_preview(self):
+        return self._call("get_preview")
+
+    def generate_image(self, prompt: str, cancel_token: Optional[CancellationToken] = None, **kwargs):
+        return self._call(
+            "generate_image", prompt,
+            cancel_token=cancel_token,
+            cost=kwargs.get("num_steps") or 20,
+            **kwargs
+        )
+
+    def generate_images(self, prompt: str, seeds, generation_ids=None, cancel_token: Optional[CancellationToken] = None, **kwargs):
+        return self._call(
+            "generate_images", prompt, list(seeds), generation_ids,
+            cancel_token=cancel_token,
+            cost=len(seeds) * (kwargs.get("num_steps") or 20),
+            **kwargs
+        )
+
+    def generate_variations(self, generation_id: str, count: int = 4, cancel_token: Optional[CancellationToken] = None, **kwargs):
+        return self._call(
+            "generate_variations", generation_id, count,
+            cancel_token=cancel_token,
+            cost=count * (kwargs.get("num_steps") or 20) * kwargs.get("strength", 0.5),
+            **kwargs
+        )
+
+    def refine(self, generation_id: str, cancel_token: Optional[CancellationToken] = None, **kwargs):
+        return self._call(
+            "refine", generation_id,
+            cancel_token=cancel_token,
+            cost=(kwargs.get("num_steps") or 20) * kwargs.get("strength", 0.3),
+            **kwargs
+        )
+
+    def redecode(self, generation_id: str, decoder: str = "full"):
+        return self._call("redecode", generation_id, decoder)
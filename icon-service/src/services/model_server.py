@@ -0,0 +1,161 @@
+from multiprocessing.connection import Connection, Listener
+from typing import Any, Dict, List, Optional
+import asyncio
+import itertools
+import logging
+import os
+import threading
+from .cancellation import CancellationToken, GenerationCancelled
+from .decoders import DECODERS
+from .ipc import Address, pack, release_segment, error_reply
+from .scheduler import FairScheduler
+
+# Methods API workers may call; the scheduled ones queue for an inference slot
+SCHEDULED_METHODS = ("generate_image", "generate_images", "generate_variations", "refine", "redecode")
+CANCELLABLE_METHODS = ("generate_image", "generate_images", "generate_variations", "refine")
+DIRECT_METHODS = ("prompt_embedding", "get_progress", "get_preview")
+
+class ModelServer:
+    """Owns the model and serves it to API worker processes
+
+    Workers connect over a multiprocessing connection (Unix socket or
+    localhost TCP) and send small request dicts. Images come back as
+    shared memory descriptors rather than pickled pixels. Jobs from all
+    workers share one FairScheduler, with each connection as a tenant;
+    workers keep their own per-user fair queues in front of it.
+    """
+    def __init__(
+        self,
+        service,
+        address: Address,
+        authkey: bytes,
+        max_concurrency: int = 1,
+        quantum: float = 20.0
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.service = service
+        self.address = address
+        self.authkey = authkey
+        self.scheduler = FairScheduler(max_concurrency=max_concurrency, quantum=quantum)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._worker_ids = itertools.count(1)
+
+    def info(self) -> Dict[str, Any]:
+        """What workers need to validate requests without the model"""
+        return {
+            "resolution": self.service.resolution,
+            "embedding_dim": self.service.embedding_dim,
+            "backend": self.service.backend.name,
+            "decoders": [
+                decoder for decoder in DECODERS
+                if decoder != "tiny" or self.service.tiny_decoder is not None
+            ]
+        }
+
+    def serve_forever(self) -> None:
+        asyncio.run(self._serve())
+
+    async def _serve(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            # Stale socket from a previous run
+            os.unlink(self.address)
+        listener = Listener(self.address, authkey=self.authkey)
+        self.logger.info(f"Model server listening on {listener.address}")
+        try:
+            while True:
+                try:
+                    connection = await self.loop.run_in_executor(None, listener.accept)
+                except (OSError, EOFError) as e:
+                    # Includes failed authkey handshakes
+                    self.logger.warning(f"Rejected worker connection: {str(e)}")
+                    continue
+                worker = f"worker-{next(self._worker_ids)}"
+                self.logger.info(f"{worker} connected")
+                threading.Thread(
+                    target=self._read,
+                    args=(connection, worker),
+                    name=f"model-server-{worker}",
+                    daemon=True
+                ).start()
+        finally:
+            listener.close()
+            self.scheduler.shutdown()
+
+    def _read(self, connection: Connection, worker: str) -> None:
+        """Receive requests from one worker until it disconnects"""
+        send_lock = threading.Lock()
+        tokens: Dict[int, CancellationToken] = {}
+        while True:
+            try:
+                message = connection.recv()
+            except (EOFError, OSError):
+                break
+            if "cancel" in message:
+                token = tokens.get(message["cancel"])
+                if token is not None:
+                    token.cancel(message.get("reason") or "cancelled")
+                continue
+            token = CancellationToken()
+            tokens[message["id"]] = token
+            asyncio.run_coroutine_threadsafe(
+                self._handle(connection, send_lock, tokens, worker, message, token),
+                self.loop
+            )
+
+        # Nobody is left to receive the results
+        self.logger.info(f"{worker} disconnected")
+        for token in list(tokens.values()):
+            token.cancel("disconnected")
+        connection.close()
+
+    async def _handle(
+        self,
+        connection: Connection,
+        send_lock: threading.Lock,
+        tokens: Dict[int, CancellationToken],
+        worker: str,
+        message: Dict[str, Any],
+        token: CancellationToken
+    ) -> None:
+        request_id = message["id"]
+        method = message["method"]
+        args = message.get("args", [])
+        kwargs = message.get("kwargs", {})
+        segments: List = []
+        try:
+            if method == "info":
+                value = self.info()
+            elif method in SCHEDULED_METHODS:
+                if method in CANCELLABLE_METHODS:
+                    kwargs["cancel_token"] = token
+                fn = getattr(self.service, method)
+                value = await self.scheduler.submit(
+                    lambda: fn(*args, **kwargs),
+                    tenant=worker,
+                    cost=message.get("cost", 1.0),
+                    token=token
+                )
+            elif method in DIRECT_METHODS:
+                fn = getattr(self.service, method)
+                value = await self.loop.run_in_executor(None, lambda: fn(*args, **kwargs))
+            else:
+                raise ValueError(f"Unknown model server method: {method}")
+            reply = {"id": request_id, "value": pack(value, segments)}
+        except Exception as e:
+            if not isinstance(e, (GenerationCancelled, KeyError, ValueError)):
+                self.logger.error(f"{method} failed for {worker}: {str(e)}")
+            reply = error_reply(request_id, e)
+        finally:
+            tokens.pop(request_id, None)
+
+        sent = False
+        try:
+            with send_lock:
+                connection.send(reply)
+            sent = True
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Could not reply to {worker}: {str(e)}")
+        finally:
+            for segment in segments:
+                release_segment(segment, handed_off=sent)
@@ -0,0 +1,46 @@
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+import json
+import logging
+import threading
+import time
+import uuid
+
+class RequestRecorder:
+    """Appends request parameters to a JSONL log for later replay"""
+    def __init__(self, path: str):
+        self.logger = logging.getLogger(__name__)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.logger.info(f"Recording requests to {self.path}")
+
+    def record(self, endpoint: str, params: Dict[str, Any]) -> str:
+        """Append one request and return its request_id"""
+        request_id = uuid.uuid4().hex
+        line = json.dumps({
+            "request_id": request_id,
+            "timestamp": time.time(),
+            "endpoint": endpoint,
+            "params": params
+        })
+        try:
+            with self._lock, self.path.open("a", encoding="utf-8") as log_file:
+                log_file.write(line + "\n")
+        except OSError as e:
+            # Recording must never fail the request itself
+            self.logger.error(f"Failed to record request: {str(e)}")
+        return request_id
+
+def read_request_log(path: str, endpoint: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Yield recorded requests, optionally filtered by endpoint"""
+    with open(path, encoding="utf-8") as log_file:
+        for line in log_file:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if "endpoint" not in entry or "params" not in entry:
+                continue
+            if endpoint is None or entry["endpoint"] == endpoint:
+                yield entry
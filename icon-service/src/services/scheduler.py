@@ -0,0 +1,178 @@
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional, Set, Tuple
+import asyncio
+import logging
+import time
+from .cancellation import CancellationToken, GenerationCancelled
+from .metrics import SCHEDULER_QUEUE_WAIT, SCHEDULER_QUEUE_DEPTH
+
+PRIORITIES = ("interactive", "bulk")
+
+class _Job:
+    __slots__ = ("fn", "tenant", "role", "weight", "priority", "cost", "future", "enqueued_at", "started", "cancelled")
+
+    def __init__(self, fn, tenant, role, weight, priority, cost, future):
+        self.fn = fn
+        self.tenant = tenant
+        self.role = role
+        self.weight = weight
+        self.priority = priority
+        self.cost = cost
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+        self.started = False
+        self.cancelled = False
+
+class FairScheduler:
+    """Weighted fair queuing of inference jobs across tenants
+
+    Within a priority class, tenants are served by deficit round robin:
+    each visit adds ``quantum * weight`` credit and jobs run while their
+    cost (roughly, denoising steps) fits the credit. Interactive jobs
+    always go before bulk ones. Jobs run on a dedicated inference pool
+    of ``max_concurrency`` threads.
+    """
+    def __init__(self, max_concurrency: int = 1, quantum: float = 20.0):
+        if quantum <= 0:
+            # No credit would ever accrue and nothing would be dispatched
+            raise ValueError("quantum must be positive")
+        self.logger = logging.getLogger(__name__)
+        self.max_concurrency = max_concurrency
+        self.quantum = quantum
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_concurrency,
+            thread_name_prefix="inference"
+        )
+        self.queues: Dict[str, "OrderedDict[str, Deque[_Job]]"] = {p: OrderedDict() for p in PRIORITIES}
+        self.rings: Dict[str, Deque[str]] = {p: deque() for p in PRIORITIES}
+        self.deficits: Dict[Tuple[str, str], float] = {}
+        self._visited: Set[Tuple[str, str]] = set()
+        self.running = 0
+
+    def queue_depth(self, priority: Optional[str] = None) -> int:
+        priorities = [priority] if priority else PRIORITIES
+        return sum(
+            sum(1 for job in queue if not job.cancelled)
+            for p in priorities
+            for queue in self.queues[p].values()
+        )
+
+    async def submit(
+        self,
+        fn: Callable[[], Any],
+        tenant: str,
+        weight: float = 1.0,
+        priority: str = "interactive",
+        cost: float = 1.0,
+        token: Optional[CancellationToken] = None,
+        role: str = "default"
+    ) -> Any:
+        """Queue fn for the tenant and return its result once it has run
+
+        role only labels metrics; tenants (one per client address for
+        anonymous callers) are too many to use as a label.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unsupported priority: {priority}")
+
+        loop = asyncio.get_running_loop()
+        job = _Job(fn, tenant, role, max(weight, 0.01), priority, max(cost, 0.0), loop.create_future())
+
+        queue = self.queues[priority].setdefault(tenant, deque())
+        if not queue:
+            self.rings[priority].append(tenant)
+        queue.append(job)
+        self._update_depth(priority)
+
+        if token is not None:
+            token.add_callback(lambda: loop.call_soon_threadsafe(self._cancel_queued, job, token.reason))
+
+        self._dispatch()
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            self._cancel_queued(job, "cancelled")
+            raise
+
+    def _cancel_queued(self, job: _Job, reason: str) -> None:
+        """Drop a job that has not started yet"""
+        if job.started or job.cancelled:
+            return
+        job.cancelled = True
+        if not job.future.done():
+            job.future.set_exception(GenerationCancelled(reason))
+        self._update_depth(job.priority)
+
+    def _next_job(self) -> Optional[_Job]:
+        for priority in PRIORITIES:
+            ring = self.rings[priority]
+            queues = self.queues[priority]
+            while ring:
+                tenant = ring[0]
+                key = (priority, tenant)
+                queue = queues[tenant]
+                while queue and queue[0].cancelled:
+                    queue.popleft()
+                if not queue:
+                    # Idle tenants do not bank credit
+                    ring.popleft()
+                    del queues[tenant]
+                    self.deficits.pop(key, None)
+                    self._visited.discard(key)
+                    continue
+
+                job = queue[0]
+                if key not in self._visited:
+                    self._visited.add(key)
+                    self.deficits[key] = self.deficits.get(key, 0.0) + self.quantum * job.weight
+                if self.deficits[key] >= job.cost:
+                    self.deficits[key] -= job.cost
+                    queue.popleft()
+                    return job
+
+                # Out of credit this round; move on to the next tenant
+                self._visited.discard(key)
+                ring.rotate(-1)
+        return None
+
+    def _dispatch(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self.running < self.max_concurrency:
+            job = self._next_job()
+            if job is None:
+                return
+            job.started = True
+            self.running += 1
+            SCHEDULER_QUEUE_WAIT.labels(role=job.role, priority=job.priority).observe(
+                time.perf_counter() - job.enqueued_at
+            )
+            self._update_depth(job.priority)
+            future = loop.run_in_executor(self.executor, job.fn)
+            future.add_done_callback(lambda f, job=job: self._complete(job, f))
+
+    def _complete(self, job: _Job, future: asyncio.Future) -> None:
+        self.running -= 1
+        if not job.future.done():
+            if future.cancelled():
+                job.future.cancel()
+            elif future.exception() is not None:
+                job.future.set_exception(future.exception())
+            else:
+                job.future.set_result(future.result())
+        self._dispatch()
+
+    def _update_depth(self, priority: str) -> None:
+        SCHEDULER_QUEUE_DEPTH.labels(priority=priority).set(self.queue_depth(priority))
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False)
+
+def parse_role_weights(spec: str) -> Dict[str, float]:
+    """Parse 'admin=4,pro=2' into a role -> weight map"""
+    weights = {}
+    for item in spec.split(","):
+        if "=" in item:
+            role, weight = item.split("=", 1)
+            weights[role.strip()] = float(weight)
+    return weights
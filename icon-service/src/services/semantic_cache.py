@@ -0,0 +1,328 @@
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import numpy as np
+from PIL import Image
+from .locks import file_lock
+from .metrics import SEMANTIC_CACHE_LOOKUPS, SEMANTIC_CACHE_LOOKUP_SECONDS
+
+SEMANTIC_CACHE_MODES = ("off", "return", "candidate")
+
+class VectorIndex:
+    """Unit vectors in a float16 memmap with brute-force or IVF top-k search
+
+    Rows form a ring: once capacity is reached the oldest row is reused.
+    Row metadata lives in an append-only JSONL file, compacted when it
+    grows past twice the capacity. The files are shared by every worker
+    process: writers hold an exclusive file lock, and each process reads
+    the entries others appended before it adds or searches, so the next
+    row is always taken from the log. Past ivf_threshold rows, an IVF
+    partitioning (k-means centroids) restricts search to the nprobe
+    closest partitions.
+    """
+    def __init__(
+        self,
+        path: Path,
+        dim: int,
+        capacity: int = 50000,
+        ivf_threshold: int = 20000,
+        nprobe: int = 8,
+        chunk_rows: int = 8192
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.capacity = capacity
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.chunk_rows = chunk_rows
+        self._lock = threading.Lock()
+
+        self.meta: Dict[int, Dict[str, Any]] = {}
+        self.next_row = 0
+        self._log_lines = 0
+        # How far into the metadata log this process has read, and which file it was
+        self._log_offset = 0
+        self._log_inode: Optional[int] = None
+
+        # IVF state, rebuilt in memory when the index outgrows it
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments: Optional[np.ndarray] = None
+        self._trained_size = 0
+
+        with file_lock(self._lock_path):
+            self._open()
+
+    @property
+    def _vectors_path(self) -> Path:
+        return self.path / "vectors.npy"
+
+    @property
+    def _meta_path(self) -> Path:
+        return self.path / "entries.jsonl"
+
+    @property
+    def _lock_path(self) -> Path:
+        return self.path / "index.lock"
+
+    @property
+    def size(self) -> int:
+        return len(self.meta)
+
+    def _open(self) -> None:
+        if self._vectors_path.exists():
+            self.vectors = np.load(self._vectors_path, mmap_mode="r+")
+            if self.vectors.shape != (self.capacity, self.dim):
+                self.logger.warning("Vector index shape changed; starting a new index")
+                self._reset()
+                return
+        else:
+            self._reset()
+            return
+        self._catch_up()
+
+    def _catch_up(self) -> None:
+        """Read entries appended to the log since this process last looked"""
+        try:
+            stat = self._meta_path.stat()
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._log_inode or stat.st_size < self._log_offset:
+            # Compacted by another process: read it again from the start
+            self.meta = {}
+            self.next_row = 0
+            self._log_lines = 0
+            self._log_offset = 0
+            self._log_inode = stat.st_ino
+        elif stat.st_size == self._log_offset:
+            return
+
+        added = []
+        with self._meta_path.open("rb") as meta_file:
+            meta_file.seek(self._log_offset)
+            for line in meta_file:
+                if not line.endswith(b"\n"):
+                    # Partly written; read it next time
+                    break
+                self._log_offset += len(line)
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self.meta[entry["row"]] = entry
+                self.next_row = (entry["row"] + 1) % self.capacity
+                self._log_lines += 1
+                added.append(entry["row"])
+        if self.centroids is not None and added:
+            rows = np.asarray(added, dtype=np.int64)
+            self.assignments[rows] = self._nearest_centroids(np.asarray(self.vectors[rows]), 1)[:, 0]
+
+    def _reset(self) -> None:
+        self.vectors = np.lib.format.open_memmap(
+            self._vectors_path,
+            mode="w+",
+            dtype=np.float16,
+            shape=(self.capacity, self.dim)
+        )
+        self._meta_path.unlink(missing_ok=True)
+        self.meta = {}
+        self.next_row = 0
+        self._log_lines = 0
+        self._log_offset = 0
+        self._log_inode = None
+
+    def _compact_log(self) -> None:
+        tmp_path = self._meta_path.with_suffix(".tmp")
+        with tmp_path.open("w", encoding="utf-8") as meta_file:
+            # Keep ring order so the next row is recovered on reload
+            rows = sorted(self.meta, key=lambda row: (row - self.next_row) % self.capacity)
+            for row in rows:
+                meta_file.write(json.dumps(self.meta[row]) + "\n")
+        os.replace(tmp_path, self._meta_path)
+        self._log_lines = len(self.meta)
+        stat = self._meta_path.stat()
+        self._log_inode = stat.st_ino
+        self._log_offset = stat.st_size
+
+    def add(self, vector: np.ndarray, meta: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Store a vector, returning the metadata of the entry it replaced"""
+        with self._lock, file_lock(self._lock_path):
+            self._catch_up()
+            row = self.next_row
+            replaced = self.meta.get(row)
+            self.vectors[row] = vector.astype(np.float16)
+            self.vectors.flush()
+
+            entry = {**meta, "row": row}
+            self.meta[row] = entry
+            self.next_row = (row + 1) % self.capacity
+            with self._meta_path.open("a", encoding="utf-8") as meta_file:
+                meta_file.write(json.dumps(entry) + "\n")
+            stat = self._meta_path.stat()
+            self._log_inode = stat.st_ino
+            self._log_offset = stat.st_size
+            self._log_lines += 1
+            if self._log_lines > 2 * self.capacity:
+                self._compact_log()
+
+            if self.centroids is not None:
+                self.assignments[row] = self._nearest_centroids(vector[None, :], 1)[0, 0]
+            return replaced
+
+    def _nearest_centroids(self, vectors: np.ndarray, count: int) -> np.ndarray:
+        scores = vectors.astype(np.float32) @ self.centroids.T
+        count = min(count, scores.shape[1])
+        return np.argpartition(-scores, count - 1, axis=1)[:, :count]
+
+    def _train(self, iterations: int = 10) -> None:
+        """k-means over a sample of stored vectors"""
+        rows = np.fromiter(self.meta.keys(), dtype=np.int64)
+        nlist = max(1, int(np.sqrt(len(rows))))
+        rng = np.random.default_rng(0)
+        sample = np.asarray(self.vectors[np.sort(rng.choice(rows, min(len(rows), nlist * 64), replace=False))], dtype=np.float32)
+
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for cluster in range(nlist):
+                members = sample[labels == cluster]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[cluster] = centroid / max(np.linalg.norm(centroid), 1e-12)
+        self.centroids = centroids
+
+        self.assignments = np.full(self.capacity, -1, dtype=np.int32)
+        for start in range(0, len(rows), self.chunk_rows):
+            chunk = rows[start:start + self.chunk_rows]
+            self.assignments[chunk] = self._nearest_centroids(np.asarray(self.vectors[chunk]), 1)[:, 0]
+        self._trained_size = len(rows)
+        self.logger.info(f"Trained IVF index with {nlist} partitions over {len(rows)} vectors")
+
+    def search(self, query: np.ndarray, k: int = 8, key: Optional[str] = None) -> List[Tuple[Dict[str, Any], float]]:
+        """Top-k entries by cosine similarity, only among entries stored under key if given"""
+        with self._lock:
+            with file_lock(self._lock_path, shared=True):
+                self._catch_up()
+            size = self.size
+            if size == 0:
+                return []
+            query = query.astype(np.float32)
+
+            if size >= self.ivf_threshold:
+                if self.centroids is None or size >= 2 * self._trained_size:
+                    self._train()
+                probes = self._nearest_centroids(query[None, :], self.nprobe)[0]
+                candidates = np.flatnonzero(np.isin(self.assignments, probes))
+            else:
+                # Rows fill from 0 until the ring wraps, so the first `size` rows are live
+                candidates = np.arange(size)
+            if key is not None:
+                # Filter before ranking so other settings cannot crowd out the top k
+                candidates = candidates[np.fromiter(
+                    (self.meta.get(int(row), {}).get("key") == key for row in candidates),
+                    dtype=bool,
+                    count=len(candidates)
+                )]
+
+            scores = np.empty(len(candidates), dtype=np.float32)
+            for start in range(0, len(candidates), self.chunk_rows):
+                chunk = candidates[start:start + self.chunk_rows]
+                # float16 storage, float32 math: numpy has no fast half-precision matmul
+                scores[start:start + len(chunk)] = np.asarray(self.vectors[chunk], dtype=np.float32) @ query
+
+            k = min(k, len(candidates))
+            if k == 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self.meta[int(candidates[i])], float(scores[i])) for i in top if int(candidates[i]) in self.meta]
+
+class SemanticPromptCache:
+    """Reuses images generated for near-duplicate prompts
+
+    Prompts are compared by cosine similarity of their CLIP text
+    embeddings. Matches only count between requests with the same
+    generation settings. In "return" mode a match above the threshold
+    is served instead of generating; in "candidate" mode it is only
+    offered alongside the fresh generation.
+    """
+    def __init__(
+        self,
+        cache_dir: Path,
+        dim: int,
+        mode: str = "off",
+        threshold: float = 0.95,
+        capacity: int = 50000,
+        ivf_threshold: int = 20000
+    ):
+        if mode not in SEMANTIC_CACHE_MODES:
+            raise ValueError(f"Unsupported semantic cache mode: {mode}")
+        self.logger = logging.getLogger(__name__)
+        self.mode = mode
+        self.threshold = threshold
+        self.cache_dir = Path(cache_dir)
+        self.images_dir = self.cache_dir / "images"
+        self.images_dir.mkdir(parents=True, exist_ok=True)
+        self.index = VectorIndex(self.cache_dir / "index", dim, capacity=capacity, ivf_threshold=ivf_threshold)
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    @staticmethod
+    def settings_key(params: Dict[str, Any]) -> str:
+        """Generation settings a cached image must share with the request"""
+        return json.dumps({
+            key: params.get(key)
+            for key in (
+                "num_steps",
+                "guidance_scale",
+                "guidance_cutoff",
+                "fast_mode",
+                "cache_interval",
+                "height",
+                "width",
+                "scheduler",
+                "decoder"
+            )
+        }, sort_keys=True)
+
+    def lookup(self, embedding: np.ndarray, settings_key: Optional[str] = None, k: int = 8) -> List[Dict[str, Any]]:
+        """Cached entries above the similarity threshold, best first"""
+        started = time.perf_counter()
+        matches = [
+            {**entry, "similarity": similarity}
+            for entry, similarity in self.index.search(embedding, k, key=settings_key)
+            if similarity >= self.threshold
+        ]
+        SEMANTIC_CACHE_LOOKUP_SECONDS.observe(time.perf_counter() - started)
+        SEMANTIC_CACHE_LOOKUPS.labels(result="hit" if matches else "miss").inc()
+        return matches
+
+    def add(self, embedding: np.ndarray, prompt: str, settings_key: str, image: Image.Image) -> str:
+        """Store a generated image under its prompt embedding"""
+        entry_id = uuid.uuid4().hex
+        path = self.image_path(entry_id)
+        tmp_path = path.with_suffix(".tmp")
+        image.save(tmp_path, format="PNG")
+        os.replace(tmp_path, path)
+
+        replaced = self.index.add(embedding, {"id": entry_id, "prompt": prompt, "key": settings_key})
+        if replaced is not None:
+            self.image_path(replaced["id"]).unlink(missing_ok=True)
+        return entry_id
+
+    def image_path(self, entry_id: str) -> Path:
+        return self.images_dir / f"{entry_id}.png"
+
+    def load_image(self, entry_id: str) -> Optional[Image.Image]:
+        path = self.image_path(entry_id)
+        if not path.exists():
+            return None
+        with Image.open(path) as image:
+            return image.copy()
@@ -1,22 +1,71 @@
+import numpy as np
 import torch
-from diffusers import StableDiffusionPipeline
+from diffusers import (
+    StableDiffusionPipeline,
+    DDIMScheduler,
+    DPMSolverMultistepScheduler,
+    EulerAncestralDiscreteScheduler,
+    PNDMScheduler
+)
 from PIL import Image
-import io
 import os
 import time
 from huggingface_hub import snapshot_download, HfFolder
 import gc
 import logging
+from typing import Any, Callable, Dict, List, Optional, Union
 from pathlib import Path
 from .state import generation_state
+from .deep_cache import DeepCacheUNet
+from .decoders import DECODERS, tiled_decode, load_tiny_decoder
+from .backends import TorchBackend, create_backend
+from .latent_store import LatentStore
+from .encoding import ImageEncoder
+from .cancellation import CancellationToken, GenerationCancelled
+from .metrics import GENERATIONS_CANCELLED, CANCELLED_COMPUTE_SECONDS
+
+# Schedulers selectable per request; all share the model's noise schedule config
+SCHEDULERS = {
+    "pndm": PNDMScheduler,
+    "ddim": DDIMScheduler,
+    "dpm": DPMSolverMultistepScheduler,
+    "euler_a": EulerAncestralDiscreteScheduler
+}
+
+# Schedulers without per-run history, which can start partway through a schedule
+SINGLE_STEP_SCHEDULERS = (DDIMScheduler, EulerAncestralDiscreteScheduler)
 
 class StableDiffusionService:
-    def __init__(self):
+    def __init__(
+        self,
+        encoder: ImageEncoder = None,
+        models_dir: str = "/app/shared/models",
+        cache_dir: str = "/app/shared/cache",
+        pipeline: StableDiffusionPipeline = None
+    ):
         self.logger = logging.getLogger(__name__)
+        self.encoder = encoder or ImageEncoder(max_workers=1)
+        self.resolution = 512
+
+        # Steps between full UNet passes in fast mode
+        self.cache_interval = int(os.getenv("DEEPCACHE_INTERVAL", "3"))
+
+        # Called with the wall time of every denoising step
+        self.step_listeners = []
+
+        # Latents of recent generations, for re-decoding, variations and refinement
+        self.latent_store = LatentStore(
+            memory_items=int(os.getenv("LATENT_CACHE_SIZE", "16")),
+            spill_dir=Path(cache_dir) / "latents",
+            disk_items=int(os.getenv("LATENT_DISK_ITEMS", "256"))
+        )
+
+        # Decode a tiny-decoder preview every N steps (0 disables)
+        self.preview_every = int(os.getenv("PREVIEW_EVERY", "0"))
         
         # Define persistent paths
-        self.models_dir = Path("/app/shared/models")
-        self.cache_dir = Path("/app/shared/cache")
+        self.models_dir = Path(models_dir)
+        self.cache_dir = Path(cache_dir)
         self.model_id = "CompVis/stable-diffusion-v1-4"
         
         # Ensure directories exist
@@ -33,7 +82,25 @@ class StableDiffusionService:
         self.logger.info(f"Cache directory: {self.cache_dir}")
         self.logger.info(f"Models directory: {self.models_dir}")
         
-        self._initialize_model()
+        if pipeline is not None:
+            # Pre-built pipeline (benchmarks, load tests)
+            self.pipeline = pipeline.to(self.device)
+        else:
+            self._initialize_model()
+
+        # Optional TAESD weights for drafts and previews
+        self.tiny_decoder = load_tiny_decoder(self.models_dir / "taesd", self.device)
+
+        # Execution backend for text encoder, UNet and VAE decoder
+        self.backend = TorchBackend(self.pipeline)
+        if isinstance(self.pipeline, StableDiffusionPipeline):
+            self.backend = create_backend(
+                os.getenv("INFERENCE_BACKEND", "torch"),
+                self.pipeline,
+                self.models_dir / self.model_id.split('/')[-1] / "onnx",
+                threads=int(os.getenv("ONNX_THREADS", "0")) or None,
+                parity_tolerance=float(os.getenv("BACKEND_PARITY_TOLERANCE", "1e-2"))
+            )
 
     def _is_model_cached(self):
         """Check if model files exist in cache"""
@@ -99,40 +166,475 @@ class StableDiffusionService:
             self.logger.error(f"Error initializing model: {str(e)}")
             raise
 
-    def generate_icon(self, prompt: str, **kwargs):
+    def _single_step(self, scheduler_name: Optional[str]) -> bool:
+        if not isinstance(self.pipeline, StableDiffusionPipeline):
+            return True
+        return issubclass(SCHEDULERS.get(scheduler_name, type(self.pipeline.scheduler)), SINGLE_STEP_SCHEDULERS)
+
+    def _pipeline_for(self, scheduler_name: str = None) -> StableDiffusionPipeline:
+        """Pipeline view sharing the loaded modules but with its own scheduler
+
+        Schedulers keep per-run state, so concurrent requests must not
+        share one; building a view only re-wires references.
+        """
+        if not isinstance(self.pipeline, StableDiffusionPipeline):
+            return self.pipeline
+        if scheduler_name is not None and scheduler_name not in SCHEDULERS:
+            raise ValueError(f"Unsupported scheduler: {scheduler_name}")
+
+        scheduler_cls = SCHEDULERS.get(scheduler_name, type(self.pipeline.scheduler))
+        components = dict(self.pipeline.components)
+        components["scheduler"] = scheduler_cls.from_config(self.pipeline.scheduler.config)
+        return StableDiffusionPipeline(**components, requires_safety_checker=False)
+
+    def _encode_prompt(self, pipeline: StableDiffusionPipeline, prompts: List[str]) -> torch.Tensor:
+        """CLIP text embeddings for a batch of prompts"""
+        tokens = pipeline.tokenizer(
+            prompts,
+            padding="max_length",
+            max_length=pipeline.tokenizer.model_max_length,
+            truncation=True,
+            return_tensors="pt"
+        )
+        return self.backend.encode_text(tokens.input_ids.to(self.device))
+
+    @property
+    def embedding_dim(self) -> Optional[int]:
+        """Size of prompt_embedding vectors, or None if the pipeline has no text encoder"""
+        if not isinstance(self.pipeline, StableDiffusionPipeline):
+            return None
+        return self.pipeline.text_encoder.config.hidden_size
+
+    def prompt_embedding(self, prompt: str) -> np.ndarray:
+        """Unit-length CLIP embedding of a prompt (hidden state at the end token)"""
+        tokens = self.pipeline.tokenizer(
+            [prompt],
+            padding="max_length",
+            max_length=self.pipeline.tokenizer.model_max_length,
+            truncation=True,
+            return_tensors="pt"
+        )
+        with torch.inference_mode():
+            hidden = self.backend.encode_text(tokens.input_ids.to(self.device))
+            # CLIP's end-of-text token has the highest id; its state summarizes the prompt
+            pooled = hidden[0, tokens.input_ids[0].argmax()]
+        vector = pooled.float().cpu().numpy()
+        return vector / max(np.linalg.norm(vector), 1e-12)
+
+    def _denoise(
+        self,
+        pipeline: StableDiffusionPipeline,
+        prompt: Union[str, List[str]],
+        num_steps: int,
+        guidance_scale: float,
+        guidance_cutoff: Optional[float],
+        fast_mode: bool,
+        cache_interval: int,
+        height: int,
+        width: int,
+        generators: List[Optional[torch.Generator]],
+        callback: Callable[[int, int, torch.Tensor], None],
+        init_latents: Optional[torch.Tensor] = None,
+        start_step: int = 0,
+        renoise: bool = False,
+        trajectory: Optional[List[torch.Tensor]] = None
+    ) -> torch.Tensor:
+        """Denoising loop with a classifier-free guidance schedule; returns latents
+
+        With guidance_scale <= 1 the unconditional UNet pass contributes
+        nothing and is skipped. guidance_cutoff (0-1) turns guidance off
+        after that fraction of the steps; late steps mostly refine
+        detail, so each one then costs a single UNet pass instead of two.
+        fast_mode reuses deep UNet features for cache_interval steps.
+
+        One image is made per generator, all sharing the prompt
+        embeddings, or one prompt per generator when given a list.
+        init_latents resumes from start_step, optionally re-noised to
+        that step's noise level first. Steps count scheduler steps, not
+        UNet calls: PNDM's warm-up takes two calls for its first step.
+        """
+        batch_size = len(generators)
+        guided_steps = 0
+        if guidance_scale > 1:
+            cutoff = 1.0 if guidance_cutoff is None else min(max(guidance_cutoff, 0.0), 1.0)
+            guided_steps = int(round(num_steps * cutoff))
+
+        with torch.inference_mode():
+            prompts = [prompt] if isinstance(prompt, str) else prompt
+            if guided_steps > start_step:
+                embeds = self._encode_prompt(pipeline, [""] + prompts)
+                uncond_embeds, cond_embeds = embeds[:1], embeds[1:]
+                guided_embeds = torch.cat([
+                    uncond_embeds.expand(batch_size, -1, -1),
+                    cond_embeds.expand(batch_size, -1, -1)
+                ])
+            else:
+                cond_embeds = self._encode_prompt(pipeline, prompts)
+            cond_embeds = cond_embeds.expand(batch_size, -1, -1)
+
+            scheduler = pipeline.scheduler
+            scheduler.set_timesteps(num_steps, device=self.device)
+            # PNDM runs its first step twice to warm up. A call leaves the
+            # latents at the next timestep's noise level, so a call whose
+            # next two timesteps repeat is only the first half of a step.
+            values = scheduler.timesteps.tolist()
+            warm_up = [
+                position + 2 < len(values) and values[position + 1] == values[position + 2]
+                for position in range(len(values))
+            ]
+            step_indices = []
+            for position in range(len(values)):
+                step_indices.append(position - sum(warm_up[:position]))
+            first = next(
+                (position for position, step in enumerate(step_indices) if step >= start_step),
+                len(step_indices)
+            )
+            timesteps = scheduler.timesteps[first:]
+            step_indices = step_indices[first:]
+            warm_up = warm_up[first:]
+
+            shape = (
+                1,
+                pipeline.unet.config.in_channels,
+                height // pipeline.vae_scale_factor,
+                width // pipeline.vae_scale_factor
+            )
+            noise = torch.cat([
+                torch.randn(shape, generator=generator, dtype=cond_embeds.dtype)
+                for generator in generators
+            ]).to(self.device)
+            if init_latents is None:
+                latents = noise * scheduler.init_noise_sigma
+            elif renoise:
+                latents = scheduler.add_noise(
+                    init_latents.expand(batch_size, -1, -1, -1),
+                    noise,
+                    timesteps[:1].repeat(batch_size)
+                )
+            else:
+                latents = init_latents.expand(batch_size, -1, -1, -1).clone()
+
+            step_kwargs = pipeline.prepare_extra_step_kwargs(
+                generators if batch_size > 1 else generators[0],
+                0.0
+            )
+
+            # Feature caching needs the torch modules; exported graphs run whole
+            if fast_mode and isinstance(self.backend, TorchBackend):
+                unet = DeepCacheUNet(pipeline.unet, cache_interval)
+            else:
+                unet = self.backend.unet
+
+            for position, t in enumerate(timesteps):
+                i = step_indices[position]
+                guided = i < guided_steps
+                model_input = torch.cat([latents] * 2) if guided else latents
+                model_input = scheduler.scale_model_input(model_input, t)
+                noise_pred = unet(
+                    model_input,
+                    t,
+                    encoder_hidden_states=guided_embeds if guided else cond_embeds
+                )
+
+                if guided:
+                    noise_uncond, noise_cond = noise_pred.chunk(2)
+                    noise_pred = noise_uncond + guidance_scale * (noise_cond - noise_uncond)
+
+                latents = scheduler.step(noise_pred, t, latents, **step_kwargs).prev_sample
+                if warm_up[position]:
+                    continue
+                if trajectory is not None:
+                    trajectory.append(latents)
+                callback(i, t, latents)
+
+        return latents
+
+    def resolve_decoder(self, decoder: Optional[str]) -> str:
+        """Validate a decoder name, falling back to full when TAESD is missing"""
+        decoder = decoder or "full"
+        if decoder not in DECODERS:
+            raise ValueError(f"Unsupported decoder: {decoder}")
+        if decoder == "tiny" and self.tiny_decoder is None:
+            self.logger.warning("Tiny decoder requested but no TAESD weights found; using full VAE")
+            return "full"
+        return decoder
+
+    def decode_latents(self, latents: torch.Tensor, decoder: str = "full") -> Image.Image:
+        """Turn final latents into an image with the chosen decoder"""
+        decoder = self.resolve_decoder(decoder)
+        vae_config = self.pipeline.vae.config
+        with torch.inference_mode():
+            if decoder == "tiny":
+                # TAESD works on unscaled latents
+                image = self.tiny_decoder.decode(latents).sample
+            elif decoder == "tiled":
+                image = tiled_decode(
+                    self.backend.decode,
+                    latents / vae_config.scaling_factor,
+                    scale=2 ** (len(vae_config.block_out_channels) - 1)
+                )
+            else:
+                image = self.backend.decode(latents / vae_config.scaling_factor)
+        return self.pipeline.image_processor.postprocess(image, output_type="pil")[0]
+
+    def redecode(self, generation_id: str, decoder: str = "full") -> Image.Image:
+        """Decode a previous generation's latents again, e.g. to upgrade a draft"""
+        return self.decode_latents(self._record(generation_id)["latents"], decoder)
+
+    def _record(self, generation_id: str) -> Dict[str, Any]:
+        record = self.latent_store.get(generation_id)
+        if record is None:
+            raise KeyError(generation_id)
+        return record
+
+    def _progress_callback(self, cancel_token: CancellationToken, num_steps: int, started: float):
+        last_step = [started]
+
+        def update_progress(step: int, timestep: int, latents: any):
+            # Raising here aborts the pipeline before the next UNet step
+            cancel_token.raise_if_cancelled()
+
+            now = time.perf_counter()
+            for listener in self.step_listeners:
+                listener(now - last_step[0])
+            last_step[0] = now
+
+            progress = int((step / num_steps) * 100)
+            generation_state.update_progress(
+                progress=progress,
+                message=f"Step {step} of {num_steps}"
+            )
+            self.logger.info(f"Progress: {progress}%")
+
+            if (
+                self.preview_every
+                and self.tiny_decoder is not None
+                and latents is not None
+                and step % self.preview_every == 0
+            ):
+                generation_state.set_preview(self.decode_latents(latents[:1], "tiny"))
+
+        return update_progress
+
+    def generate_images(
+        self,
+        prompt: Union[str, List[str]],
+        seeds: List[Optional[int]],
+        generation_ids: Optional[List[Optional[str]]] = None,
+        init_latents: Optional[torch.Tensor] = None,
+        start_step: int = 0,
+        renoise: bool = False,
+        **kwargs
+    ) -> List[Image.Image]:
+        """Run diffusion for one image per seed and return the decoded images
+
+        prompt may be a list with one prompt per seed, batching different
+        prompts that share the other settings into one run.
+        """
+        cancel_token: CancellationToken = kwargs.get('cancel_token') or CancellationToken()
+        num_steps = kwargs.get('num_steps', 20)
+        generation_ids = generation_ids or [None] * len(seeds)
+        prompts = [prompt] * len(seeds) if isinstance(prompt, str) else list(prompt)
+        if len(prompts) != len(seeds):
+            raise ValueError("One prompt per seed is required")
+        started = time.perf_counter()
         try:
-            self.logger.info(f"Generating icon with prompt: {prompt}")
+            self.logger.info(f"Generating {len(seeds)} icon(s) with prompt: {prompt}")
+            cancel_token.raise_if_cancelled()
             generation_state.reset()
+            update_progress = self._progress_callback(cancel_token, num_steps, started)
+
+            generators = [
+                torch.Generator(device=self.device).manual_seed(int(seed)) if seed is not None else None
+                for seed in seeds
+            ]
 
-            def update_progress(step: int, timestep: int, latents: any):
-                progress = int((step / kwargs.get('num_steps', 20)) * 100)
-                generation_state.update_progress(
-                    progress=progress,
-                    message=f"Step {step} of {kwargs.get('num_steps', 20)}"
+            # Generate the images
+            scheduler_name = kwargs.get('scheduler')
+            if init_latents is not None and not self._single_step(scheduler_name):
+                # Multistep schedulers would start mid-schedule with empty history
+                scheduler_name = "ddim"
+            pipeline = self._pipeline_for(scheduler_name)
+            full_prompts = [
+                f"{text}, minimalist professional app icon design, clean lines, simple shapes, flat design"
+                for text in prompts
+            ]
+            if isinstance(pipeline, StableDiffusionPipeline):
+                # Per-step latents cost num_steps times the final latents; opt-in
+                trajectory: Optional[List[torch.Tensor]] = [] if kwargs.get('keep_trajectory') else None
+                latents = self._denoise(
+                    pipeline,
+                    full_prompts[0] if len(set(full_prompts)) == 1 else full_prompts,
+                    num_steps=num_steps,
+                    guidance_scale=kwargs.get('guidance_scale', 7.5),
+                    guidance_cutoff=kwargs.get('guidance_cutoff'),
+                    fast_mode=kwargs.get('fast_mode', False),
+                    cache_interval=kwargs.get('cache_interval') or self.cache_interval,
+                    height=kwargs.get('height', self.resolution),
+                    width=kwargs.get('width', self.resolution),
+                    generators=generators,
+                    callback=update_progress,
+                    init_latents=init_latents,
+                    start_step=start_step,
+                    renoise=renoise,
+                    trajectory=trajectory
                 )
-                self.logger.info(f"Progress: {progress}%")
-
-            # Generate the image
-            output = self.pipeline(
-                prompt=f"{prompt}, minimalist professional app icon design, clean lines, simple shapes, flat design",
-                num_inference_steps=kwargs.get('num_steps', 20),
-                guidance_scale=kwargs.get('guidance_scale', 7.5),
-                height=512,
-                width=512,
-                callback=update_progress,
-                callback_steps=1
-            ).images[0]
-
-            # Convert to bytes
-            img_byte_arr = io.BytesIO()
-            output.save(img_byte_arr, format='PNG')
-            img_byte_arr.seek(0)
+
+                output = []
+                for index, (seed, generation_id) in enumerate(zip(seeds, generation_ids)):
+                    item = latents[index:index + 1]
+                    if generation_id:
+                        self.latent_store.put(generation_id, {
+                            "latents": item.clone(),
+                            # Latents after each step, for refinement from an intermediate step
+                            "trajectory": torch.stack([step[index] for step in trajectory]) if trajectory else None,
+                            "params": {
+                                "prompt": prompts[index],
+                                "seed": seed,
+                                "num_steps": num_steps,
+                                "first_step": start_step,
+                                "guidance_scale": kwargs.get('guidance_scale', 7.5),
+                                "guidance_cutoff": kwargs.get('guidance_cutoff'),
+                                "scheduler": scheduler_name,
+                                "height": kwargs.get('height', self.resolution),
+                                "width": kwargs.get('width', self.resolution)
+                            }
+                        })
+                    output.append(self.decode_latents(item, kwargs.get('decoder', 'full')))
+            else:
+                if init_latents is not None:
+                    raise ValueError("This pipeline cannot resume from stored latents")
+                output = [
+                    pipeline(
+                        prompt=full_prompt,
+                        num_inference_steps=num_steps,
+                        guidance_scale=kwargs.get('guidance_scale', 7.5),
+                        height=kwargs.get('height', self.resolution),
+                        width=kwargs.get('width', self.resolution),
+                        generator=generator,
+                        callback=update_progress,
+                        callback_steps=1
+                    ).images[0]
+                    for full_prompt, generator in zip(full_prompts, generators)
+                ]
 
             # Set final progress
             generation_state.update_progress(100, "Generation complete!")
 
-            return img_byte_arr.getvalue()
+            return output
 
+        except GenerationCancelled as e:
+            elapsed = time.perf_counter() - started
+            GENERATIONS_CANCELLED.labels(reason=e.reason).inc()
+            CANCELLED_COMPUTE_SECONDS.labels(reason=e.reason).inc(elapsed)
+            self.logger.info(f"Generation cancelled ({e.reason}) after {elapsed:.2f}s")
+            raise
         except Exception as e:
             self.logger.error(f"Error generating image: {str(e)}")
-            raise 
\ No newline at end of file
+            raise
+
+    def generate_image(self, prompt: str, **kwargs) -> Image.Image:
+        """Run diffusion and return the decoded image"""
+        generation_id = kwargs.pop('generation_id', None)
+        return self.generate_images(prompt, [kwargs.get('seed')], [generation_id], **kwargs)[0]
+
+    def _resume_kwargs(self, params: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
+        kwargs = {
+            key: params[key]
+            for key in ("num_steps", "guidance_scale", "guidance_cutoff", "scheduler", "height", "width")
+        }
+        kwargs.update({
+            key: value for key, value in overrides.items()
+            if value is not None and key != "prompt"
+        })
+        return kwargs
+
+    def generate_variations(
+        self,
+        generation_id: str,
+        count: int,
+        strength: float = 0.5,
+        seed: Optional[int] = None,
+        generation_ids: Optional[List[str]] = None,
+        **overrides
+    ) -> List[Image.Image]:
+        """Variations of a stored generation: re-noise its latents partway and denoise again
+
+        strength is the fraction of the schedule that is re-run, so the
+        cost is about strength times a full generation per variation.
+        """
+        record = self._record(generation_id)
+        kwargs = self._resume_kwargs(record["params"], overrides)
+        num_steps = kwargs["num_steps"]
+        start_step = min(num_steps - 1, int(round(num_steps * (1 - strength))))
+        seeds = [seed + i if seed is not None else None for i in range(count)]
+        return self.generate_images(
+            overrides.get('prompt') or record["params"]["prompt"],
+            seeds,
+            generation_ids,
+            init_latents=record["latents"],
+            start_step=start_step,
+            renoise=True,
+            **kwargs
+        )
+
+    def refine(
+        self,
+        generation_id: str,
+        from_step: Optional[int] = None,
+        strength: float = 0.3,
+        new_generation_id: Optional[str] = None,
+        **overrides
+    ) -> Image.Image:
+        """Denoise a stored generation further, optionally with more steps or a new prompt
+
+        With from_step the stored latents after that step are resumed on
+        the (possibly longer) new schedule; this needs a generation made
+        with keep_trajectory. Otherwise the final latents are lightly
+        re-noised by strength.
+        """
+        record = self._record(generation_id)
+        params = record["params"]
+        kwargs = self._resume_kwargs(params, overrides)
+        num_steps = kwargs["num_steps"]
+
+        if from_step is None:
+            init_latents = record["latents"]
+            start_step = min(num_steps - 1, int(round(num_steps * (1 - strength))))
+            renoise = True
+        else:
+            trajectory = record["trajectory"]
+            first_step = params["first_step"]
+            if trajectory is None:
+                raise ValueError("from_step needs a generation made with keep_trajectory")
+            if not first_step <= from_step < first_step + len(trajectory):
+                raise ValueError(f"from_step must be between {first_step} and {first_step + len(trajectory) - 1}")
+            init_latents = trajectory[from_step - first_step].unsqueeze(0)
+            # Latents after step k sit at the noise level where step k + 1 starts
+            start_step = int(round((from_step + 1) / params["num_steps"] * num_steps))
+            if start_step >= num_steps:
+                raise ValueError("Nothing left to refine after from_step")
+            renoise = False
+
+        return self.generate_images(
+            overrides.get('prompt') or params["prompt"],
+            [params["seed"]],
+            [new_generation_id],
+            init_latents=init_latents,
+            start_step=start_step,
+            renoise=renoise,
+            **kwargs
+        )[0]
+
+    def generate_icon(self, prompt: str, output_format: str = "png", **kwargs) -> bytes:
+        """Generate an icon and encode it on the calling thread"""
+        image = self.generate_image(prompt, **kwargs)
+        return self.encoder.encode(image, output_format)
+
+    def get_progress(self) -> dict:
+        """Progress of the running generation"""
+        return generation_state.get_progress()
+
+    def get_preview(self) -> Optional[Image.Image]:
+        """Latest tiny-decoder preview of the running generation"""
+        return generation_state.get_preview()
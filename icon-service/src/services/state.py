@@ -2,6 +2,7 @@
 class GenerationState:
     def __init__(self):
         self.progress = {"progress": 0, "message": "Not started"}
+        self.preview = None
 
     def update_progress(self, progress: int, message: str):
         self.progress["progress"] = progress
@@ -10,9 +11,30 @@ class GenerationState:
     def get_progress(self):
         return self.progress.copy()
 
+    def set_preview(self, image):
+        self.preview = image
+
+    def get_preview(self):
+        return self.preview
+
     def reset(self):
         self.progress["progress"] = 0
         self.progress["message"] = "Not started"
+        self.preview = None
+
+class TrainingStatus:
+    def __init__(self):
+        self.status = "idle"
+        self.progress = 0
+        self.error = None
+
+    def update(self, status, progress=None, error=None):
+        self.status = status
+        if progress is not None:
+            self.progress = progress
+        if error is not None:
+            self.error = error
 
-# Create a singleton instance
-generation_state = GenerationState() 
\ No newline at end of file
+# Create singleton instances
+generation_state = GenerationState()
+training_status = TrainingStatus() 
\ No newline at end of file
@@ -0,0 +1,52 @@
+import pytest
+
+pytest.importorskip("prometheus_client")
+
+from src.services.adaptive_quality import QualityController, QualityPlan
+
+def controller(step_s: float = 0.1, in_flight: int = 1, **kwargs) -> QualityController:
+    """A controller that has seen 20-step generations at step_s per step"""
+    quality = QualityController(p95_target_ms=2000, min_steps=10, fast_scheduler_steps=12, **kwargs)
+    for _ in range(5):
+        quality.finished(20 * step_s, QualityPlan("full", 20, quality.default_resolution))
+    for _ in range(in_flight):
+        quality.started()
+    return quality
+
+def test_full_quality_without_a_latency_target_or_samples():
+    assert QualityController().plan(30, allow_degrade=True).tier == "full"
+    assert QualityController(p95_target_ms=1).plan(30, allow_degrade=True).tier == "full"
+
+def test_full_quality_when_the_target_is_met():
+    plan = controller().plan(20, allow_degrade=True)
+    assert (plan.tier, plan.num_steps) == ("full", 20)
+
+def test_never_degrades_without_opt_in():
+    plan = controller(step_s=1.0).plan(50)
+    assert (plan.tier, plan.num_steps) == ("full", 50)
+
+def test_reduced_steps_fit_the_budget():
+    # 2 s budget at 0.1 s per step fits 20 of the 30 steps asked for
+    plan = controller().plan(30, allow_degrade=True)
+    assert (plan.tier, plan.num_steps) == ("reduced_steps", 20)
+
+def test_fast_scheduler_when_min_steps_do_not_fit():
+    # 0.15 s per step: min_steps (10) cost 1.5 s with 0.6 s of backlog ahead
+    plan = controller(step_s=0.15, in_flight=2).plan(30, allow_degrade=True)
+    assert plan.tier in ("fast_scheduler", "low_resolution")
+    assert plan.num_steps <= 12 and plan.scheduler == "dpm"
+
+def test_low_resolution_as_the_last_resort():
+    plan = controller(step_s=1.0).plan(30, allow_degrade=True)
+    assert (plan.tier, plan.resolution) == ("low_resolution", 384)
+
+def test_degraded_plans_never_exceed_the_requested_steps():
+    # Fewer steps asked for than min_steps: no tier may add steps
+    for step_s in (0.3, 1.0, 5.0):
+        plan = controller(step_s=step_s).plan(5, allow_degrade=True)
+        assert plan.num_steps <= 5
+
+def test_backlog_is_shared_by_the_workers():
+    # Two generations ahead at 2 s each miss the target on one worker, not on four
+    assert controller(step_s=0.1, in_flight=3).plan(10, allow_degrade=True).tier != "full"
+    assert controller(step_s=0.1, in_flight=3, workers=4).plan(10, allow_degrade=True).tier == "full"
@@ -0,0 +1,64 @@
+"""Range and conditional request parsing for GET /artifacts/{id}"""
+import pytest
+
+from src.services.artifacts import parse_range, etag_matches, iter_file_range
+
+SIZE = 1000
+ETAG = '"' + "a" * 64 + '"'
+
+def test_closed_range():
+    assert parse_range("bytes=0-99", SIZE) == (0, 99)
+
+def test_end_is_clamped_to_the_file():
+    assert parse_range("bytes=900-5000", SIZE) == (900, 999)
+
+def test_open_ended_range_runs_to_the_end():
+    assert parse_range("bytes=500-", SIZE) == (500, 999)
+
+def test_suffix_range_is_the_last_bytes():
+    assert parse_range("bytes=-100", SIZE) == (900, 999)
+    assert parse_range("bytes=-5000", SIZE) == (0, 999)
+
+@pytest.mark.parametrize("header", [
+    None,
+    "",
+    "items=0-10",
+    "bytes=",
+    "bytes=-",
+    "bytes=abc-10",
+    "bytes=10-abc",
+    "bytes=20-10"
+])
+def test_malformed_range_is_ignored(header):
+    assert parse_range(header, SIZE) is None
+
+def test_multi_range_falls_back_to_the_whole_file():
+    assert parse_range("bytes=0-9,20-29", SIZE) is None
+    assert parse_range("bytes=-10, 0-5", SIZE) is None
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=-0", "bytes=5000-6000"])
+def test_unsatisfiable_range_raises(header):
+    with pytest.raises(ValueError):
+        parse_range(header, SIZE)
+
+def test_if_none_match_star_and_lists():
+    assert etag_matches("*", ETAG)
+    assert etag_matches(ETAG, ETAG)
+    assert etag_matches(f'"other", {ETAG}', ETAG)
+    assert not etag_matches('"other"', ETAG)
+    assert not etag_matches(None, ETAG)
+
+def test_if_none_match_uses_weak_comparison():
+    assert etag_matches(f"W/{ETAG}", ETAG)
+    assert etag_matches(f'W/"other",W/{ETAG}', ETAG)
+
+def test_file_range_opens_the_file_before_reading(tmp_path):
+    path = tmp_path / "artifact.bin"
+    path.write_bytes(bytes(range(256)) * 4)
+
+    body = iter_file_range(path, 10, 19, chunk_size=4)
+    path.unlink()
+    assert b"".join(body) == bytes(range(10, 20))
+
+    with pytest.raises(FileNotFoundError):
+        iter_file_range(path, 0, 9)
@@ -0,0 +1,90 @@
+"""Parsing and grouping of /batch JSONL files"""
+import json
+import pytest
+
+from src.services.batch import parse_batch, plan_batches
+
+RESOLUTION = 64
+
+def negotiate(accept: str) -> str:
+    return {"image/webp": "webp", "image/png": "png"}[accept]
+
+def resolve_decoder(decoder: str) -> str:
+    if decoder not in ("full", "tiny"):
+        raise ValueError(f"Unknown decoder: {decoder}")
+    return decoder
+
+def parse(*entries, **kwargs):
+    lines = [entry if isinstance(entry, str) else json.dumps(entry) for entry in entries]
+    return parse_batch(lines, RESOLUTION, negotiate, resolve_decoder, **kwargs)
+
+def test_recorded_and_bare_lines_are_normalized_like_the_endpoint():
+    items, errors = parse(
+        {"endpoint": "/generate", "request_id": "r1", "params": {"prompt": "a cloud", "seed": 3, "num_steps": 80}},
+        {"prompt": "a tree", "accept": "image/webp", "guidance_scale": 40}
+    )
+    assert errors == []
+    assert [item.item_id for item in items] == ["r1-000000", "000001"]
+    assert items[0].params["seed"] == 3
+    assert items[0].params["num_steps"] == 50
+    assert items[0].params["height"] == items[0].params["width"] == RESOLUTION
+    assert items[1].params["guidance_scale"] == 20.0
+    assert items[1].output_format == "webp"
+    assert isinstance(items[1].params["seed"], int)
+
+def test_bad_lines_become_errors_without_failing_the_batch():
+    items, errors = parse(
+        "not json",
+        "[1, 2]",
+        {"endpoint": "/train", "params": {"prompt": "a cloud"}},
+        {"prompt": " "},
+        {"prompt": "a cloud", "decoder": "vqgan"},
+        "",
+        {"prompt": "a cloud"}
+    )
+    assert [error["index"] for error in errors] == [0, 1, 2, 3, 4]
+    assert all(error["status"] == "error" for error in errors)
+    # Blank lines are not counted
+    assert [item.index for item in items] == [5]
+
+def test_duplicate_request_ids_get_distinct_item_ids():
+    items, _ = parse(
+        {"request_id": "same", "params": {"prompt": "a cloud"}},
+        {"request_id": "same", "params": {"prompt": "a cloud"}},
+        # An id that looks like another line's index cannot collide with it
+        {"request_id": "000000", "params": {"prompt": "a tree"}},
+        {"request_id": "../escape", "params": {"prompt": "a tree"}}
+    )
+    ids = [item.item_id for item in items]
+    assert ids == ["same-000000", "same-000001", "000000-000002", "000003"]
+    assert len(set(ids)) == len(ids)
+    assert items[0].digest == items[1].digest
+
+def test_item_limit():
+    with pytest.raises(ValueError):
+        parse({"prompt": "a"}, {"prompt": "b"}, {"prompt": "c"}, max_items=2)
+
+def test_plan_groups_by_settings_in_first_seen_order():
+    items, _ = parse(
+        {"prompt": "a", "num_steps": 20},
+        {"prompt": "b", "num_steps": 30},
+        {"prompt": "c", "num_steps": 20},
+        {"prompt": "d", "num_steps": 20},
+        {"prompt": "e", "num_steps": 30},
+        {"prompt": "f", "num_steps": 20, "decoder": "tiny"}
+    )
+    batches = plan_batches(items, batch_size=2)
+    assert [[item.params["prompt"] for item in batch] for batch in batches] == [
+        ["a", "c"],
+        ["d"],
+        ["b", "e"],
+        ["f"]
+    ]
+
+def test_plan_keeps_duplicates_as_separate_items():
+    items, _ = parse(
+        {"request_id": "same", "prompt": "a cloud", "seed": 1},
+        {"request_id": "same", "prompt": "a cloud", "seed": 1}
+    )
+    batches = plan_batches(items, batch_size=4)
+    assert [[item.item_id for item in batch] for batch in batches] == [["same-000000", "same-000001"]]
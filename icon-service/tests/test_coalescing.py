@@ -0,0 +1,100 @@
+"""Sharing one computation between identical requests"""
+import asyncio
+import pytest
+
+pytest.importorskip("prometheus_client")
+
+from src.services.cancellation import CancellationToken, GenerationCancelled
+from src.services.coalescing import RequestCoalescer
+
+KEY = "same-request"
+
+class Compute:
+    """A computation that waits for release() and records its token"""
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.calls = 0
+        self.tokens = []
+        self.released = asyncio.Event()
+
+    async def __call__(self, token: CancellationToken):
+        self.calls += 1
+        self.tokens.append(token)
+        await self.released.wait()
+        if self.error is not None:
+            raise self.error
+        return "image"
+
+def test_identical_requests_share_one_computation():
+    async def run():
+        coalescer = RequestCoalescer()
+        compute = Compute()
+        requests = [asyncio.ensure_future(coalescer.run(KEY, compute)) for _ in range(3)]
+        await asyncio.sleep(0)
+        compute.released.set()
+        return compute, await asyncio.gather(*requests), coalescer
+
+    compute, results, coalescer = asyncio.run(run())
+    assert compute.calls == 1
+    assert results == ["image"] * 3
+    assert coalescer.inflight() == 0
+
+def test_leader_failure_reaches_every_follower_and_is_retried():
+    async def run():
+        coalescer = RequestCoalescer()
+        failing = Compute(RuntimeError("out of memory"))
+        requests = [asyncio.ensure_future(coalescer.run(KEY, failing)) for _ in range(3)]
+        await asyncio.sleep(0)
+        failing.released.set()
+        outcomes = await asyncio.gather(*requests, return_exceptions=True)
+
+        # The failed entry is cleared, so the next request computes again
+        retry = Compute()
+        retry.released.set()
+        return failing, outcomes, await coalescer.run(KEY, retry), retry
+
+    failing, outcomes, retried, retry = asyncio.run(run())
+    assert failing.calls == 1
+    assert all(isinstance(outcome, RuntimeError) for outcome in outcomes)
+    assert retried == "image"
+    assert retry.calls == 1
+
+def test_cancelled_follower_leaves_the_others_running():
+    async def run():
+        coalescer = RequestCoalescer()
+        compute = Compute()
+        leader = asyncio.ensure_future(coalescer.run(KEY, compute))
+        follower_token = CancellationToken()
+        follower = asyncio.ensure_future(coalescer.run(KEY, compute, follower_token))
+        await asyncio.sleep(0)
+
+        follower_token.cancel("disconnected")
+        with pytest.raises(GenerationCancelled) as cancelled:
+            await follower
+        assert cancelled.value.reason == "disconnected"
+        assert not compute.tokens[0].cancelled
+
+        compute.released.set()
+        return await leader
+
+    assert asyncio.run(run()) == "image"
+
+def test_computation_is_cancelled_with_the_reason_the_last_request_left():
+    async def run():
+        coalescer = RequestCoalescer()
+        compute = Compute()
+        tokens = [CancellationToken(), CancellationToken()]
+        requests = [asyncio.ensure_future(coalescer.run(KEY, compute, token)) for token in tokens]
+        await asyncio.sleep(0)
+
+        tokens[0].cancel("disconnected")
+        await asyncio.sleep(0)
+        assert not compute.tokens[0].cancelled
+        tokens[1].cancel("deadline")
+        await asyncio.gather(*requests, return_exceptions=True)
+        await asyncio.sleep(0)
+        return compute.tokens[0], coalescer
+
+    shared_token, coalescer = asyncio.run(run())
+    assert shared_token.reason == "deadline"
+    assert coalescer.inflight() == 0
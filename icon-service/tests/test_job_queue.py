@@ -0,0 +1,57 @@
+"""Reading jobs from the Redis streams, against a fake client"""
+import asyncio
+from collections import deque
+import pytest
+
+pytest.importorskip("prometheus_client")
+
+from src.services.job_queue import RedisJobQueue
+
+class FakeRedis:
+    """Streams are empty for the non-blocking reads; the blocking read returns `blocking`"""
+    def __init__(self, blocking):
+        self.blocking = blocking
+        self.claimed = []
+
+    async def xreadgroup(self, group, consumer, streams, count=None, block=None):
+        if block is None:
+            return []
+        response, self.blocking = self.blocking, []
+        return response
+
+    async def xclaim(self, stream, group, consumer, min_idle_time, message_ids, justid=False):
+        self.claimed.extend(message_ids)
+        return message_ids
+
+def make_queue(blocking) -> RedisJobQueue:
+    # Skips __init__, which needs the redis package
+    queue = RedisJobQueue.__new__(RedisJobQueue)
+    queue.redis = FakeRedis(blocking)
+    queue.prefix = "test"
+    queue.group = "test:workers"
+    queue.consumer = "worker"
+    queue.claim_idle_ms = 30
+    queue._tasks = []
+    queue._jobs = set()
+    queue._backlog = deque()
+    return queue
+
+def test_blocking_read_keeps_every_delivered_job():
+    async def run():
+        queue = make_queue([
+            ["test:jobs:bulk", [("2-0", {"id": "bulk-job"})]],
+            ["test:jobs:interactive", [("1-0", {"id": "interactive-job"})]]
+        ])
+        first = await queue._read_one()
+        # The second job is ours too; it is heartbeated while it waits for a slot
+        await asyncio.sleep(0.05)
+        second = await queue._read_one()
+        third = await queue._read_one()
+        return first, second, third, queue.redis.claimed, queue._backlog
+
+    first, second, third, claimed, backlog = asyncio.run(run())
+    assert first == ("test:jobs:interactive", "1-0", {"id": "interactive-job"})
+    assert second == ("test:jobs:bulk", "2-0", {"id": "bulk-job"})
+    assert third is None
+    assert "2-0" in claimed
+    assert not backlog
@@ -0,0 +1,79 @@
+"""Variations and refinement on the tiny PNDM pipeline"""
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("diffusers")
+
+from benchmarks.tiny_models import build_tiny_pipeline, tiny_resolution
+from src.services.stable_diffusion import StableDiffusionService
+
+NUM_STEPS = 10
+
+@pytest.fixture(scope="module")
+def service(tmp_path_factory):
+    work_dir = tmp_path_factory.mktemp("sd")
+    return StableDiffusionService(
+        models_dir=work_dir / "models",
+        cache_dir=work_dir / "cache",
+        pipeline=build_tiny_pipeline()
+    )
+
+@pytest.fixture
+def unet_calls(service, monkeypatch):
+    calls = []
+    unet = service.backend.unet
+
+    def counting(sample, timestep, encoder_hidden_states):
+        calls.append(int(timestep))
+        return unet(sample, timestep, encoder_hidden_states=encoder_hidden_states)
+
+    monkeypatch.setattr(service.backend, "unet", counting)
+    return calls
+
+def generate(service, generation_id, **kwargs):
+    resolution = tiny_resolution(service.pipeline)
+    return service.generate_image(
+        "a red circle",
+        seed=1,
+        num_steps=NUM_STEPS,
+        height=resolution,
+        width=resolution,
+        generation_id=generation_id,
+        **kwargs
+    )
+
+def test_pndm_trajectory_has_one_entry_per_step(service, unet_calls):
+    generate(service, "pndm", keep_trajectory=True)
+    record = service.latent_store.get("pndm")
+
+    # PNDM's warm-up makes one extra UNet call, but not an extra step
+    assert len(unet_calls) == NUM_STEPS + 1
+    assert record["trajectory"].shape[0] == NUM_STEPS
+    assert torch.equal(record["trajectory"][-1], record["latents"][0])
+
+def test_trajectory_is_opt_in(service):
+    generate(service, "no-trajectory")
+    assert service.latent_store.get("no-trajectory")["trajectory"] is None
+    with pytest.raises(ValueError, match="keep_trajectory"):
+        service.refine("no-trajectory", from_step=3)
+
+def test_variations_resume_on_a_single_step_scheduler(service, unet_calls):
+    generate(service, "source")
+    unet_calls.clear()
+    images = service.generate_variations("source", count=2, strength=0.5, seed=5)
+
+    assert len(images) == 2
+    # Half the schedule, one UNet call per step: no PNDM warm-up restarted mid-schedule
+    assert len(unet_calls) == NUM_STEPS // 2
+
+def test_refine_from_step(service, unet_calls):
+    generate(service, "refine-source", keep_trajectory=True)
+
+    unet_calls.clear()
+    service.refine("refine-source", from_step=NUM_STEPS - 2)
+    assert len(unet_calls) == 1
+
+    with pytest.raises(ValueError, match="Nothing left"):
+        service.refine("refine-source", from_step=NUM_STEPS - 1)
+    with pytest.raises(ValueError, match="between"):
+        service.refine("refine-source", from_step=NUM_STEPS)
@@ -0,0 +1,121 @@
+"""A queued /generate on one node followed by a decode of its latents"""
+import asyncio
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+pytest.importorskip("prometheus_client")
+Image = pytest.importorskip("PIL.Image")
+
+from fastapi.testclient import TestClient
+
+from src import main
+from src.services.artifacts import ArtifactStore
+from src.services.encoding import ImageEncoder
+
+API_PREFIX = "aaaaaaaa"
+WORKER_PREFIX = "bbbbbbbb"
+
+class FakeBackend:
+    name = "fake"
+
+class FakeModel:
+    """Keeps latents by generation id like StableDiffusionService"""
+    resolution = 64
+    embedding_dim = None
+    backend = FakeBackend()
+
+    def __init__(self):
+        self.latents = {}
+
+    def resolve_decoder(self, decoder: str) -> str:
+        return decoder
+
+    def generate_image(self, cancel_token=None, generation_id=None, **params):
+        image = Image.new("RGB", (params["width"], params["height"]), (200, 30, 30))
+        self.latents[generation_id] = image
+        return image
+
+    def redecode(self, generation_id: str, decoder: str = "full"):
+        return self.latents[generation_id]
+
+class InlineQueue:
+    """Runs each job at once on this node, standing in for a worker replica"""
+    def __init__(self):
+        self.payloads = []
+
+    async def start_api(self) -> None:
+        pass
+
+    async def run_worker(self, handler, concurrency: int = 1) -> None:
+        await asyncio.Event().wait()
+
+    async def submit(self, payload, priority="interactive", token=None):
+        self.payloads.append(payload)
+        return {"status": "done", "worker": "inline", **await main.run_queued_job(payload, token)}
+
+    async def close(self) -> None:
+        pass
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setenv("QUEUE_MODE", "redis")
+    monkeypatch.setenv("QUEUE_ROLE", "both")
+    monkeypatch.setenv("PRELOAD_MODEL", "0")
+    monkeypatch.delenv("GENERATION_PREFIX", raising=False)
+    monkeypatch.setitem(main.node_prefix, "value", "")
+
+    model = FakeModel()
+    queue = InlineQueue()
+    fakes = {
+        "sd": lambda: model,
+        "job_queue": lambda: queue,
+        "encoder": lambda: ImageEncoder(max_workers=1),
+        "artifacts": lambda: ArtifactStore(str(tmp_path / "artifacts")),
+        "semantic_cache": lambda: None,
+        "request_recorder": lambda: None,
+        "jwt_auth": lambda: None
+    }
+    originals = {name: main.services._factories[name] for name in [*fakes, "quality"]}
+    for name in originals:
+        main.services._instances.pop(name, None)
+    for name, factory in fakes.items():
+        main.services.register(name, factory)
+
+    with TestClient(main.create_app()) as test_client:
+        test_client.queue = queue
+        yield test_client
+
+    for name, factory in originals.items():
+        main.services._instances.pop(name, None)
+        main.services.register(name, factory)
+
+def test_queued_generation_is_decoded_where_it_ran(client):
+    # The gateway's health check tells the worker its own prefix
+    client.get("/health", headers={"X-Generation-Prefix": WORKER_PREFIX})
+
+    response = client.post(
+        "/generate",
+        data={"prompt": "a red square", "seed": "1"},
+        headers={"X-Generation-Prefix": API_PREFIX}
+    )
+    assert response.status_code == 200
+    generation_id = response.headers["X-Generation-Id"]
+
+    # Minted on the submitting node, then claimed by the node holding the latents
+    assert client.queue.payloads[0]["generation_id"].startswith(API_PREFIX)
+    assert generation_id.startswith(WORKER_PREFIX)
+    assert generation_id[8:] == client.queue.payloads[0]["generation_id"][8:]
+
+    decoded = client.post(f"/generate/{generation_id}/decode", data={"decoder": "full"})
+    assert decoded.status_code == 200
+    assert decoded.headers["X-Generation-Id"] == generation_id
+
+def test_queued_generation_keeps_the_minted_id_without_a_node_prefix(client):
+    response = client.post(
+        "/generate",
+        data={"prompt": "a red square", "seed": "2"},
+        headers={"X-Generation-Prefix": API_PREFIX}
+    )
+    assert response.status_code == 200
+    assert response.headers["X-Generation-Id"] == client.queue.payloads[0]["generation_id"]
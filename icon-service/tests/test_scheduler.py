@@ -0,0 +1,68 @@
+"""Deficit round robin ordering of the fair scheduler"""
+import asyncio
+import threading
+import pytest
+
+pytest.importorskip("prometheus_client")
+
+from src.services.scheduler import FairScheduler, parse_role_weights
+
+def run_order(jobs, quantum: float = 20.0):
+    """Names of jobs in the order they ran, all queued behind one blocking job
+
+    jobs are (name, tenant, weight, priority, cost) in submission order.
+    """
+    async def run():
+        scheduler = FairScheduler(max_concurrency=1, quantum=quantum)
+        gate = threading.Event()
+        order = []
+        blocker = asyncio.ensure_future(scheduler.submit(gate.wait, tenant="blocker"))
+        await asyncio.sleep(0)
+        queued = [
+            asyncio.ensure_future(scheduler.submit(
+                lambda name=name: order.append(name),
+                tenant=tenant,
+                weight=weight,
+                priority=priority,
+                cost=cost
+            ))
+            for name, tenant, weight, priority, cost in jobs
+        ]
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(blocker, *queued)
+        scheduler.shutdown()
+        return order
+
+    return asyncio.run(run())
+
+def test_tenants_take_turns():
+    jobs = [(f"a{i}", "a", 1.0, "interactive", 20) for i in range(3)]
+    jobs += [(f"b{i}", "b", 1.0, "interactive", 20) for i in range(3)]
+    assert run_order(jobs) == ["a0", "b0", "a1", "b1", "a2", "b2"]
+
+def test_weight_buys_more_jobs_per_round():
+    jobs = [(f"a{i}", "a", 2.0, "interactive", 20) for i in range(4)]
+    jobs += [(f"b{i}", "b", 1.0, "interactive", 20) for i in range(4)]
+    assert run_order(jobs) == ["a0", "a1", "b0", "a2", "a3", "b1", "b2", "b3"]
+
+def test_interactive_before_bulk():
+    jobs = [("bulk0", "a", 1.0, "bulk", 1), ("bulk1", "b", 1.0, "bulk", 1)]
+    jobs += [("interactive0", "c", 1.0, "interactive", 1)]
+    assert run_order(jobs) == ["interactive0", "bulk0", "bulk1"]
+
+def test_cost_above_the_quantum_waits_for_credit_without_starving():
+    # 50 steps need three quanta of 20; meanwhile the cheap tenant runs two jobs per round
+    jobs = [("big", "a", 1.0, "interactive", 50)]
+    jobs += [(f"small{i}", "b", 1.0, "interactive", 10) for i in range(8)]
+    order = run_order(jobs)
+    assert sorted(order) == sorted(name for name, *_ in jobs)
+    assert order.index("big") == 4
+
+def test_quantum_must_be_positive():
+    for quantum in (0, -5):
+        with pytest.raises(ValueError):
+            FairScheduler(quantum=quantum)
+
+def test_parse_role_weights():
+    assert parse_role_weights("admin=4, pro=2,bad,user=1") == {"admin": 4.0, "pro": 2.0, "user": 1.0}
@@ -0,0 +1,39 @@
+"""Lookups in the semantic prompt cache"""
+import pytest
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("prometheus_client")
+
+from src.services.semantic_cache import SemanticPromptCache
+
+DIM = 8
+
+def unit(*values):
+    vector = np.zeros(DIM, dtype=np.float32)
+    vector[:len(values)] = values
+    return vector / np.linalg.norm(vector)
+
+@pytest.fixture
+def cache(tmp_path):
+    return SemanticPromptCache(tmp_path, DIM, mode="return", threshold=0.9, capacity=64)
+
+def test_lookup_finds_a_match_behind_closer_entries_with_other_settings(cache):
+    image = Image.new("RGB", (4, 4))
+    # More exact matches under other settings than the lookup's k
+    for _ in range(10):
+        cache.add(unit(1.0), "a cloud", "other-settings", image)
+    wanted = cache.add(unit(1.0, 0.2), "a cloud icon", "these-settings", image)
+
+    matches = cache.lookup(unit(1.0), "these-settings", k=8)
+    assert [match["id"] for match in matches] == [wanted]
+
+def test_lookup_applies_the_threshold_and_orders_best_first(cache):
+    image = Image.new("RGB", (4, 4))
+    close = cache.add(unit(1.0, 0.1), "a cloud", "settings", image)
+    closer = cache.add(unit(1.0, 0.05), "a cloud", "settings", image)
+    cache.add(unit(0.0, 1.0), "a tree", "settings", image)
+
+    matches = cache.lookup(unit(1.0), "settings")
+    assert [match["id"] for match in matches] == [closer, close]
+    assert cache.lookup(unit(1.0), "unknown-settings") == []
@@ -1,8 +1,12 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional, List
+from concurrent.futures import Executor
+from typing import Dict, Any, Optional, List, Callable
+import asyncio
+import functools
+import gc
 import torch
+import torch.nn as nn
 import logging
-from ..models.base import BaseImageModel
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +23,8 @@ class BaseAdapter(ABC):
         self.model = None
         self.is_initialized = False
         self.config = kwargs
+        # Where blocking weight loads run; None means the loop's default pool
+        self.load_executor: Optional[Executor] = None
 
     @abstractmethod
     async def initialize(self) -> None:
@@ -43,10 +49,50 @@ class BaseAdapter(ABC):
     async def cleanup(self) -> None:
         """Clean up resources"""
         if self.model is not None:
-            del self.model
-            torch.cuda.empty_cache()
+            self.model = None
+            gc.collect()
+            if str(self.device).startswith("cuda") and torch.cuda.is_available():
+                torch.cuda.empty_cache()
         self.is_initialized = False
 
+    async def _run_blocking(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run blocking I/O such as weight loading on load_executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.load_executor, functools.partial(fn, *args))
+
+    def _load_weights(self, path: str) -> Any:
+        """Load weights; .safetensors files are memory-mapped, so reloads are cheap"""
+        if str(path).endswith(".safetensors"):
+            from safetensors.torch import load_file
+            state_dict = load_file(str(path), device=str(self.device))
+
+            # Rebuild the module when the adapter knows its architecture
+            model_factory = self.config.get("model_factory")
+            if model_factory is None:
+                return state_dict
+            model = model_factory()
+            model.load_state_dict(state_dict)
+            return model.to(self.device).eval()
+
+        return torch.load(path, map_location=self.device)
+
+    def parameter_bytes(self) -> int:
+        """Bytes held by loaded modules and state dicts"""
+        total = 0
+        seen = set()
+        for value in vars(self).values():
+            if isinstance(value, nn.Module):
+                tensors = list(value.parameters()) + list(value.buffers())
+            elif isinstance(value, dict):
+                tensors = [v for v in value.values() if isinstance(v, torch.Tensor)]
+            else:
+                continue
+            for tensor in tensors:
+                if id(tensor) not in seen:
+                    seen.add(id(tensor))
+                    total += tensor.numel() * tensor.element_size()
+        return total
+
     async def validate_input(self, input_data: Any) -> bool:
         """Validate input data"""
         return True
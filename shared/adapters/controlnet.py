@@ -1,4 +1,9 @@
-from typing import Dict, Any, Optional, Union
+from typing import Dict, Any, Optional, Union, List, Callable
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import hashlib
+import threading
 import torch
 import torch.nn as nn
 from PIL import Image
@@ -18,11 +23,30 @@ class ControlNetAdapter(BaseAdapter):
         self.control_type = control_type
         self.image_processor = ImageProcessor()
         self.preprocessors = {}
+        self.preprocessor_defaults = {}
+        self.depth_estimator = None
+        self._depth_lock = threading.Lock()
+
+        # Control signals keyed by image content hash + preprocessor params
+        self.signal_cache = OrderedDict()
+        self.cache_size = kwargs.get("control_cache_size", 64)
+        self._cache_lock = threading.Lock()
+
+        # Edge detection does not need full resolution
+        self.detect_resolution = kwargs.get("detect_resolution", 512)
+
+        # OpenCV releases the GIL, so threads give real parallelism
+        self.executor = ThreadPoolExecutor(
+            max_workers=kwargs.get("preprocess_workers", 4),
+            thread_name_prefix="controlnet-preprocess"
+        )
 
     async def initialize(self) -> None:
         """Initialize ControlNet model"""
         try:
-            self.model = torch.load(self.model_path, map_location=self.device)
+            self.model = await self._run_blocking(self._load_weights, self.model_path)
+            if self.control_type == "depth":
+                self.depth_estimator = await self._run_blocking(self._load_depth_estimator)
             self._initialize_preprocessors()
             self.is_initialized = True
             
@@ -33,19 +57,44 @@ class ControlNetAdapter(BaseAdapter):
         """Preprocess control image"""
         if not self.is_initialized:
             await self.initialize()
+
+        params = input_data.get("control_params", {})
+        loop = asyncio.get_running_loop()
+        control_images = input_data.get("control_images")
+        if control_images:
+            # Several control images: preprocess them concurrently
+            input_data["control_signals"] = await asyncio.gather(*(
+                loop.run_in_executor(
+                    self.executor,
+                    lambda image=image: self._generate_control_signal(image, **params)
+                )
+                for image in control_images
+            ))
+            return input_data
             
         control_image = input_data.get("control_image")
         if control_image is None:
             raise ValueError("Control image is required")
             
-        # Generate control signal
-        control_signal = self._generate_control_signal(control_image)
-        input_data["control_signal"] = control_signal
+        # Generate control signal off the event loop
+        input_data["control_signal"] = await loop.run_in_executor(
+            self.executor,
+            lambda: self._generate_control_signal(control_image, **params)
+        )
         
         return input_data
 
     async def process(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
         """Process control signal"""
+        control_signals = input_data.get("control_signals")
+        if control_signals:
+            return {
+                "conditioning": [
+                    self.model(signal, input_data.get("timestep", 0))
+                    for signal in control_signals
+                ]
+            }
+
         control_signal = input_data.get("control_signal")
         
         # Generate conditioning
@@ -60,7 +109,9 @@ class ControlNetAdapter(BaseAdapter):
         """Postprocess the conditioning"""
         conditioning = output_data.get("conditioning")
         
-        if conditioning is not None:
+        if isinstance(conditioning, list):
+            conditioning = [self._scale_conditioning(c) for c in conditioning]
+        elif conditioning is not None:
             # Apply any necessary scaling or processing
             conditioning = self._scale_conditioning(conditioning)
             
@@ -68,33 +119,142 @@ class ControlNetAdapter(BaseAdapter):
 
     def _initialize_preprocessors(self) -> None:
         """Initialize control signal preprocessors"""
-        if self.control_type == "canny":
-            from cv2 import Canny
-            self.preprocessors["canny"] = Canny
-        # Add other preprocessors as needed
+        self.register_preprocessor(
+            "canny",
+            self._canny,
+            low_threshold=self.config.get("low_threshold", 100),
+            high_threshold=self.config.get("high_threshold", 200)
+        )
+        self.register_preprocessor(
+            "lineart",
+            self._lineart,
+            block_size=self.config.get("lineart_block_size", 9),
+            offset=self.config.get("lineart_offset", 2)
+        )
+        if self.depth_estimator is not None:
+            self.register_preprocessor("depth", self._depth)
 
-    def _generate_control_signal(self, image: Image.Image) -> torch.Tensor:
-        """Generate control signal from image"""
-        # Convert image to numpy array
-        image_np = np.array(image)
-        
-        # Apply appropriate preprocessor
-        if self.control_type == "canny":
-            control_signal = self.preprocessors["canny"](
+    def _load_depth_estimator(self) -> Any:
+        """MiDaS depth estimation pipeline, the annotator ControlNet depth models are trained on"""
+        from transformers import pipeline
+        return pipeline(
+            "depth-estimation",
+            model=self.config.get("depth_model", "Intel/dpt-hybrid-midas"),
+            device=self.device
+        )
+
+    def register_preprocessor(
+        self,
+        name: str,
+        preprocessor: Callable[..., np.ndarray],
+        **defaults
+    ) -> None:
+        """Register a preprocessor mapping an RGB uint8 array to a control map"""
+        self.preprocessors[name] = preprocessor
+        self.preprocessor_defaults[name] = defaults
+
+    @staticmethod
+    def _canny(image_np: np.ndarray, low_threshold: int = 100, high_threshold: int = 200) -> np.ndarray:
+        """Canny edge map"""
+        from cv2 import Canny
+        return Canny(image_np, low_threshold, high_threshold)
+
+    @staticmethod
+    def _lineart(image_np: np.ndarray, block_size: int = 9, offset: int = 2) -> np.ndarray:
+        """Adaptive-threshold line drawing, white lines on black"""
+        import cv2
+        gray = cv2.cvtColor(image_np, cv2.COLOR_RGB2GRAY)
+        gray = cv2.GaussianBlur(gray, (3, 3), 0)
+        return cv2.adaptiveThreshold(
+            gray,
+            255,
+            cv2.ADAPTIVE_THRESH_MEAN_C,
+            cv2.THRESH_BINARY_INV,
+            block_size,
+            offset
+        )
+
+    def _depth(self, image_np: np.ndarray) -> np.ndarray:
+        """Relative depth map at the input size, near is bright"""
+        # One model instance: calls would contend for the same threads anyway
+        with self._depth_lock:
+            prediction = self.depth_estimator(Image.fromarray(image_np))
+        return np.asarray(prediction["depth"])
+
+    def _cache_key(self, image: Image.Image, params: Dict[str, Any]) -> str:
+        """Content hash of the image plus the preprocessor settings"""
+        digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+        digest.update(f"{image.mode}:{image.size}:{self.control_type}:{self.detect_resolution}".encode())
+        digest.update(repr(sorted(params.items())).encode())
+        return digest.hexdigest()
+
+    def _prepare_image(self, image: Image.Image) -> np.ndarray:
+        """RGB uint8 array downscaled to the detection resolution"""
+        image_np = np.asarray(image.convert("RGB"))
+        height, width = image_np.shape[:2]
+        scale = self.detect_resolution / max(height, width)
+        if scale < 1:
+            import cv2
+            image_np = cv2.resize(
                 image_np,
-                100,
-                200
+                (int(round(width * scale)), int(round(height * scale))),
+                interpolation=cv2.INTER_AREA
             )
-        else:
+        return image_np
+
+    def _generate_control_signal(self, image: Image.Image, **overrides) -> torch.Tensor:
+        """Generate control signal from image"""
+        if self.control_type not in self.preprocessors:
             raise ValueError(f"Unsupported control type: {self.control_type}")
-            
-        # Convert to tensor
-        control_signal = torch.tensor(
-            control_signal,
-            dtype=torch.float32
-        ).unsqueeze(0).unsqueeze(0)
-        
-        return control_signal.to(self.device)
+
+        params = {**self.preprocessor_defaults.get(self.control_type, {}), **overrides}
+        key = self._cache_key(image, params)
+        with self._cache_lock:
+            cached = self.signal_cache.get(key)
+            if cached is not None:
+                self.signal_cache.move_to_end(key)
+                return cached
+
+        # Apply appropriate preprocessor
+        control_map = self.preprocessors[self.control_type](
+            self._prepare_image(image),
+            **params
+        )
+
+        # Convert to tensor, sharing memory with the float32 array
+        control_signal = torch.from_numpy(
+            np.ascontiguousarray(control_map, dtype=np.float32)
+        )
+        if control_signal.ndim == 2:
+            control_signal = control_signal[None, None]
+        else:
+            control_signal = control_signal.permute(2, 0, 1).unsqueeze(0)
+        control_signal = control_signal.to(self.device)
+
+        with self._cache_lock:
+            self.signal_cache[key] = control_signal
+            while len(self.signal_cache) > self.cache_size:
+                self.signal_cache.popitem(last=False)
+
+        return control_signal
+
+    def generate_control_signals(self, images: List[Image.Image], **params) -> List[torch.Tensor]:
+        """Preprocess a batch of control images on the thread pool"""
+        return list(self.executor.map(
+            lambda image: self._generate_control_signal(image, **params),
+            images
+        ))
+
+    def clear_cache(self) -> None:
+        """Drop all cached control signals"""
+        with self._cache_lock:
+            self.signal_cache.clear()
+
+    async def cleanup(self) -> None:
+        """Clean up resources"""
+        self.clear_cache()
+        self.depth_estimator = None
+        await super().cleanup()
 
     def _scale_conditioning(self, conditioning: torch.Tensor) -> torch.Tensor:
         """Scale conditioning signal"""
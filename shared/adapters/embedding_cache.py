@@ -0,0 +1,180 @@
+from typing import Dict, Optional, Tuple
+from collections import OrderedDict
+from pathlib import Path
+import json
+import logging
+import os
+import threading
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """Content-hashed embedding cache: in-memory LRU over an on-disk memmap"""
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        capacity: int = 4096,
+        memory_items: int = 256,
+        dtype: str = "float32"
+    ):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.capacity = capacity
+        self.memory_items = memory_items
+        self.dtype = np.dtype(dtype)
+        self.memory: "OrderedDict[str, torch.Tensor]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Disk tier: one fixed-size .npy memmap plus a hash -> row index
+        self._memmap: Optional[np.memmap] = None
+        self._index: Dict[str, int] = {}
+        self._row_keys: Dict[int, str] = {}
+        self._next_row = 0
+        self._log_entries = 0
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self._open_existing()
+
+    @property
+    def _data_path(self) -> Path:
+        return self.cache_dir / "embeddings.npy"
+
+    @property
+    def _index_path(self) -> Path:
+        return self.cache_dir / "index.json"
+
+    @property
+    def _log_path(self) -> Path:
+        return self.cache_dir / "index.log"
+
+    def _open_existing(self) -> None:
+        """Reattach to a memmap written by a previous process"""
+        if not (self._data_path.exists() and self._index_path.exists()):
+            return
+        try:
+            self._memmap = np.load(self._data_path, mmap_mode="r+")
+            state = json.loads(self._index_path.read_text())
+            self._index = state["index"]
+            self._next_row = state["next_row"]
+            self._row_keys = {row: key for key, row in self._index.items()}
+            self.capacity = self._memmap.shape[0]
+            self._replay_log()
+        except Exception as e:
+            logger.warning(f"Discarding unreadable embedding cache: {str(e)}")
+            self._memmap = None
+            self._index = {}
+            self._row_keys = {}
+            self._next_row = 0
+            self._log_entries = 0
+
+    def _ensure_memmap(self, shape: Tuple[int, ...]) -> None:
+        """Create the memmap once the embedding shape is known"""
+        if self._memmap is not None and self._memmap.shape[1:] == shape:
+            return
+        if self._memmap is not None:
+            logger.warning("Embedding shape changed; resetting on-disk cache")
+        self._memmap = np.lib.format.open_memmap(
+            self._data_path,
+            mode="w+",
+            dtype=self.dtype,
+            shape=(self.capacity,) + shape
+        )
+        self._index = {}
+        self._row_keys = {}
+        self._next_row = 0
+        self._save_index()
+
+    def _replay_log(self) -> None:
+        """Apply row assignments appended since the last index snapshot"""
+        self._log_entries = 0
+        if not self._log_path.exists():
+            return
+        with self._log_path.open(encoding="utf-8") as log:
+            for line in log:
+                try:
+                    key, row = json.loads(line)
+                except ValueError:
+                    # Torn last line from a crash
+                    continue
+                self._assign(key, row)
+                self._next_row = (row + 1) % self.capacity
+                self._log_entries += 1
+
+    def _assign(self, key: str, row: int) -> None:
+        stale_key = self._row_keys.pop(row, None)
+        if stale_key is not None:
+            self._index.pop(stale_key, None)
+        self._index[key] = row
+        self._row_keys[row] = key
+
+    def _save_index(self) -> None:
+        """Snapshot the row index atomically and start a fresh log"""
+        tmp_path = self._index_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"index": self._index, "next_row": self._next_row}))
+        os.replace(tmp_path, self._index_path)
+        self._log_path.unlink(missing_ok=True)
+        self._log_entries = 0
+
+    def _log_assignment(self, key: str, row: int) -> None:
+        """Append one row assignment; compact into a snapshot once the log outgrows the cache"""
+        with self._log_path.open("a", encoding="utf-8") as log:
+            log.write(json.dumps([key, row]) + "\n")
+        self._log_entries += 1
+        if self._log_entries >= self.capacity:
+            self._save_index()
+
+    def _remember(self, key: str, embedding: torch.Tensor) -> None:
+        self.memory[key] = embedding
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[torch.Tensor]:
+        """Look up an embedding, promoting disk hits into memory"""
+        with self._lock:
+            embedding = self.memory.get(key)
+            if embedding is not None:
+                self.memory.move_to_end(key)
+                return embedding
+
+            row = self._index.get(key)
+            if row is None or self._memmap is None:
+                return None
+            embedding = torch.from_numpy(np.array(self._memmap[row], dtype=np.float32))
+            self._remember(key, embedding)
+            return embedding
+
+    def put(self, key: str, embedding: torch.Tensor) -> None:
+        """Store an embedding in memory and, if configured, on disk"""
+        self.put_many({key: embedding})
+
+    def put_many(self, embeddings: Dict[str, torch.Tensor]) -> None:
+        """Store a batch of embeddings, flushing the memmap once for all of them"""
+        # Own copies: a view would keep the whole encoder batch alive
+        embeddings = {key: embedding.detach().cpu().clone() for key, embedding in embeddings.items()}
+        with self._lock:
+            for key, embedding in embeddings.items():
+                self._remember(key, embedding)
+            if self.cache_dir is None or not embeddings:
+                return
+
+            new_rows = []
+            for key, embedding in embeddings.items():
+                self._ensure_memmap(tuple(embedding.shape))
+                if key not in self._index:
+                    # Ring buffer: reuse the oldest row once full
+                    row = self._next_row
+                    self._next_row = (self._next_row + 1) % self.capacity
+                    self._assign(key, row)
+                    new_rows.append(key)
+                self._memmap[self._index[key]] = embedding.numpy().astype(self.dtype, copy=False)
+            self._memmap.flush()
+            # Row data is flushed before the log points at it
+            for key in new_rows:
+                if key in self._index:
+                    self._log_assignment(key, self._index[key])
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(set(self.memory) | set(self._index))
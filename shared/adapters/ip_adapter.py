@@ -1,9 +1,14 @@
 from typing import Dict, Any, Optional, List
+import asyncio
+import functools
+import hashlib
+import threading
 import torch
 import torch.nn as nn
 from PIL import Image
 import numpy as np
 from .base_adapter import BaseAdapter
+from .embedding_cache import EmbeddingCache
 from ..utils.image_processing import ImageProcessor
 
 class IPAdapter(BaseAdapter):
@@ -18,17 +23,29 @@ class IPAdapter(BaseAdapter):
         self.image_encoder_path = image_encoder_path
         self.image_encoder = None
         self.image_processor = ImageProcessor()
+        self.image_size = kwargs.get("image_size", 224)
+
+        # Brand reference images repeat across requests; encode them once
+        self.embedding_cache = EmbeddingCache(
+            cache_dir=kwargs.get("embedding_cache_dir"),
+            capacity=kwargs.get("embedding_cache_capacity", 4096),
+            memory_items=kwargs.get("embedding_cache_memory_items", 256)
+        )
+
+        # Reusable (pinned when on CUDA) input batch for the image encoder
+        self._batch_buffer: Optional[torch.Tensor] = None
+        self._encode_lock = threading.Lock()
 
     async def initialize(self) -> None:
         """Initialize IP-Adapter and image encoder"""
         try:
             # Load IP-Adapter model
-            self.model = torch.load(self.model_path, map_location=self.device)
+            self.model = await self._run_blocking(self._load_weights, self.model_path)
             
             # Load image encoder
-            self.image_encoder = torch.load(
-                self.image_encoder_path,
-                map_location=self.device
+            self.image_encoder = await self._run_blocking(
+                functools.partial(torch.load, map_location=self.device),
+                self.image_encoder_path
             )
             
             self.is_initialized = True
@@ -40,15 +57,52 @@ class IPAdapter(BaseAdapter):
         """Preprocess images and prompts"""
         if not self.is_initialized:
             await self.initialize()
+
+        # Hashing and encoding block; keep them off the event loop
+        loop = asyncio.get_running_loop()
+        images = input_data.get("images")
+        if images:
+            input_data["image_embeddings"] = await loop.run_in_executor(None, self.preprocess_many, images)
             
         image = input_data.get("image")
         if image is not None:
-            # Convert to tensor and normalize
-            image_tensor = self._prepare_image(image)
-            input_data["image_embedding"] = self.image_encoder(image_tensor)
+            input_data["image_embedding"] = await loop.run_in_executor(None, self.preprocess_many, [image])
             
         return input_data
 
+    def preprocess_many(self, images: List[Image.Image]) -> torch.Tensor:
+        """Embed reference images, encoding all cache misses in one batch"""
+        keys = [self._image_key(image) for image in images]
+        embeddings: List[Optional[torch.Tensor]] = [self.embedding_cache.get(key) for key in keys]
+
+        # Deduplicate misses so repeated references are encoded once
+        missing: Dict[str, int] = {}
+        for index, (key, embedding) in enumerate(zip(keys, embeddings)):
+            if embedding is None and key not in missing:
+                missing[key] = index
+
+        if missing:
+            with self._encode_lock:
+                batch = self._input_batch(len(missing))
+                for slot, index in enumerate(missing.values()):
+                    self._prepare_image_into(images[index], batch[slot])
+
+                with torch.inference_mode():
+                    encoded = self.image_encoder(batch.to(self.device, non_blocking=True))
+                if encoded.is_cuda:
+                    # The pinned buffer is reused by the next call; let the copy finish first
+                    torch.cuda.synchronize(encoded.device)
+
+            self.embedding_cache.put_many({key: encoded[slot] for slot, key in enumerate(missing)})
+
+            fresh = {key: encoded[slot] for slot, key in enumerate(missing)}
+            embeddings = [
+                embedding if embedding is not None else fresh[key]
+                for key, embedding in zip(keys, embeddings)
+            ]
+
+        return torch.stack([embedding.to(self.device) for embedding in embeddings])
+
     async def process(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
         """Process the fusion of image and prompt"""
         image_embedding = input_data.get("image_embedding")
@@ -75,16 +129,41 @@ class IPAdapter(BaseAdapter):
             
         return {"fusion_weights": fusion_weights}
 
+    async def cleanup(self) -> None:
+        """Clean up resources"""
+        self.image_encoder = None
+        self._batch_buffer = None
+        await super().cleanup()
+
+    def _image_key(self, image: Image.Image) -> str:
+        """Content hash of a reference image for this encoder"""
+        digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+        digest.update(f"{image.mode}:{image.size}:{self.image_encoder_path}:{self.image_size}".encode())
+        return digest.hexdigest()
+
+    def _input_batch(self, size: int) -> torch.Tensor:
+        """Preallocated N x 3 x H x W encoder input, grown on demand"""
+        if self._batch_buffer is None or self._batch_buffer.shape[0] < size:
+            pin = str(self.device).startswith("cuda") and torch.cuda.is_available()
+            self._batch_buffer = torch.empty(
+                (size, 3, self.image_size, self.image_size),
+                dtype=torch.float32,
+                pin_memory=pin
+            )
+        return self._batch_buffer[:size]
+
+    def _prepare_image_into(self, image: Image.Image, out: torch.Tensor) -> None:
+        """Resize and normalize an image directly into a batch slot"""
+        image = self.image_processor.resize_image(image, (self.image_size, self.image_size))
+        pixels = torch.from_numpy(np.asarray(image)[..., :3])
+        out.copy_(pixels.permute(2, 0, 1))
+        out.div_(255.0)
+
     def _prepare_image(self, image: Image.Image) -> torch.Tensor:
         """Convert PIL image to tensor and preprocess"""
-        # Resize and normalize image
-        image = self.image_processor.resize_image(image, (224, 224))
-        image = np.array(image).transpose(2, 0, 1)
-        image = torch.tensor(image, dtype=torch.float32) / 255.0
-        
-        # Add batch dimension
-        image = image.unsqueeze(0).to(self.device)
-        return image
+        batch = torch.empty((1, 3, self.image_size, self.image_size), dtype=torch.float32)
+        self._prepare_image_into(image, batch[0])
+        return batch.to(self.device)
 
     def _normalize_weights(self, weights: torch.Tensor) -> torch.Tensor:
         """Normalize fusion weights"""
@@ -0,0 +1,175 @@
+from typing import Dict, Any, Optional, List, Callable, Iterable
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+from .base_adapter import BaseAdapter
+
+logger = logging.getLogger(__name__)
+
+class AdapterManager:
+    """Loads adapters on demand and unloads the least recently used ones
+
+    Each loaded adapter is charged its parameter bytes against a memory
+    budget. Loading past the budget evicts idle adapters in LRU order;
+    adapters in use (see ``use``) are never evicted.
+    """
+    def __init__(
+        self,
+        memory_budget_bytes: int = 2 * 1024 ** 3,
+        load_workers: int = 1
+    ):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.factories: Dict[str, Callable[[], BaseAdapter]] = {}
+        self.loaded: "OrderedDict[str, BaseAdapter]" = OrderedDict()
+        self.sizes: Dict[str, int] = {}
+        self.pins: Dict[str, int] = {}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "prefetches": 0}
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._lock: Optional[asyncio.Lock] = None
+
+        # Adapters load their weights (blocking torch I/O) on this pool
+        self.executor = ThreadPoolExecutor(
+            max_workers=load_workers,
+            thread_name_prefix="adapter-loader"
+        )
+
+    def register(self, name: str, factory: Callable[[], BaseAdapter]) -> None:
+        """Register how to construct an adapter"""
+        self.factories[name] = factory
+
+    @property
+    def loaded_bytes(self) -> int:
+        return sum(self.sizes.get(name, 0) for name in self.loaded)
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def get(self, name: str) -> BaseAdapter:
+        """Return a loaded adapter, loading it if necessary"""
+        adapter = self.loaded.get(name)
+        if adapter is not None and adapter.is_initialized:
+            self.loaded.move_to_end(name)
+            self.stats["hits"] += 1
+            return adapter
+
+        self.stats["misses"] += 1
+        if name not in self._loading:
+            self._loading[name] = asyncio.ensure_future(self._load(name))
+        return await asyncio.shield(self._loading[name])
+
+    @asynccontextmanager
+    async def use(self, name: str):
+        """Pin an adapter for the duration of a request"""
+        self.pins[name] = self.pins.get(name, 0) + 1
+        try:
+            yield await self.get(name)
+        finally:
+            self.pins[name] -= 1
+            if self.pins[name] == 0:
+                del self.pins[name]
+            async with self._get_lock():
+                await self._enforce_budget()
+
+    async def _load(self, name: str) -> BaseAdapter:
+        if name not in self.factories:
+            raise KeyError(f"Unknown adapter: {name}")
+        try:
+            # Make room up front when we already know this adapter's size
+            async with self._get_lock():
+                await self._enforce_budget(incoming=self.sizes.get(name, 0))
+
+            adapter = self.factories[name]()
+            adapter.load_executor = self.executor
+            await adapter.initialize()
+
+            async with self._get_lock():
+                self.loaded[name] = adapter
+                self.sizes[name] = adapter.parameter_bytes()
+                logger.info(
+                    f"Loaded adapter {name} ({self.sizes[name] / 1024 ** 2:.1f} MiB, "
+                    f"{self.loaded_bytes / 1024 ** 2:.1f} MiB in use)"
+                )
+                await self._enforce_budget(protect=name)
+            return adapter
+        finally:
+            self._loading.pop(name, None)
+
+    async def _enforce_budget(self, incoming: int = 0, protect: Optional[str] = None) -> None:
+        """Evict idle adapters, oldest first, until within budget"""
+        while self.loaded_bytes + incoming > self.memory_budget_bytes:
+            victim = next(
+                (name for name in self.loaded if name != protect and not self.pins.get(name)),
+                None
+            )
+            if victim is None:
+                logger.warning(
+                    f"Adapter memory {self.loaded_bytes / 1024 ** 2:.1f} MiB exceeds budget, "
+                    f"but every loaded adapter is in use"
+                )
+                return
+            await self.unload(victim)
+
+    async def unload(self, name: str) -> None:
+        """Unload one adapter; its size is remembered for later prefetch decisions"""
+        adapter = self.loaded.pop(name, None)
+        if adapter is None:
+            return
+        await adapter.cleanup()
+        self.stats["evictions"] += 1
+        logger.info(f"Unloaded adapter {name}")
+
+    @staticmethod
+    def predict(queued_requests: Iterable[Dict[str, Any]]) -> List[str]:
+        """Adapters the queued requests will need, most frequent first"""
+        counts: Dict[str, int] = {}
+        for request in queued_requests:
+            names = list(request.get("adapters", []))
+            for key in ("adapter_id", "style_id"):
+                if request.get(key):
+                    names.append(request[key])
+            for name in names:
+                counts[name] = counts.get(name, 0) + 1
+        return sorted(counts, key=lambda name: -counts[name])
+
+    def prefetch(self, queued_requests: Iterable[Dict[str, Any]]) -> List[str]:
+        """Start loading adapters predicted from the queue, if they fit"""
+        started = []
+        headroom = self.memory_budget_bytes - self.loaded_bytes
+        for name in self.predict(queued_requests):
+            if name not in self.factories or name in self.loaded or name in self._loading:
+                continue
+            size = self.sizes.get(name, 0)
+            if size > headroom:
+                # Prefetching must not evict adapters that are actually in use
+                continue
+            headroom -= size
+            self._loading[name] = asyncio.ensure_future(self._load(name))
+            self._loading[name].add_done_callback(lambda task, name=name: self._prefetched(name, task))
+            self.stats["prefetches"] += 1
+            started.append(name)
+        return started
+
+    @staticmethod
+    def _prefetched(name: str, task: asyncio.Future) -> None:
+        # Nobody may await a prefetch, so its failure is reported here
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Prefetching adapter {name} failed: {str(task.exception())}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Current residency and counters"""
+        return {
+            **self.stats,
+            "loaded": list(self.loaded),
+            "loaded_bytes": self.loaded_bytes,
+            "memory_budget_bytes": self.memory_budget_bytes
+        }
+
+    async def shutdown(self) -> None:
+        """Unload everything and stop the loader pool"""
+        for name in list(self.loaded):
+            await self.unload(name)
+        self.executor.shutdown(wait=False)
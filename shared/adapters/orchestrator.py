@@ -0,0 +1,212 @@
+from typing import Dict, Any, Optional, List, Callable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from .base_adapter import BaseAdapter
+
+logger = logging.getLogger(__name__)
+
+class Stage:
+    """One node of the adapter graph: a chain of adapter steps"""
+    def __init__(
+        self,
+        name: str,
+        adapter: BaseAdapter,
+        steps: Sequence[str] = ("preprocess", "process", "postprocess"),
+        deps: Sequence[str] = (),
+        build_input: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None
+    ):
+        self.name = name
+        self.adapter = adapter
+        self.steps = tuple(steps)
+        self.deps = tuple(deps)
+        self.build_input = build_input or (lambda results: {})
+
+class AdapterOrchestrator:
+    """Runs the adapters a request needs as a dependency graph
+
+    Text embeddings, image embeddings and the control signal are
+    independent and run concurrently; fusion waits for text and image.
+    Adapter coroutines do blocking torch/OpenCV work, so every stage
+    runs on a bounded executor instead of the event loop. Each stage
+    also has its own concurrency limit, so consecutive requests are
+    pipelined: one request's fusion overlaps the next one's encoding.
+    Each worker thread keeps one event loop for its whole life, so
+    adapters may create loop-bound objects or do async I/O.
+    """
+    def __init__(
+        self,
+        text_adapter: Optional[BaseAdapter] = None,
+        ip_adapter: Optional[BaseAdapter] = None,
+        control_adapter: Optional[BaseAdapter] = None,
+        max_workers: int = 4,
+        stage_concurrency: int = 1
+    ):
+        self.text_adapter = text_adapter
+        self.ip_adapter = ip_adapter
+        self.control_adapter = control_adapter
+        self.stage_concurrency = stage_concurrency
+        self._thread_state = threading.local()
+        self._loops: List[asyncio.AbstractEventLoop] = []
+        self._loops_guard = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="adapter-stage",
+            initializer=self._start_thread_loop
+        )
+        # Semaphores belong to the loop they were created on
+        self._stage_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._init_locks: Dict[int, threading.Lock] = {}
+        self._init_guard = threading.Lock()
+
+    def build_graph(self, request: Dict[str, Any]) -> Dict[str, Stage]:
+        """Select the stages a request needs and wire their inputs"""
+        graph: Dict[str, Stage] = {}
+
+        if self.text_adapter is not None and request.get("prompt"):
+            graph["text"] = Stage(
+                "text",
+                self.text_adapter,
+                build_input=lambda results: {
+                    "prompt": request["prompt"],
+                    "negative_prompt": request.get("negative_prompt", "")
+                }
+            )
+
+        if self.ip_adapter is not None and request.get("image") is not None:
+            graph["image"] = Stage(
+                "image",
+                self.ip_adapter,
+                steps=("preprocess",),
+                build_input=lambda results: {"image": request["image"]}
+            )
+
+        if self.control_adapter is not None and (request.get("control_image") is not None or request.get("control_images")):
+            graph["control"] = Stage(
+                "control",
+                self.control_adapter,
+                build_input=lambda results: {
+                    "control_image": request.get("control_image"),
+                    "control_images": request.get("control_images"),
+                    "control_params": request.get("control_params", {}),
+                    "timestep": request.get("timestep", 0)
+                }
+            )
+
+        if "text" in graph and "image" in graph:
+            graph["fusion"] = Stage(
+                "fusion",
+                self.ip_adapter,
+                steps=("process", "postprocess"),
+                deps=("text", "image"),
+                build_input=lambda results: {
+                    "image_embedding": results["image"]["image_embedding"],
+                    "text_embedding": results["text"]["embeddings"]
+                }
+            )
+
+        return graph
+
+    def _start_thread_loop(self) -> None:
+        """Give each worker thread its own long-lived event loop"""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._thread_state.loop = loop
+        with self._loops_guard:
+            self._loops.append(loop)
+
+    def _ensure_initialized(self, adapter: BaseAdapter) -> None:
+        """Initialize an adapter once even when stages race for it"""
+        if adapter.is_initialized:
+            return
+        with self._init_guard:
+            lock = self._init_locks.setdefault(id(adapter), threading.Lock())
+        with lock:
+            if not adapter.is_initialized:
+                self._thread_state.loop.run_until_complete(adapter.initialize())
+
+    def _run_blocking(self, stage: Stage, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Drive a stage's adapter coroutines to completion on a worker thread"""
+        self._ensure_initialized(stage.adapter)
+
+        async def chain():
+            output = data
+            for step in stage.steps:
+                output = await getattr(stage.adapter, step)(output)
+            return output
+
+        return self._thread_state.loop.run_until_complete(chain())
+
+    def _slot(self, name: str) -> asyncio.Semaphore:
+        """A stage's concurrency limit on the calling event loop"""
+        slots = self._stage_slots.setdefault(asyncio.get_running_loop(), {})
+        if name not in slots:
+            slots[name] = asyncio.Semaphore(self.stage_concurrency)
+        return slots[name]
+
+    async def run(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Run every stage a request needs, in parallel where possible"""
+        graph = self.build_graph(request)
+        loop = asyncio.get_running_loop()
+        results: Dict[str, Dict[str, Any]] = {}
+        timings: Dict[str, float] = {}
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_stage(stage: Stage) -> None:
+            if stage.deps:
+                await asyncio.gather(*(schedule(dep) for dep in stage.deps))
+            data = stage.build_input(results)
+            async with self._slot(stage.name):
+                start = time.perf_counter()
+                results[stage.name] = await loop.run_in_executor(
+                    self.executor,
+                    self._run_blocking,
+                    stage,
+                    data
+                )
+                timings[stage.name] = time.perf_counter() - start
+
+        def schedule(name: str) -> asyncio.Task:
+            if name not in tasks:
+                tasks[name] = asyncio.ensure_future(run_stage(graph[name]))
+            return tasks[name]
+
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*(schedule(name) for name in graph))
+        except Exception:
+            for task in tasks.values():
+                task.cancel()
+            raise
+
+        output: Dict[str, Any] = {
+            "stage_timings": timings,
+            "total_time": time.perf_counter() - start
+        }
+        if "text" in results:
+            output["embeddings"] = results["text"].get("embeddings")
+        if "image" in results:
+            output["image_embedding"] = results["image"].get("image_embedding")
+        if "fusion" in results:
+            output["fusion_weights"] = results["fusion"].get("fusion_weights")
+        if "control" in results:
+            output["conditioning"] = results["control"].get("conditioning")
+
+        return output
+
+    async def run_many(self, requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Run consecutive requests with their stages pipelined"""
+        return list(await asyncio.gather(*(self.run(request) for request in requests)))
+
+    def shutdown(self) -> None:
+        """Stop the stage executor and close the worker loops"""
+        self.executor.shutdown(wait=True)
+        with self._loops_guard:
+            for loop in self._loops:
+                loop.close()
+            self._loops.clear()
@@ -20,12 +20,10 @@ class T2IAdapter(BaseAdapter):
     async def initialize(self) -> None:
         """Initialize text encoder and tokenizer"""
         try:
-            self.model = CLIPTextModel.from_pretrained(
-                self.model_path
-            ).to(self.device)
-            self.tokenizer = CLIPTokenizer.from_pretrained(
-                self.tokenizer_path
+            self.model = await self._run_blocking(
+                lambda: CLIPTextModel.from_pretrained(self.model_path).to(self.device)
             )
+            self.tokenizer = await self._run_blocking(CLIPTokenizer.from_pretrained, self.tokenizer_path)
             self.is_initialized = True
             
         except Exception as e:
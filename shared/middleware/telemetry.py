@@ -1,10 +1,8 @@
 from typing import Optional, Dict, Any
 import time
 import logging
-import psutil
 from datetime import datetime
 from prometheus_client import Counter, Histogram, Gauge
-import opentelemetry.trace as trace
 from functools import wraps
 
 logger = logging.getLogger(__name__)
@@ -38,10 +36,20 @@ class TelemetryMiddleware:
         self.service_name = service_name
         self.enable_tracing = enable_tracing
         self.enable_metrics = enable_metrics
-        self.tracer = trace.get_tracer(__name__)
+        self._tracer = None
+
+    @property
+    def tracer(self):
+        # OpenTelemetry is only imported once tracing is actually used
+        if self._tracer is None:
+            import opentelemetry.trace as trace
+            self._tracer = trace.get_tracer(__name__)
+        return self._tracer
 
     async def collect_metrics(self) -> Dict[str, Any]:
         """Collect system metrics"""
+        import psutil
+
         metrics = {
             "timestamp": datetime.utcnow().isoformat(),
             "cpu": {
@@ -1,11 +1,88 @@
 from PIL import Image
 import numpy as np
-from typing import Tuple, Optional
+from typing import Tuple, Optional, Union, List
+from collections import OrderedDict
+import hashlib
 import io
 import logging
+import sys
+import threading
 
 logger = logging.getLogger(__name__)
 
+ArrayLike = Union[np.ndarray, "torch.Tensor"]
+
+# Resampling kernels matching PIL's filters: (support, kernel)
+def _bicubic(x: np.ndarray, a: float = -0.5) -> np.ndarray:
+    x = np.abs(x)
+    return np.where(
+        x < 1,
+        ((a + 2) * x - (a + 3)) * x * x + 1,
+        np.where(x < 2, (((x - 5) * x + 8) * x - 4) * a, 0.0)
+    )
+
+def _lanczos(x: np.ndarray) -> np.ndarray:
+    return np.where(np.abs(x) < 3, np.sinc(x) * np.sinc(x / 3), 0.0)
+
+RESAMPLE_KERNELS = {
+    "bilinear": (1.0, lambda x: np.maximum(0.0, 1.0 - np.abs(x))),
+    "bicubic": (2.0, _bicubic),
+    "lanczos": (3.0, _lanczos),
+}
+
+# Prepared watermarks keyed by content and target width
+_WATERMARK_CACHE: "OrderedDict[tuple, Image.Image]" = OrderedDict()
+_WATERMARK_CACHE_SIZE = 32
+_WATERMARK_LOCK = threading.Lock()
+
+def _resample_matrix(in_size: int, out_size: int, method: str) -> np.ndarray:
+    """Dense (out_size x in_size) resampling weights, PIL-style antialiased"""
+    support, kernel = RESAMPLE_KERNELS[method]
+    scale = in_size / out_size
+    filter_scale = max(scale, 1.0)
+    support = support * filter_scale
+
+    centers = (np.arange(out_size) + 0.5) * scale
+    positions = np.arange(in_size) + 0.5
+    weights = kernel((positions[None, :] - centers[:, None]) / filter_scale)
+    weights[np.abs(positions[None, :] - centers[:, None]) >= support] = 0.0
+    weights /= weights.sum(axis=1, keepdims=True)
+    return weights.astype(np.float32)
+
+def _as_numpy(images: ArrayLike) -> Tuple[np.ndarray, bool]:
+    """View a stacked batch as NumPy; CPU tensors are shared, not copied"""
+    # A tensor means torch is already loaded; never import it just to check
+    torch = sys.modules.get("torch")
+    if torch is not None and isinstance(images, torch.Tensor):
+        return images.detach().cpu().numpy(), True
+    return np.asarray(images), False
+
+def _from_numpy(array: np.ndarray, is_torch: bool) -> ArrayLike:
+    if not is_torch:
+        return array
+    import torch
+    return torch.from_numpy(array)
+
+def _letterbox_size(size: Tuple[int, int], target_size: Tuple[int, int]) -> Tuple[int, int]:
+    """Largest size with the source aspect ratio that fits the target"""
+    aspect_ratio = size[0] / size[1]
+    target_aspect = target_size[0] / target_size[1]
+
+    if aspect_ratio > target_aspect:
+        new_width = target_size[0]
+        new_height = int(new_width / aspect_ratio)
+    else:
+        new_height = target_size[1]
+        new_width = int(new_height * aspect_ratio)
+    return new_width, new_height
+
+def _watermark_position(image_size: Tuple[int, int], watermark_size: Tuple[int, int], position: str) -> Tuple[int, int]:
+    if position == "bottom-right":
+        return image_size[0] - watermark_size[0] - 10, image_size[1] - watermark_size[1] - 10
+    if position == "bottom-left":
+        return 10, image_size[1] - watermark_size[1] - 10
+    raise ValueError(f"Unsupported position: {position}")
+
 class ImageProcessor:
     @staticmethod
     def resize_image(
@@ -17,15 +94,7 @@ class ImageProcessor:
         if method not in ["lanczos", "bilinear", "bicubic", "nearest"]:
             raise ValueError(f"Unsupported resize method: {method}")
             
-        aspect_ratio = image.size[0] / image.size[1]
-        target_aspect = target_size[0] / target_size[1]
-
-        if aspect_ratio > target_aspect:
-            new_width = target_size[0]
-            new_height = int(new_width / aspect_ratio)
-        else:
-            new_height = target_size[1]
-            new_width = int(new_height * aspect_ratio)
+        new_width, new_height = _letterbox_size(image.size, target_size)
 
         resized = image.resize((new_width, new_height), getattr(Image.Resampling, method.upper()))
         
@@ -41,14 +110,27 @@ class ImageProcessor:
     def convert_format(
         image: Image.Image,
         format: str,
-        quality: int = 95
+        quality: int = 95,
+        compress_level: int = 6,
+        lossless: bool = False
     ) -> bytes:
         """Convert image to specified format"""
-        if format.lower() not in ["png", "jpeg", "webp"]:
+        format = format.lower()
+        if format not in ["png", "jpeg", "webp"]:
             raise ValueError(f"Unsupported format: {format}")
-            
+
+        # Each encoder takes different options; PNG ignores quality
+        if format == "png":
+            save_kwargs = {"compress_level": compress_level, "optimize": image.mode == "P"}
+        elif format == "jpeg":
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            save_kwargs = {"quality": quality, "optimize": True}
+        else:
+            save_kwargs = {"lossless": True} if lossless else {"quality": quality}
+
         buffer = io.BytesIO()
-        image.save(buffer, format=format, quality=quality)
+        image.save(buffer, format=format, **save_kwargs)
         return buffer.getvalue()
 
     @staticmethod
@@ -62,32 +144,51 @@ class ImageProcessor:
         if opacity < 0 or opacity > 1:
             raise ValueError("Opacity must be between 0 and 1")
 
+        watermark = ImageProcessor.prepare_watermark(watermark, image.size[0], opacity)
+        x, y = _watermark_position(image.size, watermark.size, position)
+
+        # Paste watermark
+        result = image.copy()
+        result.paste(watermark, (x, y), watermark)
+        return result
+
+    @staticmethod
+    def prepare_watermark(
+        watermark: Image.Image,
+        image_width: int,
+        opacity: float = 0.5
+    ) -> Image.Image:
+        """Resize and alpha-convert a watermark once per target width"""
+        key = (
+            hashlib.sha1(watermark.tobytes()).hexdigest(),
+            watermark.mode,
+            watermark.size,
+            image_width,
+            opacity
+        )
+        with _WATERMARK_LOCK:
+            prepared = _WATERMARK_CACHE.get(key)
+            if prepared is not None:
+                _WATERMARK_CACHE.move_to_end(key)
+                return prepared
+
         # Resize watermark to reasonable size relative to main image
-        max_watermark_width = image.size[0] // 4
+        max_watermark_width = image_width // 4
         watermark_aspect = watermark.size[0] / watermark.size[1]
-        watermark = watermark.resize(
+        prepared = watermark.resize(
             (max_watermark_width, int(max_watermark_width / watermark_aspect)),
             Image.Resampling.LANCZOS
         )
 
         # Create transparent version of watermark
-        watermark = watermark.convert("RGBA")
-        watermark.putalpha(int(255 * opacity))
-
-        # Calculate position
-        if position == "bottom-right":
-            x = image.size[0] - watermark.size[0] - 10
-            y = image.size[1] - watermark.size[1] - 10
-        elif position == "bottom-left":
-            x = 10
-            y = image.size[1] - watermark.size[1] - 10
-        else:
-            raise ValueError(f"Unsupported position: {position}")
+        prepared = prepared.convert("RGBA")
+        prepared.putalpha(int(255 * opacity))
 
-        # Paste watermark
-        result = image.copy()
-        result.paste(watermark, (x, y), watermark)
-        return result
+        with _WATERMARK_LOCK:
+            _WATERMARK_CACHE[key] = prepared
+            while len(_WATERMARK_CACHE) > _WATERMARK_CACHE_SIZE:
+                _WATERMARK_CACHE.popitem(last=False)
+        return prepared
 
     @staticmethod
     def validate_image(
@@ -114,4 +215,132 @@ class ImageProcessor:
             
         except Exception as e:
             logger.error(f"Image validation error: {str(e)}")
-            return False 
\ No newline at end of file
+            return False 
+
+    @staticmethod
+    def resize_batch(
+        images: ArrayLike,
+        target_size: Tuple[int, int],
+        method: str = "lanczos",
+        out: Optional[ArrayLike] = None,
+        fill: int = 0
+    ) -> ArrayLike:
+        """Letterbox-resize a stacked N x H x W x C batch in one pass
+
+        Same geometry and filters as resize_image. The output keeps the
+        input channels and pads with ``fill``; pass ``out`` to reuse a
+        preallocated N x target_h x target_w x C buffer.
+        """
+        if method not in ["lanczos", "bilinear", "bicubic", "nearest"]:
+            raise ValueError(f"Unsupported resize method: {method}")
+
+        batch, is_torch = _as_numpy(images)
+        if batch.ndim != 4:
+            raise ValueError("Expected a N x H x W x C batch")
+        n, height, width, channels = batch.shape
+        target_width, target_height = target_size
+        new_width, new_height = _letterbox_size((width, height), target_size)
+
+        if out is None:
+            result = np.full((n, target_height, target_width, channels), fill, dtype=batch.dtype)
+        else:
+            result, _ = _as_numpy(out)
+            if result.shape != (n, target_height, target_width, channels):
+                raise ValueError(f"Output buffer has shape {result.shape}")
+            result.fill(fill)
+
+        if method == "nearest":
+            rows = np.minimum(((np.arange(new_height) + 0.5) * height / new_height).astype(np.intp), height - 1)
+            cols = np.minimum(((np.arange(new_width) + 0.5) * width / new_width).astype(np.intp), width - 1)
+            resized = batch[:, rows][:, :, cols]
+        else:
+            # Separable resampling as two batched matrix products
+            row_weights = _resample_matrix(height, new_height, method)
+            col_weights = _resample_matrix(width, new_width, method)
+            resized = np.matmul(row_weights, batch.reshape(n, height, width * channels).astype(np.float32))
+            resized = resized.reshape(n, new_height, width, channels).transpose(0, 1, 3, 2)
+            resized = np.matmul(resized, col_weights.T).transpose(0, 1, 3, 2)
+            if np.issubdtype(result.dtype, np.integer):
+                info = np.iinfo(result.dtype)
+                resized = np.clip(np.rint(resized), info.min, info.max)
+
+        paste_x = (target_width - new_width) // 2
+        paste_y = (target_height - new_height) // 2
+        result[:, paste_y:paste_y + new_height, paste_x:paste_x + new_width] = resized
+
+        return out if out is not None else _from_numpy(result, is_torch)
+
+    @staticmethod
+    def apply_watermark_batch(
+        images: ArrayLike,
+        watermark: Image.Image,
+        opacity: float = 0.5,
+        position: str = "bottom-right",
+        inplace: bool = False
+    ) -> ArrayLike:
+        """Composite a watermark onto a stacked N x H x W x C batch"""
+        if opacity < 0 or opacity > 1:
+            raise ValueError("Opacity must be between 0 and 1")
+
+        batch, is_torch = _as_numpy(images)
+        if batch.ndim != 4 or batch.shape[-1] not in (3, 4):
+            raise ValueError("Expected a N x H x W x 3 or N x H x W x 4 batch")
+        _, height, width, channels = batch.shape
+
+        prepared = ImageProcessor.prepare_watermark(watermark, width, opacity)
+        x, y = _watermark_position((width, height), prepared.size, position)
+
+        # Clip the watermark to the image like PIL's paste does
+        mark = np.asarray(prepared, dtype=np.float32)
+        top, left = max(y, 0), max(x, 0)
+        bottom, right = min(y + mark.shape[0], height), min(x + mark.shape[1], width)
+        if bottom <= top or right <= left:
+            return images if inplace else _from_numpy(batch.copy(), is_torch)
+        mark = mark[top - y:bottom - y, left - x:right - x, :channels]
+
+        result = batch if inplace else batch.copy()
+        alpha = int(255 * opacity) / 255.0
+        region = result[:, top:bottom, left:right, :]
+        blended = region.astype(np.float32) * (1.0 - alpha) + mark * alpha
+        if np.issubdtype(result.dtype, np.integer):
+            blended = np.rint(blended)
+        region[...] = blended
+
+        return images if inplace else _from_numpy(result, is_torch)
+
+    @staticmethod
+    def validate_batch(
+        images: Union[ArrayLike, List[Union[Image.Image, np.ndarray]]],
+        min_size: Tuple[int, int] = (32, 32),
+        max_size: Tuple[int, int] = (4096, 4096)
+    ) -> np.ndarray:
+        """Validate many images at once, returning a boolean mask"""
+        if isinstance(images, list):
+            if not images:
+                return np.zeros(0, dtype=bool)
+            sizes = np.array([
+                image.size if isinstance(image, Image.Image) else (np.shape(image)[1], np.shape(image)[0])
+                for image in images
+            ])
+            finite = np.ones(len(images), dtype=bool)
+        else:
+            batch, _ = _as_numpy(images)
+            if batch.ndim != 4:
+                raise ValueError("Expected a N x H x W x C batch")
+            sizes = np.tile([batch.shape[2], batch.shape[1]], (batch.shape[0], 1))
+            if np.issubdtype(batch.dtype, np.floating):
+                finite = np.isfinite(batch).reshape(batch.shape[0], -1).all(axis=1)
+            else:
+                finite = np.ones(batch.shape[0], dtype=bool)
+
+        too_small = (sizes < np.array(min_size)).any(axis=1)
+        too_large = (sizes > np.array(max_size)).any(axis=1)
+        valid = ~too_small & ~too_large & finite
+
+        if not valid.all():
+            logger.error(
+                f"{int((~valid).sum())} of {len(valid)} images failed validation "
+                f"(too small: {int(too_small.sum())}, too large: {int(too_large.sum())}, "
+                f"non-finite: {int((~finite).sum())})"
+            )
+        return valid
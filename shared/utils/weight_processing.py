@@ -1,5 +1,5 @@
 import numpy as np
-from typing import List, Dict, Union, Optional
+from typing import List, Dict, Union, Optional, Iterator
 import logging
 
 logger = logging.getLogger(__name__)
@@ -44,17 +44,84 @@ class WeightProcessor:
     def calculate_attention(
         query: np.ndarray,
         key: np.ndarray,
-        temperature: float = 1.0
+        temperature: float = 1.0,
+        out: Optional[np.ndarray] = None
     ) -> np.ndarray:
-        """Calculate attention weights between query and key"""
-        # Compute similarity scores
-        similarity = np.dot(query, key.T) / temperature
-        
-        # Apply softmax
-        exp_sim = np.exp(similarity - similarity.max())
-        attention = exp_sim / exp_sim.sum()
-        
-        return attention
+        """Calculate attention weights between query and key
+
+        Accepts (Q x D) / (K x D) or batched (B x Q x D) / (B x K x D)
+        inputs and returns (.. x Q x K) weights, softmax-normalized per
+        query row. float32 inputs stay float32; ``out`` may be a
+        preallocated result buffer of the right shape and dtype.
+        """
+        query = np.asarray(query)
+        key = np.asarray(key)
+        dtype = np.result_type(query.dtype, key.dtype, np.float32)
+
+        # Compute similarity scores straight into the output buffer
+        key_t = np.swapaxes(key, -1, -2)
+        if out is None:
+            out = np.matmul(query, key_t).astype(dtype, copy=False)
+        else:
+            np.matmul(query, key_t, out=out)
+        if temperature != 1.0:
+            out *= 1.0 / temperature
+
+        # Numerically stable softmax over each query row, in place
+        out -= out.max(axis=-1, keepdims=True)
+        np.exp(out, out=out)
+        out /= out.sum(axis=-1, keepdims=True)
+
+        return out
+
+    @staticmethod
+    def iter_interpolated_weights(
+        start_weights: np.ndarray,
+        end_weights: np.ndarray,
+        steps: int,
+        out: Optional[np.ndarray] = None
+    ) -> Iterator[np.ndarray]:
+        """Lazily yield interpolated weights, reusing one buffer
+
+        Each yielded array is only valid until the next iteration; copy
+        it if it needs to outlive the loop.
+        """
+        if start_weights.shape != end_weights.shape:
+            raise ValueError("Weight arrays must have same shape")
+        if steps < 2:
+            yield start_weights
+            return
+
+        delta = end_weights - start_weights
+        if out is None:
+            out = np.empty_like(delta, dtype=np.result_type(delta.dtype, np.float32))
+        for alpha in np.linspace(0, 1, steps):
+            np.multiply(delta, alpha, out=out)
+            out += start_weights
+            yield out
+
+    @staticmethod
+    def interpolate_weights_array(
+        start_weights: np.ndarray,
+        end_weights: np.ndarray,
+        steps: int,
+        out: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """All interpolation steps as one (steps x ...) array"""
+        if start_weights.shape != end_weights.shape:
+            raise ValueError("Weight arrays must have same shape")
+        steps = max(steps, 1)
+
+        alphas = np.linspace(0, 1, steps) if steps > 1 else np.zeros(1)
+        alphas = alphas.astype(np.result_type(start_weights.dtype, np.float32), copy=False)
+        alphas = alphas.reshape((steps,) + (1,) * start_weights.ndim)
+
+        delta = end_weights - start_weights
+        if out is None:
+            out = np.empty((steps,) + start_weights.shape, dtype=alphas.dtype)
+        np.multiply(alphas, delta, out=out)
+        out += start_weights
+        return out
 
     @staticmethod
     def interpolate_weights(
@@ -65,9 +132,10 @@ class WeightProcessor:
         """Generate interpolated weight sequences"""
         if steps < 2:
             return [start_weights]
-            
-        alphas = np.linspace(0, 1, steps)
-        return [
-            WeightProcessor.blend_weights(start_weights, end_weights, alpha)
-            for alpha in alphas
-        ] 
\ No newline at end of file
+
+        # Views into a single allocation rather than one copy per step
+        return list(WeightProcessor.interpolate_weights_array(
+            start_weights,
+            end_weights,
+            steps
+        ))